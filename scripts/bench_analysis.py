@@ -0,0 +1,155 @@
+"""Benchmark the booking summary: per-row Python loop vs. pandas vs. rollup.
+
+Usage: python scripts/bench_analysis.py [--bookings 100000] [--repeat 3]
+
+Builds a throwaway database in a temporary directory, so it never touches the
+configured site database.
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from site_coordination import analysis, db, migrations, rollups, timeslots  # noqa: E402
+
+
+def _legacy_booking_summary(connection: sqlite3.Connection) -> dict:
+    """The original ``_build_booking_summary`` loop, kept as the baseline."""
+
+    rows = connection.execute("SELECT * FROM bookings WHERE 1=1").fetchall()
+    week_counts: dict[str, int] = {}
+    week_projects: dict[str, dict[str, int]] = {}
+    for row in rows:
+        raw = row["timeslot_raw"] or ""
+        parts = [part.strip() for part in raw.split(";") if part.strip()]
+        week = parts[0] if parts else "unknown"
+        week_counts[week] = week_counts.get(week, 0) + 1
+        project = row["project"]
+        week_projects.setdefault(week, {})
+        week_projects[week][project] = week_projects[week].get(project, 0) + 1
+    conflicts = {week: count for week, count in week_counts.items() if count > 1}
+    return {
+        "total": len(rows),
+        "week_counts": week_counts,
+        "week_projects": week_projects,
+        "conflicts": conflicts,
+    }
+
+
+def _pandas_booking_summary(connection: sqlite3.Connection) -> dict:
+    """Week counts, the week x project matrix and conflicting weeks as group-bys."""
+
+    frame = analysis.load_bookings(connection)
+    total = len(frame)
+    frame = analysis.expand_weeks(frame)
+    week_counts = frame.groupby("week", sort=True).size()
+    matrix = frame.groupby(["week", "project"], sort=True).size()
+    week_projects: dict[str, dict[str, int]] = {}
+    for (week, project), count in matrix.items():
+        week_projects.setdefault(week, {})[project] = int(count)
+    return {
+        "total": int(total),
+        "week_counts": {week: int(count) for week, count in week_counts.items()},
+        "week_projects": week_projects,
+        "conflicts": {
+            week: int(count) for week, count in week_counts[week_counts > 1].items()
+        },
+    }
+
+
+def _rollup_booking_summary(connection: sqlite3.Connection) -> dict:
+    rows = connection.execute(
+        f"SELECT start_week, end_week, total FROM {rollups.BOOKING_SLOTS.table}"
+    ).fetchall()
+    week_counts: dict[str, int] = {}
+    for row in rows:
+        weeks = timeslots.iter_weeks(row[0], row[1]) if row[0] else (0,)
+        for key in weeks:
+            week = timeslots.week_label(key)
+            week_counts[week] = week_counts.get(week, 0) + row["total"]
+    return {"total": sum(row["total"] for row in rows), "week_counts": week_counts}
+
+
+def _populate(connection: sqlite3.Connection, bookings: int) -> None:
+    generator = random.Random(42)
+    projects = [f"Project {index}" for index in range(40)]
+    answers = ("yes", "no")
+    records = (
+        db.BookingRecord(
+            email=f"user{generator.randrange(2000)}@example.com",
+            first_name="First",
+            last_name="Last",
+            project=generator.choice(projects),
+            timeslot_raw=f"2026-W{week:02d}; notes",
+            duration_weeks="1",
+            indoor_laptop_workspace=generator.choice(answers),
+            warehouse_storage_space=generator.choice(answers),
+            outdoor=generator.choice(answers),
+            outdoor_type="",
+            equipment="",
+            status="open",
+            start_week=202600 + week,
+            end_week=202600 + week,
+            week_count=1,
+        )
+        for week in (generator.randrange(1, 53) for _ in range(bookings))
+    )
+    with db.transaction(connection):
+        db.insert_bookings_many(connection, records)
+
+
+def _time(label: str, func: Callable[[], dict], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    print(f"{label:<22} {best * 1000:10.1f} ms")
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bookings", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        connection = db.connect(Path(directory) / "bench.sqlite")
+        migrations.migrate(connection)
+        _populate(connection, args.bookings)
+
+        legacy = _legacy_booking_summary(connection)
+        vectorized = _pandas_booking_summary(connection)
+        for key in ("total", "week_counts", "week_projects", "conflicts"):
+            assert legacy[key] == vectorized[key], key
+        rollup = _rollup_booking_summary(connection)
+        assert rollup["week_counts"] == legacy["week_counts"]
+        assert rollup["total"] == legacy["total"]
+
+        print(f"Booking summary over {args.bookings} bookings (best of {args.repeat}):")
+        baseline = _time(
+            "python loop", lambda: _legacy_booking_summary(connection), args.repeat
+        )
+        pandas_time = _time(
+            "pandas group-by", lambda: _pandas_booking_summary(connection), args.repeat
+        )
+        rollup_time = _time(
+            "rollup table", lambda: _rollup_booking_summary(connection), args.repeat
+        )
+        print(f"pandas speedup: {baseline / pandas_time:.1f}x")
+        print(f"rollup speedup: {baseline / rollup_time:.1f}x")
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Vectorized booking and activity analysis with pandas.
+
+Only the columns a summary needs are selected. They are fetched in chunks of
+plain tuples (no ``sqlite3.Row`` wrapping) straight into DataFrames. Every
+summary is then a group-by over the frame instead of a per-row Python loop.
+Fetching dominates the cost, so narrowing the column list matters more than
+the group-by itself; ``scripts/bench_analysis.py`` measures both.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from . import timeslots, timeutil
+from .conflicts import REQUESTED_VALUES, RESOURCE_COLUMNS
+
+CHUNK_SIZE = 50_000
+
+
+def read_frame(
+    connection: sqlite3.Connection,
+    sql: str,
+    params: list[object],
+    columns: list[str],
+    chunksize: int = CHUNK_SIZE,
+) -> pd.DataFrame:
+    """Run ``sql`` and collect its rows, fetched in chunks, into a DataFrame."""
+
+    cursor = connection.execute(sql, params)
+    cursor.row_factory = None
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(chunksize)
+        if not rows:
+            break
+        chunks.append(pd.DataFrame.from_records(rows, columns=columns))
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _filtered_sql(
+    table: str,
+    columns: list[str],
+    email_filter: str = "",
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+) -> tuple[str, list[object]]:
+    sql = f"SELECT {', '.join(columns)} FROM {table} WHERE 1=1"
+    params: list[object] = []
+    if email_filter:
+        sql += " AND email = ?"
+        params.append(email_filter)
+    start_ts, end_ts = timeutil.local_date_bounds(start_date, end_date)
+    if start_ts is not None:
+        sql += " AND created_ts >= ?"
+        params.append(start_ts)
+    if end_ts is not None:
+        sql += " AND created_ts < ?"
+        params.append(end_ts)
+    return sql, params
+
+
+def load_bookings(
+    connection: sqlite3.Connection,
+    email_filter: str = "",
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    resources: bool = False,
+    chunksize: int = CHUNK_SIZE,
+) -> pd.DataFrame:
+    """Load bookings with their ``start_week`` and ``end_week`` keys.
+
+    Unparsed timeslots have week keys of 0. The resource flag columns are only
+    read when ``resources`` is set.
+    """
+
+    columns = ["project", "start_week", "end_week"]
+    if resources:
+        columns.extend(RESOURCE_COLUMNS.values())
+    sql, params = _filtered_sql("bookings", columns, email_filter, start_date, end_date)
+    frame = read_frame(connection, sql, params, columns, chunksize)
+    for column in ("start_week", "end_week"):
+        frame[column] = frame[column].fillna(0).astype(np.int64)
+    return frame
+
+
+def load_activities(
+    connection: sqlite3.Connection,
+    table: str,
+    columns: list[str],
+    email_filter: str = "",
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    chunksize: int = CHUNK_SIZE,
+) -> pd.DataFrame:
+    """Load ``columns`` of an activity table, filtered like the analysis form."""
+
+    sql, params = _filtered_sql(table, columns, email_filter, start_date, end_date)
+    return read_frame(connection, sql, params, columns, chunksize)
+
+
+def _map_keys(keys: np.ndarray, function) -> np.ndarray:
+    # Few distinct weeks occur, so convert each distinct value once.
+    codes, uniques = pd.factorize(keys)
+    return np.array([function(value) for value in uniques], dtype=object)[codes]
+
+
+def expand_weeks(frame: pd.DataFrame) -> pd.DataFrame:
+    """Repeat each booking once per covered week, labelled in ``week``."""
+
+    start = frame["start_week"].to_numpy(dtype=np.int64)
+    end = frame["end_week"].to_numpy(dtype=np.int64)
+    known = start > 0
+    first = np.zeros(len(frame), dtype=np.int64)
+    spans = np.ones(len(frame), dtype=np.int64)
+    if known.any():
+        first[known] = _map_keys(start[known], timeslots.week_ordinal).astype(np.int64)
+        last = _map_keys(end[known], timeslots.week_ordinal).astype(np.int64)
+        spans[known] = np.maximum(last - first[known] + 1, 1)
+    rows = np.repeat(np.arange(len(frame)), spans)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(spans) - spans, spans)
+    expanded = frame.iloc[rows].reset_index(drop=True)
+    ordinals = first[rows] + offsets
+    labels = np.full(len(rows), timeslots.UNKNOWN_WEEK, dtype=object)
+    covered = known[rows]
+    if covered.any():
+        labels[covered] = _map_keys(
+            ordinals[covered],
+            lambda ordinal: timeslots.week_label(timeslots.week_from_ordinal(ordinal)),
+        )
+    expanded["week"] = labels
+    return expanded
+
+
+def resource_flags(frame: pd.DataFrame) -> pd.DataFrame:
+    """Return one boolean column per resource: whether the booking requests it."""
+
+    return pd.DataFrame(
+        {
+            resource: frame[column]
+            .fillna("")
+            .astype(str)
+            .str.strip()
+            .str.lower()
+            .isin(REQUESTED_VALUES)
+            for resource, column in RESOURCE_COLUMNS.items()
+        },
+        index=frame.index,
+    )
+
+
+def resource_pivot(frame: pd.DataFrame) -> pd.DataFrame:
+    """Count requested resources per project and covered week.
+
+    The result is indexed by ``(project, week)`` with one column per resource.
+    """
+
+    resources = list(RESOURCE_COLUMNS)
+    if frame.empty:
+        return pd.DataFrame(
+            columns=resources,
+            index=pd.MultiIndex.from_tuples([], names=["project", "week"]),
+        )
+    frame = expand_weeks(frame)
+    flags = resource_flags(frame)
+    flags["project"] = frame["project"]
+    flags["week"] = frame["week"]
+    return flags.groupby(["project", "week"], sort=True)[resources].sum().astype(int)
@@ -0,0 +1,212 @@
+"""Booked resources per week and free capacity lookups.
+
+An :class:`OccupancyMatrix` holds one row per week and one column per
+resource class, counting the booked (``gebucht``) bookings that hold the
+resource that week. Free capacity for weeks X..Y is the configured slots minus
+the column maxima of that slice, so a lookup never touches the database.
+
+Triggers bump ``capacity_state.version`` whenever a booked row changes.
+:class:`CapacityTracker` compares that counter before answering. It applies
+its own approvals and denials incrementally and reloads the matrix only when
+another process changed the bookings.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+from typing import Iterable, Optional
+
+import numpy as np
+
+from . import conflicts, timeslots
+from .config import CapacityConfig, load_capacity_config
+
+BOOKED_STATUS = "gebucht"
+LOOKUP_ERROR = "Use start=YYYY-Www (or a date) and an optional end week."
+RESOURCES: tuple[str, ...] = tuple(conflicts.RESOURCE_COLUMNS)
+
+
+def create_tables(connection: sqlite3.Connection) -> None:
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS capacity_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+        """
+    )
+    connection.execute("INSERT OR IGNORE INTO capacity_state (id, version) VALUES (1, 0)")
+    bump = "UPDATE capacity_state SET version = version + 1 WHERE id = 1;"
+    watched = ", ".join(
+        ("status", "start_week", "end_week", *conflicts.RESOURCE_COLUMNS.values())
+    )
+    connection.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS bookings_capacity_ai AFTER INSERT ON bookings
+        WHEN new.status = '{BOOKED_STATUS}' BEGIN {bump} END
+        """
+    )
+    connection.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS bookings_capacity_ad AFTER DELETE ON bookings
+        WHEN old.status = '{BOOKED_STATUS}' BEGIN {bump} END
+        """
+    )
+    connection.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS bookings_capacity_au
+        AFTER UPDATE OF {watched} ON bookings
+        WHEN old.status = '{BOOKED_STATUS}' OR new.status = '{BOOKED_STATUS}'
+        BEGIN {bump} END
+        """
+    )
+
+
+def state_version(connection: sqlite3.Connection) -> int:
+    row = connection.execute("SELECT version FROM capacity_state WHERE id = 1").fetchone()
+    return row[0] if row else 0
+
+
+class OccupancyMatrix:
+    """Booked resource counts, weeks x resources, backed by a numpy array."""
+
+    def __init__(self, slots: dict[str, int]) -> None:
+        self.slots = np.array([slots.get(resource, 0) for resource in RESOURCES])
+        self._first = 0
+        self._used = np.zeros((0, len(RESOURCES)), dtype=np.int32)
+
+    def _grow(self, first: int, last: int) -> None:
+        if not len(self._used):
+            self._first = first
+            self._used = np.zeros((last - first + 1, len(RESOURCES)), dtype=np.int32)
+            return
+        before = max(self._first - first, 0)
+        after = max(last - (self._first + len(self._used) - 1), 0)
+        if before or after:
+            self._used = np.pad(self._used, ((before, after), (0, 0)))
+            self._first -= before
+
+    def add(self, interval: conflicts.BookingInterval, delta: int = 1) -> None:
+        """Add (or with ``delta=-1`` remove) one booking."""
+
+        columns = [RESOURCES.index(resource) for resource in interval.resources]
+        if not columns:
+            return
+        first = timeslots.week_ordinal(interval.start_week)
+        last = timeslots.week_ordinal(interval.end_week)
+        self._grow(first, last)
+        rows = slice(first - self._first, last - self._first + 1)
+        self._used[rows, columns] += delta
+
+    def used(self, start_week: int, end_week: int) -> np.ndarray:
+        """Return the peak count of each resource over the weeks."""
+
+        first = timeslots.week_ordinal(start_week) - self._first
+        last = timeslots.week_ordinal(end_week) - self._first
+        window = self._used[max(first, 0) : max(last + 1, 0)]
+        if not len(window):
+            return np.zeros(len(RESOURCES), dtype=np.int32)
+        return window.max(axis=0)
+
+    def free(self, start_week: int, end_week: int) -> dict[str, int]:
+        """Return the slots left in every week of the range; negative if overbooked."""
+
+        free = self.slots - self.used(start_week, end_week)
+        return {resource: int(count) for resource, count in zip(RESOURCES, free)}
+
+
+def build_matrix(
+    intervals: Iterable[conflicts.BookingInterval], slots: dict[str, int]
+) -> OccupancyMatrix:
+    matrix = OccupancyMatrix(slots)
+    for interval in intervals:
+        matrix.add(interval)
+    return matrix
+
+
+class CapacityTracker:
+    """Process-wide occupancy matrix kept in step with the database."""
+
+    def __init__(self, config: CapacityConfig) -> None:
+        self.config = config
+        self._lock = threading.Lock()
+        self._matrix: Optional[OccupancyMatrix] = None
+        self._version = -1
+
+    def _reload(self, connection: sqlite3.Connection) -> None:
+        version = state_version(connection)
+        intervals = conflicts.load_intervals(connection, status=BOOKED_STATUS)
+        self._matrix = build_matrix(intervals, self.config.slots)
+        self._version = version
+
+    def matrix(self, connection: sqlite3.Connection) -> OccupancyMatrix:
+        """Return the current matrix, reloading it if bookings changed elsewhere."""
+
+        with self._lock:
+            if self._matrix is None or state_version(connection) != self._version:
+                self._reload(connection)
+            return self._matrix
+
+    def free(
+        self, connection: sqlite3.Connection, start_week: int, end_week: int
+    ) -> dict[str, int]:
+        return self.matrix(connection).free(start_week, end_week)
+
+    def status_changed(
+        self, connection: sqlite3.Connection, booking: sqlite3.Row, new_status: str
+    ) -> None:
+        """Apply a committed status change of ``booking`` (the row before it).
+
+        The update bumped the version once; any other difference means another
+        writer got in between, and the matrix is reloaded instead.
+        """
+
+        was_booked = booking["status"] == BOOKED_STATUS
+        if was_booked == (new_status == BOOKED_STATUS):
+            return
+        with self._lock:
+            if self._matrix is None:
+                return
+            version = state_version(connection)
+            interval = conflicts.interval_from_booking(booking)
+            if version != self._version + 1:
+                self._reload(connection)
+                return
+            if interval is not None:
+                self._matrix.add(interval, -1 if was_booked else 1)
+            self._version = version
+
+
+_tracker: Optional[CapacityTracker] = None
+_tracker_lock = threading.Lock()
+
+
+def get_tracker() -> CapacityTracker:
+    """Return the process-wide tracker, creating it on first use."""
+
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = CapacityTracker(load_capacity_config())
+        return _tracker
+
+
+def lookup(connection: sqlite3.Connection, start: str, end: str = "") -> Optional[dict]:
+    """Answer a free-capacity query for the weeks ``start`` to ``end``.
+
+    Weeks are given as ``2026-W41`` or a date; ``end`` defaults to ``start``.
+    Returns None if the range cannot be parsed.
+    """
+
+    start_week = timeslots.parse_week(start)
+    end_week = timeslots.parse_week(end) if end.strip() else start_week
+    if start_week is None or end_week is None or end_week < start_week:
+        return None
+    tracker = get_tracker()
+    return {
+        "start_week": timeslots.week_label(start_week),
+        "end_week": timeslots.week_label(end_week),
+        "capacity": tracker.config.slots,
+        "free": tracker.free(connection, start_week, end_week),
+    }
@@ -4,14 +4,18 @@ from __future__ import annotations
 
 import os
 import base64
+import hmac
 import importlib
 import importlib.util
 import io
 import socket
+from contextlib import closing
 from flask import (
     Flask,
     Response,
+    abort,
     flash,
+    jsonify,
     redirect,
     render_template,
     request,
@@ -19,15 +23,22 @@ from flask import (
     session,
     url_for,
 )
-from datetime import datetime
 from pathlib import Path
 from typing import Optional, Tuple
-from zoneinfo import ZoneInfo
 from urllib.parse import quote_plus
 
 
-from site_coordination import db
+from site_coordination import capacity, db_tools, migrations, timeutil
+from site_coordination.config import load_roster_token, load_session_policy
 from site_coordination.db_tools import get_connection
+from site_coordination.presence import (
+    current_roster,
+    record_event,
+    research_event,
+    service_event,
+)
+from site_coordination.session_updater import start_session_updater
+from site_coordination.wal_checkpoint import start_wal_checkpoint
 
 
 def create_app() -> Flask:
@@ -41,6 +52,11 @@ def create_app() -> Flask:
         static_folder=str(base_dir / "static"),
     )
     app.secret_key = os.environ.get("SITE_COORDINATION_SECRET", "dev-secret")
+    db_tools.init_app(app)
+    app.extensions["wal_checkpoint"] = start_wal_checkpoint(app.logger)
+    session_policy = load_session_policy()
+    roster_token = load_roster_token()
+    app.extensions["session_updater"] = start_session_updater(session_policy, app.logger)
 
     @app.get("/")
     def index() -> str:
@@ -93,6 +109,30 @@ def create_app() -> Flask:
                 flash("Eintrag gespeichert.", "success")
         return render_template("service_provider.html")
 
+    @app.get("/roster")
+    def roster() -> str:
+        _require_roster_token(roster_token)
+        with get_connection() as connection:
+            people = _public_roster(current_roster(connection, session_policy))
+        return render_template("roster.html", people=people, token=roster_token)
+
+    @app.get("/roster.json")
+    def roster_json() -> Response:
+        _require_roster_token(roster_token)
+        with get_connection() as connection:
+            people = _public_roster(current_roster(connection, session_policy))
+        return jsonify({"count": len(people), "people": people})
+
+    @app.get("/api/capacity")
+    def api_capacity() -> Tuple[Response, int]:
+        with get_connection() as connection:
+            result = capacity.lookup(
+                connection, request.args.get("start", ""), request.args.get("end", "")
+            )
+        if result is None:
+            return jsonify({"error": capacity.LOOKUP_ERROR}), 400
+        return jsonify(result), 200
+
     @app.get("/registrations")
     def registrations() -> str:
         return render_template("registrations.html")
@@ -268,16 +308,38 @@ def _insert_activity(
     project: str,
     presence: str,
 ) -> str:
-    created_at = datetime.now(ZoneInfo("Europe/Berlin")).strftime("%Y-%m-%d %H:%M:%S")
+    now = timeutil.now_local()
+    created_at = timeutil.format_local(now)
     with get_connection() as connection:
-        connection.execute(
+        cursor = connection.execute(
             """
             INSERT INTO activity_research (
-                email, first_name, last_name, project, presence, created_at
+                email, first_name, last_name, project, presence, created_at, created_ts
             )
-            VALUES (?, ?, ?, ?, ?, ?)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
             """,
-            (email, first_name, last_name, project, presence, created_at),
+            (
+                email,
+                first_name,
+                last_name,
+                project,
+                presence,
+                created_at,
+                timeutil.epoch_seconds(now),
+            ),
+        )
+        record_event(
+            connection,
+            research_event(
+                email,
+                first_name,
+                last_name,
+                project,
+                presence,
+                created_at,
+                timeutil.epoch_seconds(now),
+                cursor.lastrowid,
+            ),
         )
         connection.commit()
     return created_at
@@ -290,27 +352,63 @@ def _insert_service_provider_activity(
     service: str,
     presence: str,
 ) -> str:
-    created_at = datetime.now(ZoneInfo("Europe/Berlin")).strftime("%Y-%m-%d %H:%M:%S")
+    now = timeutil.now_local()
+    created_at = timeutil.format_local(now)
     with get_connection() as connection:
-        connection.execute(
+        cursor = connection.execute(
             """
             INSERT INTO activity_service_provider (
-                name, company, mobile, service, presence, created_at
+                name, company, mobile, service, presence, created_at, created_ts
             )
-            VALUES (?, ?, ?, ?, ?, ?)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
             """,
-            (name, company, mobile, service, presence, created_at),
+            (
+                name,
+                company,
+                mobile,
+                service,
+                presence,
+                created_at,
+                timeutil.epoch_seconds(now),
+            ),
+        )
+        record_event(
+            connection,
+            service_event(
+                name,
+                company,
+                mobile,
+                service,
+                presence,
+                created_at,
+                timeutil.epoch_seconds(now),
+                cursor.lastrowid,
+            ),
         )
         connection.commit()
     return created_at
 
 
+def _require_roster_token(roster_token: str) -> None:
+    # The kiosk is public, so the roster is only served with the configured
+    # token (query parameter or X-Roster-Token header) and is off without one.
+    supplied = request.args.get("token") or request.headers.get("X-Roster-Token", "")
+    if not roster_token or not hmac.compare_digest(supplied, roster_token):
+        abort(404)
+
+
+def _public_roster(people: list[dict]) -> list[dict]:
+    # Email addresses stay in the coordination app.
+    return [
+        {key: value for key, value in person.items() if key != "detail"}
+        for person in people
+    ]
+
+
 def _ensure_database() -> None:
-    with get_connection() as connection:
-        db.init_db(connection)
-        db.ensure_users_credentials_column(connection)
-        db.ensure_activity_research_name_columns(connection)
-        db.ensure_booking_request_columns(connection)
+    auto_migrate = db_tools.get_pool().config.auto_migrate
+    with closing(get_connection()) as connection:
+        migrations.ensure_schema(connection, auto_migrate=auto_migrate)
 
 
 def _build_qr_code_data_uri(url: str) -> str | None:
@@ -3,42 +3,125 @@
 from __future__ import annotations
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import logging
 from pathlib import Path
+import signal
+import time
+from typing import Iterable, Optional
 
-from .config import load_database_config, load_imap_config, load_smtp_config
-from . import db
-from .email_parser import (
-    EmailParseError,
-    parse_access_request,
-    parse_booking_request,
+from .config import (
+    load_database_config,
+    load_imap_config,
+    load_ingest_config,
+    load_session_policy,
+    load_smtp_config,
 )
-from .imap_watcher import fetch_unseen_messages
-from .processor import handle_access_request, handle_booking_request
+from . import db, indexes, ingest, migrations, presence, rollups, search, sessions
+from .email_parser import EmailParseError, iter_requests
+from .imap_watcher import ImapWatcher, SyncStats, connect as connect_imap
+from .mail_archive import ArchivedMessage, iter_directory, iter_mbox
+from .processor import process_request
 from .user_admin import approve_registration, reject_registration
 
 
 def _handle_email_body(connection, body: str) -> str:
-    if "BEGIN_ACCESS_REQUEST_V1" in body:
-        request = parse_access_request(body)
-        result = handle_access_request(connection, request)
-        return result.message
-    if "BEGIN_BOOKING_REQUEST_V1" in body:
-        request = parse_booking_request(body)
-        result = handle_booking_request(connection, request)
-        return result.message
-    raise EmailParseError("Unsupported email format.")
+    blocks = list(iter_requests(body))
+    if not blocks:
+        raise EmailParseError("Unsupported email format.")
+    messages = []
+    for block in blocks:
+        if block.request is None:
+            messages.append(f"Skipped block at line {block.line}: {block.error}")
+        else:
+            messages.append(process_request(connection, block.request).message)
+    return "\n".join(messages)
+
+
+def _label(item: ingest.IngestItem, name: str) -> str:
+    # Digest emails carry several requests; name the block.
+    return f"{name}, line {item.line}" if item.line else name
 
 
 def _command_init_db(args: argparse.Namespace) -> None:
     config = load_database_config()
-    connection = db.connect(config.path)
+    connection = db.connect(config.path, profile=config.profile)
     db.init_db(connection)
     print(f"Database initialized at {config.path}")
 
 
+def _command_migrate(args: argparse.Namespace) -> None:
+    config = load_database_config()
+    connection = db.connect(config.path, profile=config.profile)
+    version = migrations.schema_version(connection)
+    if args.check:
+        if version != migrations.LATEST_VERSION:
+            raise SystemExit(
+                f"Schema version {version} is behind {migrations.LATEST_VERSION}."
+            )
+        print(f"Schema is current at version {version}.")
+        return
+    applied = migrations.migrate(connection)
+    for migration in applied:
+        print(f"Applied migration {migration.version}: {migration.description}")
+    print(f"Schema is current at version {migrations.LATEST_VERSION}.")
+
+
+def _command_check_indexes(args: argparse.Namespace) -> None:
+    config = load_database_config()
+    connection = db.connect(config.path, profile=config.profile)
+    db.init_db(connection)
+    problems = indexes.find_full_scans(connection)
+    for name, details in problems.items():
+        print(f"Full scan in '{name}': {'; '.join(details)}")
+    if problems:
+        raise SystemExit(1)
+    print(f"All {len(indexes.HOT_QUERIES)} hot queries use an index.")
+
+
+def _command_rebuild_search(args: argparse.Namespace) -> None:
+    config = load_database_config()
+    connection = db.connect(config.path, profile=config.profile)
+    db.init_db(connection)
+    search.rebuild(connection)
+    print(f"Rebuilt {len(search.FTS_TABLES)} search indexes.")
+
+
+def _command_rebuild_rollups(args: argparse.Namespace) -> None:
+    config = load_database_config()
+    connection = db.connect(config.path, profile=config.profile)
+    db.init_db(connection)
+    rollups.rebuild(connection)
+    print(f"Rebuilt {len(rollups.ROLLUPS)} analytics rollups.")
+
+
+def _command_rebuild_sessions(args: argparse.Namespace) -> None:
+    config = load_database_config()
+    connection = db.connect(config.path, profile=config.profile)
+    db.init_db(connection)
+    processed = sessions.rebuild(connection, load_session_policy())
+    print(f"Paired {processed} check-in/check-out events into sessions.")
+
+
+def _command_update_sessions(args: argparse.Namespace) -> None:
+    config = load_database_config()
+    connection = db.connect(config.path, profile=config.profile)
+    db.init_db(connection)
+    processed = sessions.update(connection, load_session_policy())
+    print(f"Folded {processed} new check-in/check-out events into sessions.")
+
+
+def _command_rebuild_presence(args: argparse.Namespace) -> None:
+    config = load_database_config()
+    connection = db.connect(config.path, profile=config.profile)
+    db.init_db(connection)
+    on_site = presence.rebuild(connection)
+    print(f"Rebuilt the on-site roster: {on_site} people checked in.")
+
+
 def _command_process_file(args: argparse.Namespace) -> None:
     config = load_database_config()
-    connection = db.connect(config.path)
+    connection = db.connect(config.path, profile=config.profile)
     db.init_db(connection)
     body = Path(args.path).read_text(encoding="utf-8")
     message = _handle_email_body(connection, body)
@@ -48,22 +131,106 @@ def _command_process_file(args: argparse.Namespace) -> None:
 def _command_process_imap(args: argparse.Namespace) -> None:
     config = load_database_config()
     imap_config = load_imap_config()
-    connection = db.connect(config.path)
+    connection = db.connect(config.path, profile=config.profile)
     db.init_db(connection)
 
-    messages = fetch_unseen_messages(imap_config)
-    for message in messages:
-        try:
-            result = _handle_email_body(connection, message.body)
-            print(f"Processed: {message.subject} -> {result}")
-        except EmailParseError as exc:
-            print(f"Skipped: {message.subject} ({exc})")
+    client = connect_imap(imap_config)
+    try:
+        if args.bulk:
+            ingest_config = load_ingest_config()
+            with ProcessPoolExecutor(ingest_config.workers) as executor:
+                bulk = ingest.BulkIngest(executor, ingest_config)
+                stats = _sync_mailbox(client, connection, imap_config, bulk)
+        else:
+            stats = _sync_mailbox(client, connection, imap_config)
+    finally:
+        client.logout()
+    print(
+        f"Processed {stats.messages} messages in {stats.seconds:.2f}s"
+        f" ({stats.per_second:.1f} msgs/s)."
+    )
+
+
+def _sync_mailbox(
+    client, connection, imap_config, bulk: Optional[ingest.BulkIngest] = None
+) -> SyncStats:
+    counters = ingest.StageCounters()
+    started = time.perf_counter()
+    for item in ingest.ingest_mailbox(
+        client,
+        connection,
+        imap_config.mailbox,
+        counters,
+        imap_config.fetch_chunk_size,
+        imap_config.fetch_mode,
+        bulk,
+    ):
+        label = _label(item, item.message.subject)
+        if item.error:
+            print(f"Skipped: {label} ({item.error})", flush=True)
+        elif item.duplicate and bulk is None:
+            print(f"Duplicate: {label} -> {item.result}", flush=True)
+        elif bulk is None:
+            # A bulk replay only reports what went wrong.
+            print(f"Processed: {label} -> {item.result}", flush=True)
+    if counters.fetched:
+        print(f"Stages: {counters.summary()}.", flush=True)
+    return SyncStats(counters.fetched, time.perf_counter() - started)
+
+
+def _command_process_dir(args: argparse.Namespace) -> None:
+    _ingest_archive(iter_directory(Path(args.path)))
+
+
+def _command_process_mbox(args: argparse.Namespace) -> None:
+    _ingest_archive(iter_mbox(Path(args.path)))
+
+
+def _ingest_archive(messages: Iterable[ArchivedMessage]) -> None:
+    config = load_database_config()
+    connection = db.connect(config.path, profile=config.profile)
+    db.init_db(connection)
+
+    ingest_config = load_ingest_config()
+    counters = ingest.StageCounters()
+    started = time.perf_counter()
+    with ProcessPoolExecutor(ingest_config.workers) as executor:
+        bulk = ingest.BulkIngest(executor, ingest_config)
+        for item in ingest.ingest_archive(connection, messages, counters, bulk):
+            if item.error:
+                print(f"Skipped: {_label(item, item.source)} ({item.error})", flush=True)
+    stats = SyncStats(counters.fetched, time.perf_counter() - started)
+    if counters.fetched:
+        print(f"Stages: {counters.summary()}.")
+    print(
+        f"Processed {stats.messages} messages in {stats.seconds:.2f}s"
+        f" ({stats.per_second:.1f} msgs/s)."
+    )
+
+
+def _command_watch_imap(args: argparse.Namespace) -> None:
+    config = load_database_config()
+    imap_config = load_imap_config()
+    connection = db.connect(config.path, profile=config.profile)
+    db.init_db(connection)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    watcher = ImapWatcher(
+        imap_config,
+        lambda client: _sync_mailbox(client, connection, imap_config),
+        logging.getLogger("site_coordination.imap"),
+    )
+    signal.signal(signal.SIGTERM, lambda *_: watcher.stop())
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        watcher.stop()
 
 
 def _command_approve(args: argparse.Namespace) -> None:
     config = load_database_config()
     smtp_config = load_smtp_config()
-    connection = db.connect(config.path)
+    connection = db.connect(config.path, profile=config.profile)
     db.init_db(connection)
     result = approve_registration(connection, smtp_config, args.email)
     print(f"Registration {result.email} updated: {result.status}")
@@ -71,7 +238,7 @@ def _command_approve(args: argparse.Namespace) -> None:
 
 def _command_reject(args: argparse.Namespace) -> None:
     config = load_database_config()
-    connection = db.connect(config.path)
+    connection = db.connect(config.path, profile=config.profile)
     db.init_db(connection)
     result = reject_registration(connection, args.email)
     print(f"Registration {result.email} updated: {result.status}")
@@ -84,6 +251,49 @@ def build_parser() -> argparse.ArgumentParser:
     init_db_parser = subparsers.add_parser("init-db", help="Initialize database")
     init_db_parser.set_defaults(func=_command_init_db)
 
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="Apply pending schema migrations"
+    )
+    migrate_parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Only report whether migrations are pending (exit code 1 if so)",
+    )
+    migrate_parser.set_defaults(func=_command_migrate)
+
+    check_indexes_parser = subparsers.add_parser(
+        "check-indexes",
+        help="Fail if a hot query falls back to a full table scan (EXPLAIN QUERY PLAN)",
+    )
+    check_indexes_parser.set_defaults(func=_command_check_indexes)
+
+    rebuild_search_parser = subparsers.add_parser(
+        "rebuild-search", help="Rebuild the FTS5 search indexes (e.g. after VACUUM)"
+    )
+    rebuild_search_parser.set_defaults(func=_command_rebuild_search)
+
+    rebuild_rollups_parser = subparsers.add_parser(
+        "rebuild-rollups", help="Recount the analytics rollup tables"
+    )
+    rebuild_rollups_parser.set_defaults(func=_command_rebuild_rollups)
+
+    rebuild_sessions_parser = subparsers.add_parser(
+        "rebuild-sessions",
+        help="Re-pair all check-in/check-out events (e.g. after a policy change)",
+    )
+    rebuild_sessions_parser.set_defaults(func=_command_rebuild_sessions)
+
+    update_sessions_parser = subparsers.add_parser(
+        "update-sessions",
+        help="Fold new events into the sessions and close those past their limit",
+    )
+    update_sessions_parser.set_defaults(func=_command_update_sessions)
+
+    rebuild_presence_parser = subparsers.add_parser(
+        "rebuild-presence", help="Rebuild the on-site roster from the activity log"
+    )
+    rebuild_presence_parser.set_defaults(func=_command_rebuild_presence)
+
     process_file_parser = subparsers.add_parser(
         "process-file", help="Process an email body from a file"
     )
@@ -93,8 +303,30 @@ def build_parser() -> argparse.ArgumentParser:
     process_imap_parser = subparsers.add_parser(
         "process-imap", help="Process unseen emails from IMAP"
     )
+    process_imap_parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Replay a large backlog: parallel parsing and group commits",
+    )
     process_imap_parser.set_defaults(func=_command_process_imap)
 
+    process_dir_parser = subparsers.add_parser(
+        "process-dir", help="Process exported emails from a Maildir or .eml directory"
+    )
+    process_dir_parser.add_argument("path", help="Maildir or directory of .eml files")
+    process_dir_parser.set_defaults(func=_command_process_dir)
+
+    process_mbox_parser = subparsers.add_parser(
+        "process-mbox", help="Process exported emails from an mbox file"
+    )
+    process_mbox_parser.add_argument("path", help="Path to the mbox file")
+    process_mbox_parser.set_defaults(func=_command_process_mbox)
+
+    watch_imap_parser = subparsers.add_parser(
+        "watch-imap", help="Process new emails as they arrive (IMAP IDLE)"
+    )
+    watch_imap_parser.set_defaults(func=_command_watch_imap)
+
     approve_parser = subparsers.add_parser(
         "approve", help="Approve a registration and send credentials"
     )
@@ -2,17 +2,71 @@
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import os
 from pathlib import Path
 from typing import Dict
 
 
+@dataclass(frozen=True)
+class ConnectionProfile:
+    """PRAGMA settings applied to every SQLite connection."""
+
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    busy_timeout_ms: int = 5000
+    cache_size_kib: int = 20000
+    mmap_size: int = 268435456
+    temp_store: str = "MEMORY"
+    journal_size_limit: int = 67108864
+    checkpoint_interval_seconds: int = 300
+    checkpoint_mode: str = "PASSIVE"
+
+
 @dataclass(frozen=True)
 class DatabaseConfig:
     """Database configuration."""
 
     path: Path
+    pool_size: int = 5
+    statement_cache_size: int = 128
+    auto_migrate: bool = False
+    profile: ConnectionProfile = field(default_factory=ConnectionProfile)
+
+
+@dataclass(frozen=True)
+class SessionPolicy:
+    """How check-in/check-out events are paired into on-site sessions.
+
+    ``missing_checkout``: ``end_of_day`` ends an unpaired check-in at local
+    midnight, ``max_hours`` after ``max_session_hours``, and ``discard`` counts
+    it as zero hours. ``double_checkin``: ``close_previous`` ends the open
+    session at the new check-in, and ``keep_first`` ignores the repeat.
+    ``update_interval_seconds``: how often the check-in app folds new events
+    into the sessions (0 disables it).
+    """
+
+    missing_checkout: str = "end_of_day"
+    double_checkin: str = "close_previous"
+    max_session_hours: int = 12
+    update_interval_seconds: int = 60
+
+
+@dataclass(frozen=True)
+class CapacityConfig:
+    """Bookable slots per resource class and week."""
+
+    indoor: int = 10
+    warehouse: int = 4
+    outdoor: int = 4
+
+    @property
+    def slots(self) -> Dict[str, int]:
+        return {
+            "indoor": self.indoor,
+            "warehouse": self.warehouse,
+            "outdoor": self.outdoor,
+        }
 
 
 @dataclass(frozen=True)
@@ -23,6 +77,22 @@ class ImapConfig:
     user: str
     password: str
     mailbox: str = "INBOX"
+    port: int = 993
+    use_ssl: bool = True
+    idle_timeout_seconds: int = 300
+    poll_interval_seconds: int = 30
+    fetch_chunk_size: int = 500
+    # "text": only the text/plain part; "full": the whole message.
+    fetch_mode: str = "text"
+
+
+@dataclass(frozen=True)
+class IngestConfig:
+    """Bulk ingest: parse worker processes and group-commit batches."""
+
+    workers: int = 4
+    batch_size: int = 200
+    batch_ms: int = 250
 
 
 @dataclass(frozen=True)
@@ -67,17 +137,109 @@ def load_env() -> None:
     _apply_env_overrides(_load_env_file(env_path))
 
 
-def load_database_config() -> DatabaseConfig:
-    """Load database configuration from environment variables."""
+def _int_env(key: str, default: int, minimum: int = 0) -> int:
+    """Read an integer environment variable with a fallback."""
+
+    try:
+        return max(int(os.environ.get(key, str(default))), minimum)
+    except ValueError:
+        return default
+
+
+def _bool_env(key: str, default: bool) -> bool:
+    """Read a boolean environment variable such as ``true`` or ``0``."""
+
+    value = os.environ.get(key)
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _choice_env(key: str, default: str, choices: set[str]) -> str:
+    """Read an upper-cased environment variable restricted to known values."""
+
+    value = os.environ.get(key, default).strip().upper()
+    return value if value in choices else default
+
+
+def load_connection_profile() -> ConnectionProfile:
+    """Load the SQLite connection profile from environment variables."""
 
     load_env()
+    return ConnectionProfile(
+        journal_mode=_choice_env(
+            "SITE_COORDINATION_DB_JOURNAL_MODE",
+            "WAL",
+            {"WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY"},
+        ),
+        synchronous=_choice_env(
+            "SITE_COORDINATION_DB_SYNCHRONOUS", "NORMAL", {"OFF", "NORMAL", "FULL", "EXTRA"}
+        ),
+        busy_timeout_ms=_int_env("SITE_COORDINATION_DB_BUSY_TIMEOUT_MS", 5000),
+        cache_size_kib=_int_env("SITE_COORDINATION_DB_CACHE_SIZE_KIB", 20000),
+        mmap_size=_int_env("SITE_COORDINATION_DB_MMAP_SIZE", 268435456),
+        temp_store=_choice_env(
+            "SITE_COORDINATION_DB_TEMP_STORE", "MEMORY", {"DEFAULT", "FILE", "MEMORY"}
+        ),
+        journal_size_limit=_int_env("SITE_COORDINATION_DB_JOURNAL_SIZE_LIMIT", 67108864),
+        checkpoint_interval_seconds=_int_env(
+            "SITE_COORDINATION_DB_CHECKPOINT_INTERVAL_SECONDS", 300
+        ),
+        checkpoint_mode=_choice_env(
+            "SITE_COORDINATION_DB_CHECKPOINT_MODE",
+            "PASSIVE",
+            {"PASSIVE", "FULL", "RESTART", "TRUNCATE"},
+        ),
+    )
+
+
 def load_database_config() -> DatabaseConfig:
     """Load database configuration from environment variables."""
 
+    load_env()
     db_path = Path(
         os.environ.get("SITE_COORDINATION_DB", "database/site_coordination.sqlite")
     )
-    return DatabaseConfig(path=db_path)
+    return DatabaseConfig(
+        path=db_path,
+        pool_size=_int_env("SITE_COORDINATION_DB_POOL_SIZE", 5, minimum=1),
+        statement_cache_size=_int_env("SITE_COORDINATION_DB_STATEMENT_CACHE", 128),
+        auto_migrate=_bool_env("SITE_COORDINATION_AUTO_MIGRATE", False),
+        profile=load_connection_profile(),
+    )
+
+
+def load_session_policy() -> SessionPolicy:
+    """Load the session pairing policy from environment variables."""
+
+    load_env()
+    return SessionPolicy(
+        missing_checkout=_choice_env(
+            "SITE_COORDINATION_SESSION_MISSING_CHECKOUT",
+            "END_OF_DAY",
+            {"END_OF_DAY", "MAX_HOURS", "DISCARD"},
+        ).lower(),
+        double_checkin=_choice_env(
+            "SITE_COORDINATION_SESSION_DOUBLE_CHECKIN",
+            "CLOSE_PREVIOUS",
+            {"CLOSE_PREVIOUS", "KEEP_FIRST"},
+        ).lower(),
+        max_session_hours=_int_env("SITE_COORDINATION_SESSION_MAX_HOURS", 12, minimum=1),
+        update_interval_seconds=_int_env(
+            "SITE_COORDINATION_SESSION_UPDATE_INTERVAL_SECONDS", 60
+        ),
+    )
+
+
+def load_capacity_config() -> CapacityConfig:
+    """Load the per-week resource capacity from environment variables."""
+
+    load_env()
+    return CapacityConfig(
+        indoor=_int_env("SITE_COORDINATION_CAPACITY_INDOOR", 10),
+        warehouse=_int_env("SITE_COORDINATION_CAPACITY_WAREHOUSE", 4),
+        outdoor=_int_env("SITE_COORDINATION_CAPACITY_OUTDOOR", 4),
+    )
 
 
 def load_imap_config() -> ImapConfig:
@@ -89,6 +251,29 @@ def load_imap_config() -> ImapConfig:
         user=os.environ.get("SITE_COORDINATION_IMAP_USER", ""),
         password=os.environ.get("SITE_COORDINATION_IMAP_PASSWORD", ""),
         mailbox=os.environ.get("SITE_COORDINATION_IMAP_MAILBOX", "INBOX"),
+        port=_int_env("SITE_COORDINATION_IMAP_PORT", 993, minimum=1),
+        use_ssl=_bool_env("SITE_COORDINATION_IMAP_SSL", True),
+        idle_timeout_seconds=_int_env(
+            "SITE_COORDINATION_IMAP_IDLE_TIMEOUT_SECONDS", 300, minimum=1
+        ),
+        poll_interval_seconds=_int_env(
+            "SITE_COORDINATION_IMAP_POLL_INTERVAL_SECONDS", 30, minimum=1
+        ),
+        fetch_chunk_size=_int_env("SITE_COORDINATION_IMAP_FETCH_CHUNK", 500, minimum=1),
+        fetch_mode=_choice_env(
+            "SITE_COORDINATION_IMAP_FETCH_MODE", "TEXT", {"TEXT", "FULL"}
+        ).lower(),
+    )
+
+
+def load_ingest_config() -> IngestConfig:
+    """Load the bulk ingest settings from environment variables."""
+
+    load_env()
+    return IngestConfig(
+        workers=_int_env("SITE_COORDINATION_INGEST_WORKERS", os.cpu_count() or 1, minimum=1),
+        batch_size=_int_env("SITE_COORDINATION_INGEST_BATCH", 200, minimum=1),
+        batch_ms=_int_env("SITE_COORDINATION_INGEST_BATCH_MS", 250),
     )
 
 
@@ -106,3 +291,10 @@ def load_smtp_config() -> SmtpConfig:
             "SITE_COORDINATION_SENDER_EMAIL", "wordpress@campus-rwth-aachen.com"
         ),
     )
+
+
+def load_roster_token() -> str:
+    """Load the token for the check-in app's roster; empty disables the roster."""
+
+    load_env()
+    return os.environ.get("SITE_COORDINATION_ROSTER_TOKEN", "").strip()
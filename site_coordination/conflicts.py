@@ -0,0 +1,171 @@
+"""Booking overlaps per resource class.
+
+Each booking covers the weeks ``start_week`` to ``end_week`` (see
+:mod:`site_coordination.timeslots`). A sweep line runs over those intervals,
+once per resource class, sorted by start week. It keeps the still-running
+bookings in a heap ordered by end week, so each new booking is compared only
+with the bookings it actually overlaps. That is O(n log n) plus one step per
+reported overlap, instead of comparing every pair.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import heapq
+import sqlite3
+from typing import Iterable, Optional
+
+# Resource label -> bookings column holding the requested flag.
+RESOURCE_COLUMNS: dict[str, str] = {
+    "indoor": "indoor_laptop_workspace",
+    "warehouse": "warehouse_storage_space",
+    "outdoor": "outdoor",
+}
+REQUESTED_VALUES = frozenset({"yes", "y", "ja", "j", "true", "1", "x"})
+# Denied bookings never hold a resource.
+INACTIVE_STATUSES = ("denied",)
+
+
+@dataclass(frozen=True)
+class BookingInterval:
+    booking_id: int
+    email: str
+    project: str
+    status: str
+    start_week: int
+    end_week: int
+    resources: frozenset[str]
+
+
+@dataclass(frozen=True)
+class Overlap:
+    resource: str
+    first: BookingInterval
+    second: BookingInterval
+    start_week: int
+    end_week: int
+
+    def other(self, booking_id: int) -> BookingInterval:
+        return self.second if self.first.booking_id == booking_id else self.first
+
+
+def is_requested(value: Optional[str]) -> bool:
+    return (value or "").strip().lower() in REQUESTED_VALUES
+
+
+def interval_from_booking(booking: sqlite3.Row) -> Optional[BookingInterval]:
+    """Build the interval of one ``bookings`` row; None without a parsed timeslot."""
+
+    if booking["start_week"] is None:
+        return None
+    return BookingInterval(
+        booking_id=booking["id"],
+        email=booking["email"],
+        project=booking["project"],
+        status=booking["status"],
+        start_week=booking["start_week"],
+        end_week=booking["end_week"],
+        resources=frozenset(
+            resource
+            for resource, column in RESOURCE_COLUMNS.items()
+            if is_requested(booking[column])
+        ),
+    )
+
+
+def load_intervals(
+    connection: sqlite3.Connection,
+    start_week: Optional[int] = None,
+    end_week: Optional[int] = None,
+    status: Optional[str] = None,
+) -> list[BookingInterval]:
+    """Load active bookings with a parsed timeslot.
+
+    With ``start_week``/``end_week`` only bookings overlapping that window are
+    read, using the ``(start_week, end_week)`` index. ``status`` narrows the
+    result to one booking status.
+    """
+
+    sql = (
+        "SELECT id, email, project, status, start_week, end_week,"
+        f" {', '.join(RESOURCE_COLUMNS.values())} FROM bookings"
+        " WHERE start_week IS NOT NULL"
+        f" AND status NOT IN ({', '.join('?' for _ in INACTIVE_STATUSES)})"
+    )
+    params: list[object] = list(INACTIVE_STATUSES)
+    if status is not None:
+        sql += " AND status = ?"
+        params.append(status)
+    if end_week is not None:
+        sql += " AND start_week <= ?"
+        params.append(end_week)
+    if start_week is not None:
+        sql += " AND end_week >= ?"
+        params.append(start_week)
+    return [
+        interval
+        for interval in map(interval_from_booking, connection.execute(sql, params))
+        if interval is not None
+    ]
+
+
+def sweep(intervals: Iterable[BookingInterval], resource: str) -> list[Overlap]:
+    """Return every overlapping pair of bookings that request ``resource``."""
+
+    ordered = sorted(
+        (interval for interval in intervals if resource in interval.resources),
+        key=lambda interval: (interval.start_week, interval.end_week, interval.booking_id),
+    )
+    # Week keys (year * 100 + week) sort like the weeks themselves.
+    active: list[tuple[int, int, BookingInterval]] = []
+    overlaps: list[Overlap] = []
+    for interval in ordered:
+        while active and active[0][0] < interval.start_week:
+            heapq.heappop(active)
+        for end_week, _, running in active:
+            overlaps.append(
+                Overlap(
+                    resource,
+                    running,
+                    interval,
+                    interval.start_week,
+                    min(end_week, interval.end_week),
+                )
+            )
+        heapq.heappush(active, (interval.end_week, interval.booking_id, interval))
+    return overlaps
+
+
+def find_conflicts(intervals: list[BookingInterval]) -> dict[str, list[Overlap]]:
+    """Run the sweep for every resource class."""
+
+    return {resource: sweep(intervals, resource) for resource in RESOURCE_COLUMNS}
+
+
+def conflicts_for_bookings(
+    connection: sqlite3.Connection, booking_ids: Iterable[int]
+) -> dict[int, list[Overlap]]:
+    """Return the overlaps of each given booking with any other active booking.
+
+    Only bookings within the combined week window of ``booking_ids`` are read.
+    """
+
+    wanted = set(booking_ids)
+    if not wanted:
+        return {}
+    placeholders = ", ".join("?" for _ in wanted)
+    window = connection.execute(
+        "SELECT min(start_week), max(end_week) FROM bookings"
+        f" WHERE id IN ({placeholders}) AND start_week IS NOT NULL",
+        list(wanted),
+    ).fetchone()
+    if window[0] is None:
+        return {}
+    result: dict[int, list[Overlap]] = {}
+    intervals = load_intervals(connection, window[0], window[1])
+    for overlaps in find_conflicts(intervals).values():
+        for overlap in overlaps:
+            for booking_id in (overlap.first.booking_id, overlap.second.booking_id):
+                if booking_id in wanted:
+                    result.setdefault(booking_id, []).append(overlap)
+    return result
@@ -2,13 +2,25 @@
 
 from __future__ import annotations
 
+import dataclasses
 import os
+import re
 import sqlite3
 import sys
+from contextlib import closing
 from pathlib import Path
 from typing import Iterable, Optional
 
-from flask import Flask, flash, redirect, render_template, request, url_for
+from flask import (
+    Flask,
+    Response,
+    flash,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
 from jinja2 import ChoiceLoader, FileSystemLoader
 
 BASE_DIR = Path(__file__).resolve().parents[1]
@@ -17,8 +29,22 @@ if SRC_DIR.exists():
     sys.path.insert(0, str(SRC_DIR))
 
 from email_automation.service import on_send_email_click
-from site_coordination import db
-from site_coordination.config import load_smtp_config
+from site_coordination import (
+    capacity,
+    conflicts,
+    db,
+    db_tools,
+    migrations,
+    pagination,
+    rollups,
+    screening,
+    search,
+    sessions,
+    timeslots,
+    timeutil,
+)
+from site_coordination.analysis import load_bookings, resource_pivot
+from site_coordination.config import load_session_policy, load_smtp_config
 from site_coordination.db_tools import get_connection
 from site_coordination.email_parser import (
     EmailParseError,
@@ -32,8 +58,12 @@ from site_coordination.notifications import (
     send_email,
 )
 from site_coordination.passwords import generate_password
-from site_coordination.processor import handle_access_request, handle_booking_request
+from site_coordination.presence import current_roster
+from site_coordination.processor import process_request
 from site_coordination.sharepoint_sync import start_sharepoint_sync
+from site_coordination.wal_checkpoint import start_wal_checkpoint
+
+PENDING_BOOKING_STATUSES = ("pending_review", "zu_ueberpruefen")
 
 
 def create_app() -> Flask:
@@ -53,9 +83,13 @@ def create_app() -> Flask:
             FileSystemLoader(str(legacy_templates_dir)),
         ],
     )
+    app.add_template_filter(timeslots.week_label, "week_label")
     app.secret_key = os.environ.get("SITE_COORDINATION_SECRET", "dev-secret")
+    db_tools.init_app(app)
     _ensure_database()
     app.extensions["sharepoint_sync"] = start_sharepoint_sync(app.logger)
+    app.extensions["wal_checkpoint"] = start_wal_checkpoint(app.logger)
+    session_policy = load_session_policy()
 
     @app.get("/")
     def index() -> str:
@@ -78,8 +112,8 @@ def create_app() -> Flask:
                     )
                     return redirect(url_for("registration_manual"))
                 with get_connection() as connection:
-                    result = handle_access_request(connection, parsed)
-                flash(result.message, "success")
+                    result = process_request(connection, parsed)
+                flash(result.message, "error" if result.duplicate else "success")
                 return redirect(url_for("registration_manual"))
             except EmailParseError as exc:
                 flash(f"Could not parse registration email: {exc}", "error")
@@ -95,7 +129,7 @@ def create_app() -> Flask:
             elif email and action == "deny":
                 _deny_registration(email)
         query = request.args.get("q", "").strip()
-        registrations = _fetch_registrations(query)
+        page = _fetch_registrations(query, *_page_request())
         status_labels = {
             "open": "Open",
             "offen": "Open",
@@ -104,7 +138,9 @@ def create_app() -> Flask:
         }
         return render_template(
             "registrations_manage.html",
-            registrations=registrations,
+            registrations=page.rows,
+            page=page,
+            page_args={"q": query},
             query=query,
             status_labels=status_labels,
         )
@@ -121,10 +157,12 @@ def create_app() -> Flask:
             if email and action == "send":
                 _send_user_credentials(email)
         query = request.args.get("q", "").strip()
-        users = _fetch_users(query)
+        page = _fetch_users(query, *_page_request())
         return render_template(
             "users_manage.html",
-            users=users,
+            users=page.rows,
+            page=page,
+            page_args={"q": query},
             query=query,
             credentials_preview=credentials_preview,
         )
@@ -140,8 +178,8 @@ def create_app() -> Flask:
             try:
                 parsed = parse_booking_request(raw_email)
                 with get_connection() as connection:
-                    result = handle_booking_request(connection, parsed)
-                flash(result.message, "success")
+                    result = process_request(connection, parsed)
+                flash(result.message, "error" if result.duplicate else "success")
                 return redirect(url_for("booking_manual"))
             except EmailParseError as exc:
                 flash(f"Could not parse booking email: {exc}", "error")
@@ -169,7 +207,21 @@ def create_app() -> Flask:
             elif booking_id and action == "send_response":
                 _send_booking_response(int(booking_id))
         query = request.args.get("q", "").strip()
-        bookings_list = _fetch_bookings(query)
+        verdict = request.args.get("verdict", "").strip()
+        if verdict not in screening.VERDICTS:
+            verdict = ""
+        page = _fetch_bookings(query, *_page_request(), verdict=verdict)
+        pending_ids = [
+            row["id"] for row in page.rows if row["status"] in PENDING_BOOKING_STATUSES
+        ]
+        with get_connection() as connection:
+            booking_conflicts = conflicts.conflicts_for_bookings(connection, pending_ids)
+            matrix = capacity.get_tracker().matrix(connection)
+        booking_capacity = {
+            row["id"]: matrix.free(row["start_week"], row["end_week"])
+            for row in page.rows
+            if row["id"] in pending_ids and row["start_week"] is not None
+        }
         status_labels = {
             "pending_review": "Pending review",
             "zu_ueberpruefen": "Pending review",
@@ -178,9 +230,16 @@ def create_app() -> Flask:
         }
         return render_template(
             "bookings_manage.html",
-            bookings=bookings_list,
+            bookings=page.rows,
+            page=page,
+            page_args={"q": query, "verdict": verdict},
             query=query,
+            verdict=verdict,
+            verdicts=screening.VERDICTS,
+            reason_labels=screening.REASON_LABELS,
             booking_preview=booking_preview,
+            booking_conflicts=booking_conflicts,
+            booking_capacity=booking_capacity,
             status_labels=status_labels,
         )
 
@@ -189,15 +248,17 @@ def create_app() -> Flask:
         table = request.args.get("table", "research")
         query = request.args.get("q", "").strip()
         if table == "service":
-            activity_rows = _fetch_activity_service(query)
+            page = _fetch_activity_service(query, *_page_request())
         else:
             table = "research"
-            activity_rows = _fetch_activity_research(query)
+            page = _fetch_activity_research(query, *_page_request())
         return render_template(
             "activities.html",
             table=table,
             query=query,
-            rows=activity_rows,
+            rows=page.rows,
+            page=page,
+            page_args={"q": query, "table": table},
         )
 
     @app.route("/analysis", methods=["GET", "POST"])
@@ -218,12 +279,23 @@ def create_app() -> Flask:
         booking_summary = _build_booking_summary(email_filter, start_date, end_date)
         user_activity = _build_user_activity_summary(email_filter, start_date, end_date)
         service_activity = _build_service_activity_summary(service_start, service_end)
+        resource_conflicts = _build_resource_conflicts(email_filter)
+        with get_connection() as connection:
+            research_hours = sessions.hours_summary(
+                connection, "research", start_date, end_date, email_filter
+            )
+            service_hours = sessions.hours_summary(
+                connection, "service", service_start, service_end
+            )
         return render_template(
             "analysis.html",
             selections=selections,
             booking_summary=booking_summary,
+            resource_conflicts=resource_conflicts,
             user_activity=user_activity,
             service_activity=service_activity,
+            research_hours=research_hours,
+            service_hours=service_hours,
             filters={
                 "email": email_filter,
                 "start_date": start_date,
@@ -233,30 +305,72 @@ def create_app() -> Flask:
             },
         )
 
+    @app.get("/api/capacity")
+    def api_capacity() -> tuple[Response, int]:
+        with get_connection() as connection:
+            result = capacity.lookup(
+                connection, request.args.get("start", ""), request.args.get("end", "")
+            )
+        if result is None:
+            return jsonify({"error": capacity.LOOKUP_ERROR}), 400
+        return jsonify(result), 200
+
+    @app.get("/roster")
+    def roster() -> str:
+        with get_connection() as connection:
+            people = current_roster(connection, session_policy)
+        return render_template("roster.html", people=people)
+
+    @app.get("/roster.json")
+    def roster_json() -> Response:
+        with get_connection() as connection:
+            people = current_roster(connection, session_policy)
+        return jsonify({"count": len(people), "people": people})
+
+    @app.route("/analysis/resources.csv")
+    def analysis_resources_csv() -> Response:
+        email_filter = request.args.get("email", "").strip().lower()
+        with get_connection() as connection:
+            frame = load_bookings(
+                connection,
+                email_filter,
+                request.args.get("start_date") or None,
+                request.args.get("end_date") or None,
+                resources=True,
+            )
+        pivot = resource_pivot(frame)
+        return Response(
+            pivot.to_csv(),
+            mimetype="text/csv",
+            headers={
+                "Content-Disposition": "attachment; filename=resources_by_project_week.csv"
+            },
+        )
+
     return app
 
 
 def _ensure_database() -> None:
-    with get_connection() as connection:
-        db.init_db(connection)
-        db.ensure_users_credentials_column(connection)
-        db.ensure_activity_research_name_columns(connection)
-        db.ensure_booking_request_columns(connection)
+    auto_migrate = db_tools.get_pool().config.auto_migrate
+    with closing(get_connection()) as connection:
+        migrations.ensure_schema(connection, auto_migrate=auto_migrate)
 
 
-def _fetch_registrations(query: str) -> list[sqlite3.Row]:
-    sql = "SELECT * FROM registrations"
-    params: list[str] = []
-    if query:
-        sql += (
-            " WHERE email LIKE ? OR first_name LIKE ? OR last_name LIKE ?"
-            " OR affiliation LIKE ? OR project LIKE ? OR status LIKE ?"
-        )
-        like_query = f"%{query}%"
-        params = [like_query] * 6
-    sql += " ORDER BY created_at DESC"
-    with get_connection() as connection:
-        return connection.execute(sql, params).fetchall()
+def _page_request() -> tuple[Optional[str], int]:
+    cursor = request.args.get("cursor") or None
+    return cursor, pagination.parse_page_size(request.args.get("page_size"))
+
+
+def _ranked_request() -> bool:
+    # "Best matches first" shows one page of the top matches; see
+    # search.search_listing.
+    return request.args.get("sort") == "relevance"
+
+
+def _fetch_registrations(
+    query: str, cursor: Optional[str], page_size: int
+) -> pagination.Page:
+    return _fetch_listing("registrations", query, cursor, page_size)
 
 
 def _user_exists(email: str) -> bool:
@@ -270,76 +384,102 @@ def _user_exists(email: str) -> bool:
     return row is not None
 
 
-def _fetch_bookings(query: str) -> list[sqlite3.Row]:
-    sql = "SELECT * FROM bookings"
-    params: list[str] = []
-    if query:
-        sql += (
-            " WHERE email LIKE ? OR first_name LIKE ? OR last_name LIKE ?"
-            " OR project LIKE ? OR timeslot_raw LIKE ? OR status LIKE ?"
+def _fetch_bookings(
+    query: str, cursor: Optional[str], page_size: int, verdict: str = ""
+) -> pagination.Page:
+    if verdict:
+        return _fetch_listing(
+            "bookings",
+            query,
+            cursor,
+            page_size,
+            where=("bookings.screening_verdict = ?",),
+            params=(verdict,),
         )
-        like_query = f"%{query}%"
-        params = [like_query] * 6
-    sql += " ORDER BY created_at DESC"
-    with get_connection() as connection:
-        return connection.execute(sql, params).fetchall()
+    return _fetch_listing("bookings", query, cursor, page_size)
 
 
-def _fetch_users(query: str) -> list[sqlite3.Row]:
-    sql = "SELECT * FROM users"
-    params: list[str] = []
-    if query:
-        sql += (
-            " WHERE email LIKE ? OR first_name LIKE ? OR last_name LIKE ?"
-            " OR affiliation LIKE ? OR project LIKE ? OR phone LIKE ?"
-        )
-        like_query = f"%{query}%"
-        params = [like_query] * 6
-    sql += " ORDER BY created_at DESC"
-    with get_connection() as connection:
-        return connection.execute(sql, params).fetchall()
+def _fetch_users(query: str, cursor: Optional[str], page_size: int) -> pagination.Page:
+    return _fetch_listing("users", query, cursor, page_size)
 
 
-def _fetch_activity_research(query: str) -> list[sqlite3.Row]:
-    sql = "SELECT * FROM activity_research"
-    params: list[str] = []
-    if query:
-        sql += (
-            " WHERE email LIKE ? OR first_name LIKE ? OR last_name LIKE ?"
-            " OR project LIKE ? OR presence LIKE ? OR created_at LIKE ?"
-        )
-        like_query, created_query = _activity_like_terms(query)
-        params = [like_query] * 5 + [created_query]
-    sql += " ORDER BY created_at DESC"
-    with get_connection() as connection:
-        return connection.execute(sql, params).fetchall()
+def _fetch_activity_research(
+    query: str, cursor: Optional[str], page_size: int
+) -> pagination.Page:
+    return _fetch_listing("activity_research", query, cursor, page_size, by_date=True)
 
 
-def _fetch_activity_service(query: str) -> list[sqlite3.Row]:
-    sql = "SELECT * FROM activity_service_provider"
-    params: list[str] = []
-    if query:
-        sql += (
-            " WHERE name LIKE ? OR company LIKE ? OR service LIKE ? OR presence LIKE ?"
-            " OR created_at LIKE ?"
-        )
-        like_query, created_query = _activity_like_terms(query)
-        params = [like_query] * 4 + [created_query]
-    sql += " ORDER BY created_at DESC"
-    with get_connection() as connection:
-        return connection.execute(sql, params).fetchall()
+def _fetch_activity_service(
+    query: str, cursor: Optional[str], page_size: int
+) -> pagination.Page:
+    return _fetch_listing(
+        "activity_service_provider", query, cursor, page_size, by_date=True
+    )
 
 
-def _activity_like_terms(query: str) -> tuple[str, str]:
+def _fetch_listing(
+    table: str,
+    query: str,
+    cursor: Optional[str],
+    page_size: int,
+    by_date: bool = False,
+    where: tuple[str, ...] = (),
+    params: tuple = (),
+) -> pagination.Page:
     query = query.strip()
-    if not query:
-        return ("", "")
-    like_query = f"%{query}%"
+    created_prefix = _created_at_prefix(query) if by_date and query else None
+    ranked = False
+    with get_connection() as connection:
+        if created_prefix:
+            bounds = (created_prefix, f"{created_prefix}~")
+            listing = pagination.Listing(
+                source=table,
+                columns="*, rowid AS row_key",
+                keys=("created_at", "rowid"),
+                where=("created_at >= ?", "created_at < ?"),
+                params=bounds,
+            )
+            total = connection.execute(
+                f"SELECT count(*) FROM {table} WHERE created_at >= ? AND created_at < ?",
+                bounds,
+            ).fetchone()[0]
+        elif query:
+            ranked = _ranked_request()
+            if ranked:
+                cursor = None
+            listing = search.search_listing(table, query, ranked)
+            if listing is None:
+                return pagination.Page(rows=[], page_size=page_size, approx_total=0)
+            total = search.count_matches(connection, table, query)
+        else:
+            listing = pagination.Listing(
+                source=table,
+                columns="*, rowid AS row_key",
+                keys=("created_at", "rowid"),
+            )
+            total = pagination.approximate_row_count(connection, table)
+        if where:
+            listing = dataclasses.replace(
+                listing, where=listing.where + where, params=listing.params + params
+            )
+            total = connection.execute(
+                f"SELECT count(*) FROM {listing.source}"
+                f" WHERE {' AND '.join(listing.where)}",
+                listing.params,
+            ).fetchone()[0]
+        page = pagination.fetch_page(connection, listing, cursor, page_size, total)
+    if ranked:
+        return dataclasses.replace(page, next_cursor=None, prev_cursor=None)
+    return page
+
+
+def _created_at_prefix(query: str) -> str | None:
     normalized_date = _normalize_date_query(query)
-    created_query = like_query
-    if normalized_date and normalized_date != query:
-        created_query = f"%{normalized_date}%"
-    return like_query, created_query
+    if normalized_date:
+        return normalized_date
+    if re.fullmatch(r"\d{4}(-\d{2}){0,2}", query):
+        return query
+    return None
 
 
 def _normalize_date_query(query: str) -> str | None:
@@ -395,19 +535,26 @@ def _approve_booking(booking_id: int) -> None:
             return
         connection.execute(
             "UPDATE bookings SET status = ? WHERE id = ?",
-            ("gebucht", booking_id),
+            (capacity.BOOKED_STATUS, booking_id),
         )
         connection.commit()
+        capacity.get_tracker().status_changed(connection, row, capacity.BOOKED_STATUS)
     flash(f"Booking approved for {row['email']}.", "success")
 
 
 def _deny_booking(booking_id: int) -> None:
     with get_connection() as connection:
+        row = connection.execute(
+            "SELECT * FROM bookings WHERE id = ?",
+            (booking_id,),
+        ).fetchone()
         connection.execute(
             "UPDATE bookings SET status = ? WHERE id = ?",
             ("denied", booking_id),
         )
         connection.commit()
+        if row is not None:
+            capacity.get_tracker().status_changed(connection, row, "denied")
     flash("Booking denied.", "success")
 
 
@@ -551,92 +698,159 @@ def _analysis_selections() -> Iterable[str]:
         return db.fetch_user_emails(connection)
 
 
+def _created_ts_range(
+    start_date: Optional[str], end_date: Optional[str]
+) -> tuple[str, list[int]]:
+    start_ts, end_ts = timeutil.local_date_bounds(start_date, end_date)
+    sql = ""
+    params: list[int] = []
+    if start_ts is not None:
+        sql += " AND created_ts >= ?"
+        params.append(start_ts)
+    if end_ts is not None:
+        sql += " AND created_ts < ?"
+        params.append(end_ts)
+    return sql, params
+
+
+def _day_range(
+    start_date: Optional[str], end_date: Optional[str]
+) -> tuple[str, list[str]]:
+    start = timeutil.parse_date(start_date)
+    end = timeutil.parse_date(end_date)
+    sql = ""
+    params: list[str] = []
+    if start:
+        sql += " AND day >= ?"
+        params.append(start.isoformat())
+    if end:
+        sql += " AND day <= ?"
+        params.append(end.isoformat())
+    return sql, params
+
+
 def _build_booking_summary(
     email_filter: str,
     start_date: Optional[str],
     end_date: Optional[str],
 ) -> dict:
-    base_sql = "SELECT * FROM bookings WHERE 1=1"
-    params: list[str] = []
-    if email_filter:
-        base_sql += " AND email = ?"
-        params.append(email_filter)
-    if start_date:
-        base_sql += " AND date(created_at) >= date(?)"
-        params.append(start_date)
-    if end_date:
-        base_sql += " AND date(created_at) <= date(?)"
-        params.append(end_date)
+    if email_filter or start_date or end_date:
+        # The rollup has no email or creation date, so filtered views
+        # aggregate the indexed slice of raw rows instead.
+        base_sql = (
+            "SELECT coalesce(start_week, 0) AS start_week,"
+            " coalesce(end_week, 0) AS end_week, project, count(*) AS total"
+            " FROM bookings WHERE 1=1"
+        )
+        params: list[object] = []
+        if email_filter:
+            base_sql += " AND email = ?"
+            params.append(email_filter)
+        range_sql, range_params = _created_ts_range(start_date, end_date)
+        base_sql += range_sql + " GROUP BY 1, 2, project"
+        params.extend(range_params)
+    else:
+        base_sql = (
+            "SELECT start_week, end_week, project, total"
+            f" FROM {rollups.BOOKING_SLOTS.table}"
+        )
+        params = []
     with get_connection() as connection:
         rows = connection.execute(base_sql, params).fetchall()
 
+    # A booking counts in every week it covers; unparsed timeslots are "unknown".
     week_counts: dict[str, int] = {}
     week_projects: dict[str, dict[str, int]] = {}
+    total = 0
     for row in rows:
-        week = _extract_week(row["timeslot_raw"])
-        week_counts[week] = week_counts.get(week, 0) + 1
-        project = row["project"]
-        week_projects.setdefault(week, {})
-        week_projects[week][project] = week_projects[week].get(project, 0) + 1
-
+        total += row["total"]
+        if row["start_week"]:
+            weeks = timeslots.iter_weeks(row["start_week"], row["end_week"])
+        else:
+            weeks = iter((0,))
+        for key in weeks:
+            week = timeslots.week_label(key)
+            week_counts[week] = week_counts.get(week, 0) + row["total"]
+            projects = week_projects.setdefault(week, {})
+            projects[row["project"]] = projects.get(row["project"], 0) + row["total"]
+
+    week_counts = dict(sorted(week_counts.items()))
+    week_projects = {
+        week: dict(sorted(week_projects[week].items())) for week in week_counts
+    }
     conflicts = {week: count for week, count in week_counts.items() if count > 1}
     return {
-        "total": len(rows),
+        "total": total,
         "week_counts": week_counts,
         "week_projects": week_projects,
         "conflicts": conflicts,
     }
 
 
+def _build_resource_conflicts(email_filter: str) -> dict[str, list[conflicts.Overlap]]:
+    with get_connection() as connection:
+        intervals = conflicts.load_intervals(connection)
+    found = conflicts.find_conflicts(intervals)
+    if email_filter:
+        found = {
+            resource: [
+                overlap
+                for overlap in overlaps
+                if email_filter in (overlap.first.email, overlap.second.email)
+            ]
+            for resource, overlaps in found.items()
+        }
+    return found
+
+
 def _build_user_activity_summary(
     email_filter: str,
     start_date: Optional[str],
     end_date: Optional[str],
 ) -> dict:
-    base_sql = "SELECT * FROM activity_research WHERE 1=1"
+    base_sql = (
+        f"SELECT email, project, total FROM {rollups.RESEARCH_DAILY.table} WHERE 1=1"
+    )
     params: list[str] = []
     if email_filter:
         base_sql += " AND email = ?"
         params.append(email_filter)
-    if start_date:
-        base_sql += " AND date(created_at) >= date(?)"
-        params.append(start_date)
-    if end_date:
-        base_sql += " AND date(created_at) <= date(?)"
-        params.append(end_date)
+    range_sql, range_params = _day_range(start_date, end_date)
+    base_sql += range_sql
+    params.extend(range_params)
+    sql = (
+        "SELECT email, project, sum(total) AS total"
+        f" FROM ({base_sql}) GROUP BY email, project ORDER BY email, project"
+    )
     with get_connection() as connection:
-        rows = connection.execute(base_sql, params).fetchall()
+        rows = connection.execute(sql, params).fetchall()
     per_user: dict[str, int] = {}
+    per_project: dict[str, int] = {}
     for row in rows:
-        per_user[row["email"]] = per_user.get(row["email"], 0) + 1
-    return {"total": len(rows), "per_user": per_user}
+        per_user[row["email"]] = per_user.get(row["email"], 0) + row["total"]
+        per_project[row["project"]] = per_project.get(row["project"], 0) + row["total"]
+    return {
+        "total": sum(per_user.values()),
+        "per_user": per_user,
+        "per_project": dict(sorted(per_project.items())),
+    }
 
 
 def _build_service_activity_summary(
     start_date: Optional[str],
     end_date: Optional[str],
 ) -> dict:
-    base_sql = "SELECT * FROM activity_service_provider WHERE 1=1"
-    params: list[str] = []
-    if start_date:
-        base_sql += " AND date(created_at) >= date(?)"
-        params.append(start_date)
-    if end_date:
-        base_sql += " AND date(created_at) <= date(?)"
-        params.append(end_date)
+    base_sql = f"SELECT service, total FROM {rollups.SERVICE_DAILY.table} WHERE 1=1"
+    range_sql, params = _day_range(start_date, end_date)
+    base_sql += range_sql
+    sql = (
+        "SELECT service, sum(total) AS total"
+        f" FROM ({base_sql}) GROUP BY service ORDER BY service"
+    )
     with get_connection() as connection:
-        rows = connection.execute(base_sql, params).fetchall()
-    per_service: dict[str, int] = {}
-    for row in rows:
-        per_service[row["service"]] = per_service.get(row["service"], 0) + 1
-    return {"total": len(rows), "per_service": per_service}
-
-
-def _extract_week(timeslot_raw: str) -> str:
-    if not timeslot_raw:
-        return "unknown"
-    parts = [part.strip() for part in timeslot_raw.split(";") if part.strip()]
-    return parts[0] if parts else "unknown"
+        rows = connection.execute(sql, params).fetchall()
+    per_service = {row["service"]: row["total"] for row in rows}
+    return {"total": sum(per_service.values()), "per_service": per_service}
 
 
 def _debug_enabled() -> bool:
@@ -2,10 +2,14 @@
 
 from __future__ import annotations
 
+from contextlib import contextmanager
 from dataclasses import dataclass
 from pathlib import Path
 import sqlite3
-from typing import Iterable
+from typing import Iterable, Iterator, Optional
+
+from . import migrations
+from .config import ConnectionProfile
 
 
 @dataclass(frozen=True)
@@ -34,180 +38,196 @@ class BookingRecord:
     outdoor_type: str
     equipment: str
     status: str
+    start_week: Optional[int] = None
+    end_week: Optional[int] = None
+    week_count: Optional[int] = None
+    screening_verdict: Optional[str] = None
+    screening_reasons: Optional[str] = None
+
 
+@dataclass(frozen=True)
+class UserRecord:
+    email: str
+    password: str
+    first_name: str
+    last_name: str
+    affiliation: str
+    project: str
+    phone: str
 
-def connect(db_path: Path) -> sqlite3.Connection:
+
+@dataclass(frozen=True)
+class RowOutcome:
+    """Result of one row of a batch insert; ``error`` is None if it was stored."""
+
+    index: int
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def connect(
+    db_path: Path,
+    *,
+    profile: Optional[ConnectionProfile] = None,
+    cached_statements: int = 128,
+    check_same_thread: bool = True,
+) -> sqlite3.Connection:
     """Connect to the SQLite database."""
 
     db_path.parent.mkdir(parents=True, exist_ok=True)
-    connection = sqlite3.connect(db_path)
+    connection = sqlite3.connect(
+        db_path,
+        cached_statements=cached_statements,
+        check_same_thread=check_same_thread,
+    )
     connection.row_factory = sqlite3.Row
+    if profile is not None:
+        apply_connection_profile(connection, profile)
     return connection
 
 
-def init_db(connection: sqlite3.Connection) -> None:
-    """Create the required tables if they do not exist."""
-
-    cursor = connection.cursor()
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS registrations (
-            email TEXT PRIMARY KEY,
-            first_name TEXT NOT NULL,
-            last_name TEXT NOT NULL,
-            affiliation TEXT NOT NULL,
-            project TEXT NOT NULL,
-            phone TEXT NOT NULL,
-            activity TEXT NOT NULL,
-            status TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """
-    )
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            email TEXT PRIMARY KEY,
-            password TEXT NOT NULL,
-            first_name TEXT NOT NULL,
-            last_name TEXT NOT NULL,
-            affiliation TEXT NOT NULL,
-            project TEXT NOT NULL,
-            phone TEXT NOT NULL,
-            credentials_sent INTEGER NOT NULL DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """
-    )
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS bookings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT NOT NULL,
-            first_name TEXT NOT NULL,
-            last_name TEXT NOT NULL,
-            project TEXT NOT NULL,
-            timeslot_raw TEXT NOT NULL,
-            duration_weeks TEXT NOT NULL,
-            indoor_laptop_workspace TEXT NOT NULL,
-            warehouse_storage_space TEXT NOT NULL,
-            outdoor TEXT NOT NULL,
-            outdoor_type TEXT NOT NULL,
-            equipment TEXT NOT NULL,
-            status TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (email) REFERENCES users(email)
-        )
-        """
-    )
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS activity_research (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT NOT NULL,
-            first_name TEXT NOT NULL,
-            last_name TEXT NOT NULL,
-            project TEXT NOT NULL,
-            presence TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (email) REFERENCES users(email)
-        )
-        """
-    )
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS activity_service_provider (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            company TEXT NOT NULL,
-            mobile TEXT NOT NULL,
-            service TEXT NOT NULL,
-            presence TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """
-    )
+def apply_connection_profile(
+    connection: sqlite3.Connection, profile: ConnectionProfile
+) -> None:
+    """Apply the PRAGMA profile to a freshly opened connection.
+
+    The values are validated by ``config.load_connection_profile`` because
+    PRAGMA arguments cannot be bound as parameters.
+    """
+
+    connection.execute(f"PRAGMA busy_timeout = {int(profile.busy_timeout_ms)}")
+    connection.execute(f"PRAGMA journal_mode = {profile.journal_mode}")
+    connection.execute(f"PRAGMA synchronous = {profile.synchronous}")
+    connection.execute(f"PRAGMA cache_size = {-int(profile.cache_size_kib)}")
+    connection.execute(f"PRAGMA mmap_size = {int(profile.mmap_size)}")
+    connection.execute(f"PRAGMA temp_store = {profile.temp_store}")
+    connection.execute(f"PRAGMA journal_size_limit = {int(profile.journal_size_limit)}")
+
+
+def checkpoint_wal(
+    connection: sqlite3.Connection, mode: str = "PASSIVE"
+) -> tuple[int, int, int]:
+    """Run a WAL checkpoint and return (busy, log_frames, checkpointed_frames)."""
+
+    row = connection.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    return (row[0], row[1], row[2])
+
+
+@contextmanager
+def transaction(
+    connection: sqlite3.Connection, immediate: bool = True
+) -> Iterator[sqlite3.Connection]:
+    """Run the block in one transaction: commit on success, roll back on error.
+
+    ``BEGIN IMMEDIATE`` takes the write lock up front, so a batch never fails
+    halfway on a busy database. Inside an open transaction the block simply
+    joins it, and the outer caller decides when to commit.
+    """
+
+    if connection.in_transaction:
+        yield connection
+        return
+    connection.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield connection
+    except BaseException:
+        connection.rollback()
+        raise
     connection.commit()
 
 
-def ensure_users_credentials_column(connection: sqlite3.Connection) -> None:
-    """Ensure users table has the credentials_sent column."""
-
-    columns = {
-        row["name"]
-        for row in connection.execute("PRAGMA table_info(users)").fetchall()
-    }
-    if "credentials_sent" not in columns:
-        connection.execute(
-            "ALTER TABLE users ADD COLUMN credentials_sent INTEGER NOT NULL DEFAULT 0"
-        )
-        connection.commit()
+def _insert_many(
+    connection: sqlite3.Connection, sql: str, rows: Iterable[tuple]
+) -> list[RowOutcome]:
+    """Run ``sql`` for every row and report each row's outcome.
+
+    The rows go through one ``executemany``. If any row fails, that attempt is
+    rolled back to a savepoint and the rows are retried one by one, so every
+    valid row is kept and each failing row reports its error.
+    """
+
+    rows = list(rows)
+    if not connection.in_transaction:
+        # A savepoint outside a transaction would commit on release.
+        connection.execute("BEGIN")
+    connection.execute("SAVEPOINT insert_many")
+    try:
+        try:
+            connection.executemany(sql, rows)
+            return [RowOutcome(index) for index in range(len(rows))]
+        except sqlite3.DatabaseError:
+            connection.execute("ROLLBACK TO insert_many")
+        outcomes = []
+        for index, row in enumerate(rows):
+            connection.execute("SAVEPOINT insert_row")
+            try:
+                connection.execute(sql, row)
+            except sqlite3.DatabaseError as exc:
+                connection.execute("ROLLBACK TO insert_row")
+                outcomes.append(RowOutcome(index, str(exc)))
+            else:
+                outcomes.append(RowOutcome(index))
+            connection.execute("RELEASE insert_row")
+        return outcomes
+    finally:
+        connection.execute("RELEASE insert_many")
 
 
-def ensure_activity_research_name_columns(connection: sqlite3.Connection) -> None:
-    """Ensure activity_research table has first_name and last_name columns."""
-
-    columns = {
-        row["name"]
-        for row in connection.execute("PRAGMA table_info(activity_research)").fetchall()
-    }
-    if "first_name" not in columns:
-        connection.execute(
-            "ALTER TABLE activity_research ADD COLUMN first_name TEXT NOT NULL DEFAULT ''"
-        )
-    if "last_name" not in columns:
-        connection.execute(
-            "ALTER TABLE activity_research ADD COLUMN last_name TEXT NOT NULL DEFAULT ''"
-        )
-    if "first_name" not in columns or "last_name" not in columns:
-        connection.commit()
+def init_db(connection: sqlite3.Connection) -> None:
+    """Create the required tables or upgrade them to the latest schema version."""
+
+    migrations.migrate(connection)
+
+
+# An upsert updates the row in place: created_at and the rowid stay, and the
+# FTS index sees one UPDATE instead of a delete and a reinsert.
+_REGISTRATION_INSERT = """
+    INSERT INTO registrations (
+        email, first_name, last_name, affiliation, project, phone, activity, status
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(email) DO UPDATE SET
+        first_name = excluded.first_name,
+        last_name = excluded.last_name,
+        affiliation = excluded.affiliation,
+        project = excluded.project,
+        phone = excluded.phone,
+        activity = excluded.activity,
+        status = excluded.status
+"""
+
+
+def _registration_row(record: RegistrationRecord) -> tuple:
+    return (
+        record.email,
+        record.first_name,
+        record.last_name,
+        record.affiliation,
+        record.project,
+        record.phone,
+        record.activity,
+        record.status,
+    )
 
 
-def ensure_booking_request_columns(connection: sqlite3.Connection) -> None:
-    """Ensure bookings table matches the current booking request schema."""
+def insert_registration(
+    connection: sqlite3.Connection, record: RegistrationRecord, commit: bool = True
+) -> None:
+    """Insert a registration record; with ``commit=False`` the caller commits."""
 
-    columns = {
-        row["name"]
-        for row in connection.execute("PRAGMA table_info(bookings)").fetchall()
-    }
-    changed = False
-    if "indoor" in columns and "indoor_laptop_workspace" not in columns:
-        connection.execute(
-            "ALTER TABLE bookings RENAME COLUMN indoor TO indoor_laptop_workspace"
-        )
-        columns.remove("indoor")
-        columns.add("indoor_laptop_workspace")
-        changed = True
-    if "warehouse_storage_space" not in columns:
-        connection.execute(
-            "ALTER TABLE bookings ADD COLUMN warehouse_storage_space TEXT NOT NULL DEFAULT ''"
-        )
-        changed = True
-    if changed:
+    connection.execute(_REGISTRATION_INSERT, _registration_row(record))
+    if commit:
         connection.commit()
 
 
-def insert_registration(connection: sqlite3.Connection, record: RegistrationRecord) -> None:
-    """Insert a registration record."""
+def insert_registrations_many(
+    connection: sqlite3.Connection, records: Iterable[RegistrationRecord]
+) -> list[RowOutcome]:
+    """Insert registrations with one ``executemany``; the caller commits."""
 
-    connection.execute(
-        """
-        INSERT OR REPLACE INTO registrations (
-            email, first_name, last_name, affiliation, project, phone, activity, status
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            record.email,
-            record.first_name,
-            record.last_name,
-            record.affiliation,
-            record.project,
-            record.phone,
-            record.activity,
-            record.status,
-        ),
-    )
-    connection.commit()
+    return _insert_many(connection, _REGISTRATION_INSERT, map(_registration_row, records))
 
 
 def update_registration_status(
@@ -222,6 +242,13 @@ def update_registration_status(
     connection.commit()
 
 
+_USER_INSERT = """
+    INSERT OR REPLACE INTO users (
+        email, password, first_name, last_name, affiliation, project, phone
+    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+
 def insert_user(
     connection: sqlite3.Connection,
     email: str,
@@ -235,43 +262,81 @@ def insert_user(
     """Insert a user record."""
 
     connection.execute(
-        """
-        INSERT OR REPLACE INTO users (
-            email, password, first_name, last_name, affiliation, project, phone
-        ) VALUES (?, ?, ?, ?, ?, ?, ?)
-        """,
+        _USER_INSERT,
         (email, password, first_name, last_name, affiliation, project, phone),
     )
     connection.commit()
 
 
-def insert_booking(connection: sqlite3.Connection, record: BookingRecord) -> None:
-    """Insert a booking record."""
+def insert_users_many(
+    connection: sqlite3.Connection, records: Iterable[UserRecord]
+) -> list[RowOutcome]:
+    """Insert users with one ``executemany``; the caller commits."""
 
-    connection.execute(
-        """
-        INSERT INTO bookings (
-            email, first_name, last_name, project, timeslot_raw, duration_weeks,
-            indoor_laptop_workspace, warehouse_storage_space, outdoor, outdoor_type,
-            equipment, status
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
+    rows = (
         (
             record.email,
+            record.password,
             record.first_name,
             record.last_name,
+            record.affiliation,
             record.project,
-            record.timeslot_raw,
-            record.duration_weeks,
-            record.indoor_laptop_workspace,
-            record.warehouse_storage_space,
-            record.outdoor,
-            record.outdoor_type,
-            record.equipment,
-            record.status,
-        ),
+            record.phone,
+        )
+        for record in records
     )
-    connection.commit()
+    return _insert_many(connection, _USER_INSERT, rows)
+
+
+_BOOKING_INSERT = """
+    INSERT INTO bookings (
+        email, first_name, last_name, project, timeslot_raw, duration_weeks,
+        indoor_laptop_workspace, warehouse_storage_space, outdoor, outdoor_type,
+        equipment, status, start_week, end_week, week_count, screening_verdict,
+        screening_reasons
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _booking_row(record: BookingRecord) -> tuple:
+    return (
+        record.email,
+        record.first_name,
+        record.last_name,
+        record.project,
+        record.timeslot_raw,
+        record.duration_weeks,
+        record.indoor_laptop_workspace,
+        record.warehouse_storage_space,
+        record.outdoor,
+        record.outdoor_type,
+        record.equipment,
+        record.status,
+        record.start_week,
+        record.end_week,
+        record.week_count,
+        record.screening_verdict,
+        record.screening_reasons,
+    )
+
+
+def insert_booking(
+    connection: sqlite3.Connection, record: BookingRecord, commit: bool = True
+) -> int:
+    """Insert a booking and return its id; with ``commit=False`` the caller commits."""
+
+    booking_id = connection.execute(_BOOKING_INSERT, _booking_row(record)).lastrowid
+    if commit:
+        connection.commit()
+    return booking_id
+
+
+def insert_bookings_many(
+    connection: sqlite3.Connection, records: Iterable[BookingRecord]
+) -> list[RowOutcome]:
+    """Insert bookings with one ``executemany``; the caller commits."""
+
+    return _insert_many(connection, _BOOKING_INSERT, map(_booking_row, records))
 
 
 def fetch_user_emails(connection: sqlite3.Connection) -> Iterable[str]:
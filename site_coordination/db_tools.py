@@ -2,18 +2,124 @@
 
 from __future__ import annotations
 
+import queue
 import sqlite3
-from pathlib import Path
+import threading
+from typing import Optional
 
-from site_coordination.config import load_database_config
+from flask import Flask, g, has_app_context
+
+from site_coordination import db
+from site_coordination.config import DatabaseConfig, load_database_config
+
+_REQUEST_CONNECTION_KEY = "site_coordination_connection"
+
+
+class ConnectionPool:
+    """Bounded pool of configured SQLite connections.
+
+    Up to ``pool_size`` idle connections are kept for reuse. Connections opened
+    beyond that during bursts are closed when they are released.
+    """
+
+    def __init__(self, config: DatabaseConfig) -> None:
+        self._config = config
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue(
+            maxsize=config.pool_size
+        )
+
+    @property
+    def config(self) -> DatabaseConfig:
+        return self._config
+
+    def open(self) -> sqlite3.Connection:
+        """Open a new connection with the per-connection setup applied."""
+
+        return db.connect(
+            self._config.path,
+            profile=self._config.profile,
+            cached_statements=self._config.statement_cache_size,
+            check_same_thread=False,
+        )
+
+    def acquire(self) -> sqlite3.Connection:
+        """Return an idle connection or open a new one."""
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self.open()
+
+    def release(self, connection: sqlite3.Connection) -> None:
+        """Return a connection to the pool, discarding uncommitted work."""
+
+        if connection.in_transaction:
+            connection.rollback()
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def close(self) -> None:
+        """Close all idle connections."""
+
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            connection.close()
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Return the process-wide connection pool, creating it on first use."""
+
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(load_database_config())
+    return _pool
+
+
+def reset_pool() -> None:
+    """Close the process-wide pool so the next call re-reads the configuration."""
+
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = None
 
 
 def get_connection() -> sqlite3.Connection:
-    """Return a configured SQLite connection."""
+    """Return a configured SQLite connection.
+
+    Inside a Flask application context the connection is bound to ``flask.g``
+    and shared by every helper for the rest of the request. Outside of an
+    application context a new connection is opened for the caller.
+    """
 
-    config = load_database_config()
-    db_path = Path(config.path)
-    db_path.parent.mkdir(parents=True, exist_ok=True)
-    connection = sqlite3.connect(db_path)
-    connection.row_factory = sqlite3.Row
+    if not has_app_context():
+        return get_pool().open()
+    connection = g.get(_REQUEST_CONNECTION_KEY)
+    if connection is None:
+        connection = get_pool().acquire()
+        setattr(g, _REQUEST_CONNECTION_KEY, connection)
     return connection
+
+
+def _release_request_connection(exc: Optional[BaseException] = None) -> None:
+    connection = g.pop(_REQUEST_CONNECTION_KEY, None)
+    if connection is not None:
+        get_pool().release(connection)
+
+
+def init_app(app: Flask) -> None:
+    """Return request-scoped connections to the pool on teardown."""
+
+    app.teardown_appcontext(_release_request_connection)
@@ -1,9 +1,18 @@
-"""Email parsing for WordPress form submissions."""
+"""Email parsing for WordPress form submissions.
+
+:func:`iter_requests` walks a body once and yields every
+``BEGIN_*_V1`` ... ``END_*_V1`` block it finds, so a digest email can carry
+many submissions of either type. Each block is parsed on its own; a broken
+block carries its error and position, and the blocks after it still parse.
+"""
 
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Dict, Optional
+import re
+from typing import Callable, Dict, Iterator, Optional, Union
+
+from .timeslots import Timeslot, parse_timeslot
 
 ACCESS_REQUEST_MARKER = "BEGIN_ACCESS_REQUEST_V1"
 ACCESS_REQUEST_END = "END_ACCESS_REQUEST_V1"
@@ -11,6 +20,12 @@ BOOKING_REQUEST_MARKER = "BEGIN_BOOKING_REQUEST_V1"
 BOOKING_REQUEST_END = "END_BOOKING_REQUEST_V1"
 
 
+ACCESS_REQUEST = "ACCESS_REQUEST"
+BOOKING_REQUEST = "BOOKING_REQUEST"
+
+_MARKER_PATTERN = re.compile(r"\b(BEGIN|END)_(ACCESS_REQUEST|BOOKING_REQUEST)_V1\b")
+
+
 class EmailParseError(ValueError):
     """Raised when an email cannot be parsed."""
 
@@ -39,6 +54,7 @@ class BookingRequest:
     outdoor: str
     outdoor_type: str
     equipment: str
+    timeslot: Optional[Timeslot] = None
 
 
 def _parse_key_values(lines: list[str]) -> Dict[str, str]:
@@ -53,17 +69,7 @@ def _parse_key_values(lines: list[str]) -> Dict[str, str]:
     return data
 
 
-def parse_access_request(body: str) -> AccessRequest:
-    """Parse an access request email body."""
-
-    if ACCESS_REQUEST_MARKER not in body:
-        raise EmailParseError("Missing access request marker.")
-
-    start_index = body.index(ACCESS_REQUEST_MARKER) + len(ACCESS_REQUEST_MARKER)
-    end_index = body.index(ACCESS_REQUEST_END)
-    payload = body[start_index:end_index].strip()
-    lines = payload.splitlines()
-
+def _access_request(lines: list[str]) -> AccessRequest:
     activity_start: Optional[int] = None
     activity_end: Optional[int] = None
     for idx, line in enumerate(lines):
@@ -104,16 +110,8 @@ def parse_access_request(body: str) -> AccessRequest:
     )
 
 
-def parse_booking_request(body: str) -> BookingRequest:
-    """Parse a booking request email body."""
-
-    if BOOKING_REQUEST_MARKER not in body:
-        raise EmailParseError("Missing booking request marker.")
-
-    start_index = body.index(BOOKING_REQUEST_MARKER) + len(BOOKING_REQUEST_MARKER)
-    end_index = body.index(BOOKING_REQUEST_END)
-    payload = body[start_index:end_index].strip()
-    data = _parse_key_values(payload.splitlines())
+def _booking_request(lines: list[str]) -> BookingRequest:
+    data = _parse_key_values(lines)
 
     required = [
         "first_name",
@@ -144,4 +142,111 @@ def parse_booking_request(body: str) -> BookingRequest:
         outdoor=data["outdoor"],
         outdoor_type=data["outdoor_type"],
         equipment=data["equipment"],
+        timeslot=parse_timeslot(data["timeslot_raw"], data["duration_weeks"]),
     )
+
+
+Request = Union[AccessRequest, BookingRequest]
+
+_BLOCK_PARSERS: dict[str, Callable[[list[str]], Request]] = {
+    ACCESS_REQUEST: _access_request,
+    BOOKING_REQUEST: _booking_request,
+}
+
+
+@dataclass(frozen=True)
+class RequestBlock:
+    """One request block of an email body, parsed or with the reason it failed."""
+
+    kind: str
+    # Offset and 1-based line of the BEGIN marker.
+    start: int
+    line: int
+    request: Optional[Request] = None
+    error: str = ""
+
+
+def _parse_block(kind: str, start: int, line: int, payload: str) -> RequestBlock:
+    try:
+        request = _BLOCK_PARSERS[kind](payload.strip().splitlines())
+    except EmailParseError as exc:
+        return RequestBlock(kind, start, line, error=str(exc))
+    return RequestBlock(kind, start, line, request=request)
+
+
+def iter_requests(body: str) -> Iterator[RequestBlock]:
+    """Yield every request block of ``body`` in order, in a single pass.
+
+    A block that is not closed by its own END marker before the next BEGIN
+    marker (or the end of the body) is yielded with an error.
+    """
+
+    line = 1
+    scanned = 0
+    open_block: Optional[tuple[str, int, int, int]] = None
+    for match in _MARKER_PATTERN.finditer(body):
+        line += body.count("\n", scanned, match.start())
+        scanned = match.start()
+        edge, kind = match.groups()
+        if open_block is not None:
+            open_kind, open_start, open_line, payload_start = open_block
+            if edge == "END" and kind == open_kind:
+                yield _parse_block(
+                    open_kind, open_start, open_line, body[payload_start : match.start()]
+                )
+                open_block = None
+                continue
+            yield RequestBlock(
+                open_kind,
+                open_start,
+                open_line,
+                error=f"Missing END_{open_kind}_V1 marker.",
+            )
+            open_block = None
+        if edge == "BEGIN":
+            open_block = (kind, match.start(), line, match.end())
+    if open_block is not None:
+        open_kind, open_start, open_line, _ = open_block
+        yield RequestBlock(
+            open_kind, open_start, open_line, error=f"Missing END_{open_kind}_V1 marker."
+        )
+
+
+def _first_block(body: str, kind: Optional[str] = None) -> Optional[RequestBlock]:
+    for block in iter_requests(body):
+        if kind is None or block.kind == kind:
+            return block
+    return None
+
+
+def _block_request(block: RequestBlock) -> Request:
+    if block.request is None:
+        raise EmailParseError(block.error)
+    return block.request
+
+
+def parse_access_request(body: str) -> AccessRequest:
+    """Parse the first access request block of an email body."""
+
+    block = _first_block(body, ACCESS_REQUEST)
+    if block is None:
+        raise EmailParseError("Missing access request marker.")
+    return _block_request(block)
+
+
+def parse_booking_request(body: str) -> BookingRequest:
+    """Parse the first booking request block of an email body."""
+
+    block = _first_block(body, BOOKING_REQUEST)
+    if block is None:
+        raise EmailParseError("Missing booking request marker.")
+    return _block_request(block)
+
+
+def parse_request(body: str) -> Request:
+    """Parse the first request block of an email body, of either type."""
+
+    block = _first_block(body)
+    if block is None:
+        raise EmailParseError("Unsupported email format.")
+    return _block_request(block)
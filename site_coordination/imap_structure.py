@@ -0,0 +1,187 @@
+"""IMAP ``FETCH`` responses and ``BODYSTRUCTURE`` handling.
+
+Form submissions often carry PDFs or photos, but only the text/plain part is
+read. :func:`find_text_part` locates that part in a ``BODYSTRUCTURE``, so
+only its section has to be downloaded with ``BODY.PEEK[n]``;
+:func:`decode_text` undoes its transfer encoding and charset.
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+from dataclasses import dataclass
+from email.errors import HeaderParseError
+from email.header import decode_header, make_header
+from email.parser import Parser
+from email.policy import compat32
+import itertools
+import quopri
+import re
+from typing import Iterable, Iterator, Optional, Union
+
+# imaplib ends the line before a literal with its size, e.g. b"BODY[1] {123}".
+_LITERAL_SIZE = re.compile(rb"\{\d+\}$")
+_DELIMITERS = b' ()"\r\n'
+_FOLDING = re.compile(r"\r?\n(?=[ \t])")
+_OPEN = object()
+_CLOSE = object()
+
+Value = Union[bytes, None, list]
+
+
+@dataclass(frozen=True)
+class TextPart:
+    section: str
+    encoding: str
+    charset: str
+
+
+def _tokens(text: bytes) -> Iterator[object]:
+    index = 0
+    while index < len(text):
+        char = text[index : index + 1]
+        if char in (b" ", b"\r", b"\n"):
+            index += 1
+        elif char == b"(":
+            index += 1
+            yield _OPEN
+        elif char == b")":
+            index += 1
+            yield _CLOSE
+        elif char == b'"':
+            value = bytearray()
+            index += 1
+            while index < len(text) and text[index : index + 1] != b'"':
+                if text[index : index + 1] == b"\\":
+                    index += 1
+                value += text[index : index + 1]
+                index += 1
+            index += 1
+            yield bytes(value)
+        else:
+            start = index
+            while index < len(text) and text[index] not in _DELIMITERS:
+                if text[index : index + 1] == b"[":
+                    # Section specs such as BODY[HEADER.FIELDS (SUBJECT MESSAGE-ID)].
+                    index = text.find(b"]", index)
+                    if index < 0:
+                        index = len(text)
+                        break
+                index += 1
+            atom = text[start:index]
+            yield None if atom.upper() == b"NIL" else atom
+
+
+def parse_fetch_response(response: Iterable) -> Iterator[dict[bytes, Value]]:
+    """Yield the data items of each message in an ``imaplib`` FETCH response.
+
+    Keys are upper-cased item names (``b"UID"``, ``b"BODY[1]"``); values are
+    bytes, None for NIL, or nested lists.
+    """
+
+    stack: list[list] = []
+    for item in response:
+        if item is None:
+            continue
+        text, literal = item if isinstance(item, tuple) else (item, None)
+        if literal is not None:
+            text = _LITERAL_SIZE.sub(b"", text.rstrip())
+        for token in _tokens(text):
+            if token is _OPEN:
+                stack.append([])
+            elif token is _CLOSE:
+                if not stack:
+                    continue
+                done = stack.pop()
+                if stack:
+                    stack[-1].append(done)
+                else:
+                    yield {
+                        bytes(key).upper(): value
+                        for key, value in zip(done[::2], done[1::2])
+                        if isinstance(key, bytes)
+                    }
+            elif stack:
+                stack[-1].append(token)
+        if literal is not None and stack:
+            stack[-1].append(literal)
+
+
+def item_value(items: dict[bytes, Value], prefix: bytes) -> Value:
+    """Return the first item whose name starts with ``prefix``."""
+
+    for key, value in items.items():
+        if key.startswith(prefix):
+            return value
+    return None
+
+
+def _text(value: Value) -> str:
+    return value.decode("ascii", "replace").lower() if isinstance(value, bytes) else ""
+
+
+def _is_attachment(part: list) -> bool:
+    # Single-part fields: type, subtype, params, id, description, encoding,
+    # size, lines (text only), md5, disposition.
+    disposition = part[9] if len(part) > 9 else None
+    return isinstance(disposition, list) and _text(disposition[0]) == "attachment"
+
+
+def find_text_part(structure: Value, section: str = "") -> Optional[TextPart]:
+    """Return the first inline text/plain part of a ``BODYSTRUCTURE``."""
+
+    if not isinstance(structure, list) or not structure:
+        return None
+    if isinstance(structure[0], list):
+        children = itertools.takewhile(lambda part: isinstance(part, list), structure)
+        for index, child in enumerate(children, 1):
+            found = find_text_part(child, f"{section}.{index}" if section else str(index))
+            if found is not None:
+                return found
+        return None
+    if len(structure) < 2 or (_text(structure[0]), _text(structure[1])) != ("text", "plain"):
+        return None
+    if _is_attachment(structure):
+        return None
+    params = structure[2] if len(structure) > 2 and isinstance(structure[2], list) else []
+    names = [_text(value) for value in params[::2]]
+    charset = dict(zip(names, (_text(value) for value in params[1::2])))
+    encoding = _text(structure[5]) if len(structure) > 5 else ""
+    return TextPart(section or "1", encoding or "7bit", charset.get("charset") or "us-ascii")
+
+
+def decode_text(data: Optional[bytes], part: TextPart) -> str:
+    """Decode a fetched section according to its transfer encoding and charset."""
+
+    data = data or b""
+    if part.encoding == "base64":
+        try:
+            data = base64.b64decode(data)
+        except binascii.Error:
+            pass
+    elif part.encoding == "quoted-printable":
+        data = quopri.decodestring(data)
+    try:
+        text = data.decode(part.charset, errors="replace")
+    except LookupError:
+        text = data.decode("utf-8", errors="replace")
+    return text.replace("\r\n", "\n")
+
+
+def decode_headers(header: Optional[bytes]) -> tuple[str, str]:
+    """Decode Subject and Message-ID from a fetched ``HEADER.FIELDS`` block.
+
+    ``policy.default`` would build a new header class per message that only
+    the cyclic garbage collector frees, so the compat32 values are decoded here.
+    """
+
+    # Raw 8-bit subjects are decoded as UTF-8, the way mail clients show them.
+    text = (header or b"").decode("utf-8", errors="replace")
+    headers = Parser(policy=compat32).parsestr(text, headersonly=True)
+    message_id = _FOLDING.sub("", str(headers.get("Message-ID", ""))).strip()
+    value = _FOLDING.sub("", str(headers.get("Subject", "")))
+    try:
+        return str(make_header(decode_header(value))), message_id
+    except (HeaderParseError, LookupError, UnicodeError):
+        return value, message_id
@@ -0,0 +1,132 @@
+"""UID-checkpointed mailbox sync.
+
+``imap_checkpoints`` stores, per mailbox, the ``UIDVALIDITY`` and the highest
+UID that has been processed. A sync only asks the server for ``UID > last_uid``,
+so neither the ``\\Seen`` flag nor a rescan of the mailbox is needed: mail that
+someone already opened in a mail client is still ingested.
+
+Each message is stored and the checkpoint advanced in one SQLite transaction
+(see :mod:`site_coordination.ingest`). If the process dies, either both
+happened or neither did, and the next sync starts after the last committed
+UID. Messages are still flagged ``\\Seen`` afterwards, but only for people
+reading the mailbox.
+
+Without a checkpoint (first run, or the server changed ``UIDVALIDITY`` and
+all old UIDs are void), the unseen messages are processed once, as the
+flag-based sync did before, and the checkpoint starts at ``UIDNEXT - 1``.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import imaplib
+import logging
+import sqlite3
+from typing import Optional
+
+from .imap_watcher import mailbox_status, search_uids_after, search_unseen_uids
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Checkpoint:
+    mailbox: str
+    uidvalidity: int
+    last_uid: int
+
+
+def create_tables(connection: sqlite3.Connection) -> None:
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS imap_checkpoints (
+            mailbox TEXT PRIMARY KEY,
+            uidvalidity INTEGER NOT NULL,
+            last_uid INTEGER NOT NULL,
+            updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+
+def load_checkpoint(connection: sqlite3.Connection, mailbox: str) -> Optional[Checkpoint]:
+    row = connection.execute(
+        "SELECT uidvalidity, last_uid FROM imap_checkpoints WHERE mailbox = ?",
+        (mailbox,),
+    ).fetchone()
+    if row is None:
+        return None
+    return Checkpoint(mailbox, row[0], row[1])
+
+
+def save_checkpoint(connection: sqlite3.Connection, checkpoint: Checkpoint) -> None:
+    """Write ``checkpoint`` without committing; the caller's transaction does."""
+
+    connection.execute(
+        """
+        INSERT INTO imap_checkpoints (mailbox, uidvalidity, last_uid)
+        VALUES (?, ?, ?)
+        ON CONFLICT(mailbox) DO UPDATE SET
+            uidvalidity = excluded.uidvalidity,
+            last_uid = excluded.last_uid,
+            updated_at = CURRENT_TIMESTAMP
+        """,
+        (checkpoint.mailbox, checkpoint.uidvalidity, checkpoint.last_uid),
+    )
+
+
+@dataclass(frozen=True)
+class SyncPlan:
+    """What one sync fetches: ``uids`` in order, after ``checkpoint``."""
+
+    checkpoint: Checkpoint
+    uids: list[int]
+    uidnext: int
+    bootstrap: bool
+
+
+def plan_sync(
+    client: imaplib.IMAP4, connection: sqlite3.Connection, mailbox: str
+) -> SyncPlan:
+    uidvalidity, uidnext = mailbox_status(client, mailbox)
+    checkpoint = load_checkpoint(connection, mailbox)
+    if checkpoint is not None and checkpoint.uidvalidity == uidvalidity:
+        uids = search_uids_after(client, checkpoint.last_uid)
+        return SyncPlan(checkpoint, uids, uidnext, bootstrap=False)
+    if checkpoint is not None:
+        logger.warning(
+            "UIDVALIDITY of %s changed from %s to %s; resetting the checkpoint.",
+            mailbox,
+            checkpoint.uidvalidity,
+            uidvalidity,
+        )
+    start = Checkpoint(mailbox, uidvalidity, 0)
+    return SyncPlan(start, search_unseen_uids(client), uidnext, bootstrap=True)
+
+
+def advance(
+    connection: sqlite3.Connection, checkpoint: Checkpoint, uid: int
+) -> Checkpoint:
+    """Move the checkpoint past ``uid`` inside the caller's transaction."""
+
+    checkpoint = Checkpoint(
+        checkpoint.mailbox, checkpoint.uidvalidity, max(checkpoint.last_uid, uid)
+    )
+    save_checkpoint(connection, checkpoint)
+    return checkpoint
+
+
+def finish_sync(connection: sqlite3.Connection, plan: SyncPlan) -> None:
+    """After a bootstrap, start the checkpoint at ``UIDNEXT - 1``."""
+
+    if not plan.bootstrap:
+        return
+    current = load_checkpoint(connection, plan.checkpoint.mailbox)
+    last_uid = plan.uidnext - 1
+    if current is not None and current.uidvalidity == plan.checkpoint.uidvalidity:
+        last_uid = max(last_uid, current.last_uid)
+    save_checkpoint(
+        connection,
+        Checkpoint(plan.checkpoint.mailbox, plan.checkpoint.uidvalidity, last_uid),
+    )
+    connection.commit()
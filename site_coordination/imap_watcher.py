@@ -1,4 +1,16 @@
-"""IMAP polling utilities to read WordPress form emails."""
+"""IMAP utilities to read WordPress form emails.
+
+Messages are fetched by UID in chunks, one ``UID FETCH`` per chunk, and
+flagged ``\\Seen`` with one ``UID STORE`` per chunk once the ingest has
+stored them. In the default ``text`` mode a chunk costs one more round trip:
+the ``BODYSTRUCTURE`` is fetched first and then only the text/plain section,
+so attachments never cross the wire. Which UIDs to fetch is decided by
+:mod:`site_coordination.imap_sync`. :class:`ImapWatcher` backs
+``watch-imap``: it keeps one logged-in connection and waits in IDLE, so new
+mail is processed within seconds. Servers without IDLE are polled with NOOP,
+and a lost connection or a failed database write is retried with exponential
+backoff.
+"""
 
 from __future__ import annotations
 
@@ -7,48 +19,421 @@ from email.message import Message
 from email.parser import BytesParser
 from email.policy import default
 import imaplib
+import logging
+import re
+import select
+import sqlite3
+import ssl
+import threading
+import time
+from typing import Callable, Iterator, Optional
 
 from .config import ImapConfig
+from .imap_structure import (
+    TextPart,
+    decode_headers,
+    decode_text,
+    find_text_part,
+    item_value,
+    parse_fetch_response,
+)
+
+# Upper bound for the reconnect delay.
+MAX_BACKOFF_SECONDS = 300
+# Blocking reads fail after this long, so a dead connection is noticed.
+SOCKET_TIMEOUT_SECONDS = 60
+
+FETCH_TEXT = "text"
+FETCH_FULL = "full"
+
+_UID_PATTERN = re.compile(rb"UID (\d+)")
+_STATUS_PATTERN = re.compile(rb"(UIDVALIDITY|UIDNEXT) (\d+)")
 
 
 @dataclass(frozen=True)
 class InboxMessage:
     subject: str
     body: str
-    raw: Message
+    # The parsed message; only kept if asked for, as it holds every attachment.
+    raw: Optional[Message] = None
+    uid: int = 0
+    message_id: str = ""
+
+
+@dataclass(frozen=True)
+class SyncStats:
+    messages: int
+    seconds: float
+
+    @property
+    def per_second(self) -> float:
+        return self.messages / self.seconds if self.seconds else 0.0
+
+
+def _decode_part(part: Message) -> str:
+    payload = part.get_payload(decode=True)
+    if not isinstance(payload, bytes):
+        return ""
+    try:
+        return payload.decode(part.get_content_charset() or "utf-8", errors="replace")
+    except LookupError:
+        # Unknown charset names, e.g. "x-foo".
+        return payload.decode("utf-8", errors="replace")
 
 
 def _extract_body(message: Message) -> str:
+    """Return the first text/plain part, or "" if the message has no text."""
+
     if message.is_multipart():
         for part in message.walk():
-            content_type = part.get_content_type()
-            if content_type == "text/plain":
-                return part.get_content()
-    return message.get_content()
+            if part.get_content_type() == "text/plain":
+                return _decode_part(part)
+        return ""
+    if message.get_content_maintype() != "text":
+        return ""
+    return _decode_part(message)
 
 
-def fetch_unseen_messages(config: ImapConfig) -> list[InboxMessage]:
-    """Fetch unseen messages from IMAP."""
+def connect(config: ImapConfig) -> imaplib.IMAP4:
+    """Open a logged-in connection with the mailbox selected."""
 
-    messages: list[InboxMessage] = []
-    with imaplib.IMAP4_SSL(config.host) as client:
+    if config.use_ssl:
+        client: imaplib.IMAP4 = imaplib.IMAP4_SSL(
+            config.host, config.port, timeout=SOCKET_TIMEOUT_SECONDS
+        )
+    else:
+        client = imaplib.IMAP4(config.host, config.port, timeout=SOCKET_TIMEOUT_SECONDS)
+    try:
         client.login(config.user, config.password)
         client.select(config.mailbox)
-        status, data = client.search(None, "UNSEEN")
-        if status != "OK":
-            return messages
-        for msg_id in data[0].split():
-            fetch_status, msg_data = client.fetch(msg_id, "(RFC822)")
-            if fetch_status != "OK":
+    except BaseException:
+        client.shutdown()
+        raise
+    return client
+
+
+def uid_set(uids: list[int]) -> str:
+    """Compress sorted UIDs into an IMAP sequence set such as ``1:500,502``."""
+
+    ranges: list[str] = []
+    start = previous = uids[0]
+    for uid in uids[1:]:
+        if uid != previous + 1:
+            ranges.append(f"{start}:{previous}" if previous != start else str(start))
+            start = uid
+        previous = uid
+    ranges.append(f"{start}:{previous}" if previous != start else str(start))
+    return ",".join(ranges)
+
+
+def mailbox_status(client: imaplib.IMAP4, mailbox: str) -> tuple[int, int]:
+    """Return ``(UIDVALIDITY, UIDNEXT)`` of ``mailbox``."""
+
+    status, data = client.status(mailbox, "(UIDVALIDITY UIDNEXT)")
+    if status != "OK":
+        raise imaplib.IMAP4.error(f"STATUS failed: {data!r}")
+    values = dict(_STATUS_PATTERN.findall(b" ".join(data)))
+    if b"UIDVALIDITY" not in values or b"UIDNEXT" not in values:
+        raise imaplib.IMAP4.error(f"STATUS without UIDVALIDITY/UIDNEXT: {data!r}")
+    return int(values[b"UIDVALIDITY"]), int(values[b"UIDNEXT"])
+
+
+def _search_uids(client: imaplib.IMAP4, *criteria: str) -> list[int]:
+    status, data = client.uid("SEARCH", None, *criteria)
+    if status != "OK":
+        return []
+    return sorted(int(uid) for uid in data[0].split())
+
+
+def search_unseen_uids(client: imaplib.IMAP4) -> list[int]:
+    return _search_uids(client, "UNSEEN")
+
+
+def search_uids_after(client: imaplib.IMAP4, last_uid: int) -> list[int]:
+    """Return the UIDs above ``last_uid``.
+
+    ``UID n:*`` always matches the newest message, even if its UID is below
+    ``n``, so the result is filtered again here.
+    """
+
+    uids = _search_uids(client, "UID", f"{last_uid + 1}:*")
+    return [uid for uid in uids if uid > last_uid]
+
+
+def parse_message(data: bytes, uid: int = 0, keep_raw: bool = False) -> InboxMessage:
+    """Parse a whole RFC 822 message into its subject and text body."""
+
+    parsed = BytesParser(policy=default).parsebytes(data)
+    return InboxMessage(
+        subject=parsed.get("Subject", ""),
+        body=_extract_body(parsed),
+        raw=parsed if keep_raw else None,
+        uid=uid,
+        message_id=str(parsed.get("Message-ID", "")).strip(),
+    )
+
+
+def _fetched_messages(response: list, keep_raw: bool) -> Iterator[InboxMessage]:
+    # imaplib yields (b"1 (UID 5 BODY[] {123}", literal) pairs, each followed
+    # by the rest of the response line, e.g. b")" or b" UID 5)".
+    pending: Optional[bytes] = None
+    for item in response:
+        header, data = item if isinstance(item, tuple) else (item, None)
+        match = _UID_PATTERN.search(header or b"")
+        if data is not None:
+            if match:
+                yield parse_message(data, int(match.group(1)), keep_raw)
+            else:
+                pending = data
+        elif pending is not None and match:
+            yield parse_message(pending, int(match.group(1)), keep_raw)
+            pending = None
+
+
+def _uid_fetch(client: imaplib.IMAP4, uids: list[int], items: str) -> list:
+    status, response = client.uid("FETCH", uid_set(uids), items)
+    if status != "OK":
+        raise imaplib.IMAP4.error(f"UID FETCH failed: {response!r}")
+    return response
+
+
+def _fetch_full(
+    client: imaplib.IMAP4, uids: list[int], keep_raw: bool
+) -> list[InboxMessage]:
+    response = _uid_fetch(client, uids, "(UID BODY.PEEK[])")
+    return list(_fetched_messages(response, keep_raw))
+
+
+def _fetch_text(client: imaplib.IMAP4, uids: list[int]) -> list[InboxMessage]:
+    response = _uid_fetch(
+        client,
+        uids,
+        "(UID BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (SUBJECT MESSAGE-ID)])",
+    )
+    headers: dict[int, tuple[str, str]] = {}
+    parts: dict[int, TextPart] = {}
+    by_section: dict[str, list[int]] = {}
+    for items in parse_fetch_response(response):
+        # Unsolicited FETCH responses (e.g. flag changes) carry no UID.
+        if b"UID" not in items:
+            continue
+        uid = int(items[b"UID"])
+        headers[uid] = decode_headers(item_value(items, b"BODY[HEADER"))
+        part = find_text_part(items.get(b"BODYSTRUCTURE"))
+        if part is not None:
+            parts[uid] = part
+            by_section.setdefault(part.section, []).append(uid)
+
+    messages: list[InboxMessage] = []
+    # Usually every form email has its text in the same section, e.g. "1".
+    for section, section_uids in by_section.items():
+        response = _uid_fetch(client, sorted(section_uids), f"(UID BODY.PEEK[{section}])")
+        for items in parse_fetch_response(response):
+            uid = int(items.get(b"UID") or 0)
+            if uid not in parts:
                 continue
-            msg_bytes = msg_data[0][1]
-            parsed = BytesParser(policy=default).parsebytes(msg_bytes)
+            body = decode_text(items.get(f"BODY[{section}]".encode()), parts[uid])
+            subject, message_id = headers[uid]
             messages.append(
-                InboxMessage(
-                    subject=parsed.get("Subject", ""),
-                    body=_extract_body(parsed),
-                    raw=parsed,
-                )
+                InboxMessage(subject=subject, body=body, uid=uid, message_id=message_id)
+            )
+    # Messages without a text/plain part are parsed in full, as before.
+    others = sorted(uid for uid in headers if uid not in parts)
+    if others:
+        messages.extend(_fetch_full(client, others, keep_raw=False))
+    return sorted(messages, key=lambda message: message.uid)
+
+
+def fetch_chunks(
+    client: imaplib.IMAP4,
+    uids: list[int],
+    chunk_size: int,
+    mode: str = FETCH_TEXT,
+    keep_raw: bool = False,
+) -> Iterator[list[InboxMessage]]:
+    """Fetch ``uids`` with one ``UID FETCH`` per chunk (two in ``text`` mode).
+
+    ``keep_raw`` needs the whole message and implies ``full`` mode.
+    ``BODY.PEEK`` leaves the ``\\Seen`` flag alone; see :func:`mark_seen`.
+    """
+
+    for index in range(0, len(uids), chunk_size):
+        chunk = uids[index : index + chunk_size]
+        if mode == FETCH_TEXT and not keep_raw:
+            yield _fetch_text(client, chunk)
+        else:
+            yield _fetch_full(client, chunk, keep_raw)
+
+
+def mark_seen(client: imaplib.IMAP4, uids: list[int]) -> None:
+    if uids:
+        client.uid("STORE", uid_set(sorted(uids)), "+FLAGS.SILENT", "(\\Seen)")
+
+
+def supports_idle(client: imaplib.IMAP4) -> bool:
+    return "IDLE" in client.capabilities
+
+
+def _buffered(client: imaplib.IMAP4) -> bool:
+    # imaplib reads through a buffered file, so lines it has already taken
+    # off the socket are invisible to select(). peek() returns them without a
+    # socket read; if the buffer is empty, the non-blocking read returns
+    # nothing instead of waiting.
+    sock = client.socket()
+    timeout = sock.gettimeout()
+    sock.settimeout(0.0)
+    try:
+        return bool(client.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+
+def _readable(client: imaplib.IMAP4, timeout: float) -> bool:
+    if _buffered(client):
+        return True
+    sock = client.socket()
+    # TLS records may already be decrypted and buffered in the SSL object.
+    pending = getattr(sock, "pending", None)
+    if pending is not None and pending():
+        return True
+    readable, _, _ = select.select([sock], [], [], timeout)
+    return bool(readable)
+
+
+def idle(
+    client: imaplib.IMAP4,
+    timeout: float,
+    stop: Optional[threading.Event] = None,
+) -> bool:
+    """Wait in IDLE for up to ``timeout`` seconds (RFC 2177).
+
+    Returns True if the server announced new mail. ``imaplib`` before Python
+    3.14 has no IDLE support, so the command is driven on the raw connection.
+    """
+
+    tag = client._new_tag()
+    client.send(tag + b" IDLE\r\n")
+    changed = False
+    while True:
+        line = client.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("connection closed during IDLE")
+        if line.startswith(b"+"):
+            break
+        if not line.startswith(b"*"):
+            raise imaplib.IMAP4.error(f"IDLE rejected: {line!r}")
+        # Untagged responses may come before the continuation.
+        changed = changed or _announces_mail(line)
+    remaining = timeout
+    while remaining > 0 and not changed and not (stop and stop.is_set()):
+        # Short waits keep shutdown requests responsive.
+        step = min(remaining, 1.0)
+        remaining -= step
+        if not _readable(client, step):
+            continue
+        line = client.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("connection closed during IDLE")
+        changed = _announces_mail(line)
+    client.send(b"DONE\r\n")
+    while True:
+        line = client.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("connection closed during IDLE")
+        if line.startswith(tag):
+            if not line[len(tag) :].strip().upper().startswith(b"OK"):
+                raise imaplib.IMAP4.error(f"IDLE failed: {line!r}")
+            return changed
+        changed = changed or _announces_mail(line)
+
+
+def _announces_mail(line: bytes) -> bool:
+    words = line.upper().split()
+    return line.startswith(b"*") and (b"EXISTS" in words or b"RECENT" in words)
+
+
+class ImapWatcher:
+    """Process new mail as it arrives over one long-lived IMAP connection."""
+
+    def __init__(
+        self,
+        config: ImapConfig,
+        sync: Callable[[imaplib.IMAP4], SyncStats],
+        logger: logging.Logger,
+        connect_func: Callable[[ImapConfig], imaplib.IMAP4] = connect,
+    ) -> None:
+        """``sync`` processes whatever is new over the open connection."""
+
+        self._config = config
+        self._sync = sync
+        self._logger = logger
+        self._connect = connect_func
+        self._stop_event = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        """Watch the mailbox until :meth:`stop` is called."""
+
+        backoff = 1
+        while not self._stop_event.is_set():
+            client: Optional[imaplib.IMAP4] = None
+            try:
+                client = self._connect(self._config)
+                self._logger.info("Watching %s on %s.", self._config.mailbox, self._config.host)
+                backoff = 1
+                self._watch(client)
+            except (imaplib.IMAP4.error, OSError) as exc:
+                self._logger.warning("IMAP connection lost: %s; retrying in %ss.", exc, backoff)
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+            except sqlite3.Error as exc:
+                # E.g. "database is locked" while another writer holds the
+                # lock. The checkpoint was not advanced, so the next sync
+                # picks the same mail up again.
+                self._logger.warning("Sync failed: %s; retrying in %ss.", exc, backoff)
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+            finally:
+                if client is not None:
+                    _close_quietly(client)
+
+    def _watch(self, client: imaplib.IMAP4) -> None:
+        use_idle = supports_idle(client)
+        if not use_idle:
+            self._logger.info("Server has no IDLE; polling with NOOP.")
+        self._process(client)
+        while not self._stop_event.is_set():
+            if use_idle:
+                idle(client, self._config.idle_timeout_seconds, self._stop_event)
+                if self._stop_event.is_set():
+                    return
+            else:
+                if self._stop_event.wait(self._config.poll_interval_seconds):
+                    return
+                client.noop()
+            # Sync after every cycle, even on an IDLE timeout: an EXISTS that
+            # arrived with a response during the last sync was taken by
+            # imaplib and is not announced again. A sync without new mail
+            # costs one STATUS and one UID SEARCH.
+            self._process(client)
+
+    def _process(self, client: imaplib.IMAP4) -> None:
+        stats = self._sync(client)
+        if stats.messages:
+            self._logger.info(
+                "Processed %s messages in %.2fs (%.1f msgs/s).",
+                stats.messages,
+                stats.seconds,
+                stats.per_second,
             )
-            client.store(msg_id, "+FLAGS", "\\Seen")
-    return messages
+
+
+def _close_quietly(client: imaplib.IMAP4) -> None:
+    try:
+        client.logout()
+    except (imaplib.IMAP4.error, OSError):
+        pass
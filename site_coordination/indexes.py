@@ -0,0 +1,244 @@
+"""Managed secondary indexes and query plan checks for hot lookups."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import sqlite3
+from typing import Iterable, Sequence
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    name: str
+    table: str
+    columns: tuple[str, ...]
+
+    def create_sql(self) -> str:
+        return (
+            f"CREATE INDEX IF NOT EXISTS {self.name} "
+            f"ON {self.table} ({', '.join(self.columns)})"
+        )
+
+
+@dataclass(frozen=True)
+class HotQuery:
+    name: str
+    sql: str
+    params: tuple = ()
+
+
+# Each group is created by its own migration; add new groups instead of
+# editing a group that has already shipped.
+HOT_PATH_INDEXES: tuple[IndexSpec, ...] = (
+    IndexSpec("idx_bookings_email_project", "bookings", ("email", "project")),
+    IndexSpec("idx_bookings_created_at", "bookings", ("created_at",)),
+    IndexSpec("idx_bookings_status_created_at", "bookings", ("status", "created_at")),
+    IndexSpec(
+        "idx_activity_research_email_created_at",
+        "activity_research",
+        ("email", "created_at"),
+    ),
+    IndexSpec("idx_activity_research_created_at", "activity_research", ("created_at",)),
+    IndexSpec(
+        "idx_activity_service_provider_created_at",
+        "activity_service_provider",
+        ("created_at",),
+    ),
+    IndexSpec("idx_registrations_created_at", "registrations", ("created_at",)),
+    IndexSpec(
+        "idx_registrations_status_created_at", "registrations", ("status", "created_at")
+    ),
+    IndexSpec("idx_users_created_at", "users", ("created_at",)),
+)
+
+TIMESTAMP_INDEXES: tuple[IndexSpec, ...] = (
+    IndexSpec("idx_bookings_created_ts", "bookings", ("created_ts",)),
+    IndexSpec("idx_bookings_email_created_ts", "bookings", ("email", "created_ts")),
+    IndexSpec("idx_activity_research_created_ts", "activity_research", ("created_ts",)),
+    IndexSpec(
+        "idx_activity_research_email_created_ts",
+        "activity_research",
+        ("email", "created_ts"),
+    ),
+    IndexSpec(
+        "idx_activity_service_provider_created_ts",
+        "activity_service_provider",
+        ("created_ts",),
+    ),
+)
+
+TIMESLOT_INDEXES: tuple[IndexSpec, ...] = (
+    IndexSpec("idx_bookings_start_end_week", "bookings", ("start_week", "end_week")),
+)
+
+SCREENING_INDEXES: tuple[IndexSpec, ...] = (
+    IndexSpec(
+        "idx_bookings_email_start_end_week", "bookings", ("email", "start_week", "end_week")
+    ),
+    IndexSpec(
+        "idx_bookings_verdict_created_at", "bookings", ("screening_verdict", "created_at")
+    ),
+)
+
+LEDGER_INDEXES: tuple[IndexSpec, ...] = (
+    IndexSpec("idx_ingest_ledger_message_id", "ingest_ledger", ("message_id",)),
+)
+
+INDEXES: tuple[IndexSpec, ...] = (
+    HOT_PATH_INDEXES
+    + TIMESTAMP_INDEXES
+    + TIMESLOT_INDEXES
+    + SCREENING_INDEXES
+    + LEDGER_INDEXES
+)
+
+# Queries issued on every check-in, login or manage page load. None of them may
+# fall back to a full table scan or a temporary sort.
+HOT_QUERIES: tuple[HotQuery, ...] = (
+    HotQuery(
+        "checkin booking projects",
+        "SELECT DISTINCT project FROM bookings WHERE email = ? ORDER BY project",
+        ("user@example.com",),
+    ),
+    HotQuery(
+        "login user lookup",
+        "SELECT password, project, first_name, last_name, affiliation "
+        "FROM users WHERE email = ?",
+        ("user@example.com",),
+    ),
+    HotQuery(
+        "manage registrations",
+        "SELECT * FROM registrations WHERE (created_at, rowid) < (?, ?)"
+        " ORDER BY created_at DESC, rowid DESC LIMIT 51",
+        ("2024-01-01 00:00:00", 1000),
+    ),
+    HotQuery(
+        "open registrations",
+        "SELECT * FROM registrations WHERE status = ? ORDER BY created_at DESC",
+        ("open",),
+    ),
+    HotQuery(
+        "manage users",
+        "SELECT * FROM users WHERE (created_at, rowid) < (?, ?)"
+        " ORDER BY created_at DESC, rowid DESC LIMIT 51",
+        ("2024-01-01 00:00:00", 1000),
+    ),
+    HotQuery(
+        "manage bookings",
+        "SELECT * FROM bookings WHERE (created_at, rowid) < (?, ?)"
+        " ORDER BY created_at DESC, rowid DESC LIMIT 51",
+        ("2024-01-01 00:00:00", 1000),
+    ),
+    HotQuery(
+        "pending bookings",
+        "SELECT * FROM bookings WHERE status = ? ORDER BY created_at DESC",
+        ("pending_review",),
+    ),
+    HotQuery(
+        "research activities",
+        "SELECT * FROM activity_research WHERE (created_at, rowid) < (?, ?)"
+        " ORDER BY created_at DESC, rowid DESC LIMIT 51",
+        ("2024-01-01 00:00:00", 1000),
+    ),
+    HotQuery(
+        "service activities",
+        "SELECT * FROM activity_service_provider WHERE (created_at, rowid) < (?, ?)"
+        " ORDER BY created_at DESC, rowid DESC LIMIT 51",
+        ("2024-01-01 00:00:00", 1000),
+    ),
+    HotQuery(
+        "user activity summary",
+        "SELECT email, project, sum(total) AS total FROM ("
+        "SELECT email, project, total FROM rollup_research_daily WHERE 1=1"
+        " AND email = ? AND day >= ? AND day <= ?"
+        ") GROUP BY email, project ORDER BY email, project",
+        ("user@example.com", "2024-01-01", "2024-01-31"),
+    ),
+    HotQuery(
+        "bookings overlapping weeks",
+        "SELECT id, project FROM bookings WHERE start_week <= ? AND end_week >= ?",
+        (202650, 202641),
+    ),
+    HotQuery(
+        "user bookings overlapping weeks",
+        "SELECT 1 FROM bookings WHERE email = ? AND start_week <= ? AND end_week >= ?",
+        ("user@example.com", 202650, 202641),
+    ),
+    HotQuery(
+        "bookings by screening verdict",
+        "SELECT * FROM bookings WHERE bookings.screening_verdict = ?"
+        " ORDER BY created_at DESC",
+        ("review",),
+    ),
+    HotQuery(
+        "booking date range",
+        "SELECT * FROM bookings WHERE 1=1 AND created_ts >= ? AND created_ts < ?",
+        (1704063600, 1706742000),
+    ),
+    HotQuery(
+        "ingest ledger payload lookup",
+        "SELECT payload_hash, message_id, kind, record_key, result"
+        " FROM ingest_ledger WHERE payload_hash = ? AND ("
+        "(kind = 'registration' AND EXISTS (SELECT 1 FROM registrations"
+        " WHERE registrations.email = ingest_ledger.record_key"
+        " AND registrations.status IN ('open', 'offen')))"
+        " OR (kind = 'booking' AND EXISTS (SELECT 1 FROM bookings"
+        " WHERE bookings.id = CAST(ingest_ledger.record_key AS INTEGER)"
+        " AND bookings.status = 'pending_review'))) LIMIT 1",
+        ("0" * 64,),
+    ),
+    HotQuery(
+        "ingest ledger message lookup",
+        "SELECT 1 FROM ingest_ledger WHERE message_id = ? LIMIT 1",
+        ("<id@example.com>",),
+    ),
+    HotQuery(
+        "service activity date range",
+        "SELECT * FROM activity_service_provider WHERE 1=1"
+        " AND created_ts >= ? AND created_ts < ?",
+        (1704063600, 1706742000),
+    ),
+)
+
+
+def ensure_indexes(
+    connection: sqlite3.Connection, specs: Iterable[IndexSpec] = INDEXES
+) -> None:
+    """Create the managed indexes that do not exist yet."""
+
+    for spec in specs:
+        connection.execute(spec.create_sql())
+
+
+def explain(connection: sqlite3.Connection, sql: str, params: Sequence = ()) -> list[str]:
+    """Return the EXPLAIN QUERY PLAN detail lines for a statement."""
+
+    rows = connection.execute(f"EXPLAIN QUERY PLAN {sql}", tuple(params)).fetchall()
+    return [row[3] for row in rows]
+
+
+def _is_full_scan(detail: str) -> bool:
+    if detail.startswith("USE TEMP B-TREE FOR ORDER BY"):
+        return True
+    return (
+        detail.startswith("SCAN ")
+        and "USING" not in detail
+        and "VIRTUAL TABLE" not in detail
+    )
+
+
+def find_full_scans(
+    connection: sqlite3.Connection, queries: Iterable[HotQuery] = HOT_QUERIES
+) -> dict[str, list[str]]:
+    """Return the plan lines of every hot query that scans or sorts a whole table."""
+
+    problems: dict[str, list[str]] = {}
+    for query in queries:
+        details = [
+            detail
+            for detail in explain(connection, query.sql, query.params)
+            if _is_full_scan(detail)
+        ]
+        if details:
+            problems[query.name] = details
+    return problems
@@ -0,0 +1,501 @@
+"""Streaming ingest of form emails from IMAP or an archive.
+
+Mail passes through five lazy stages, each a generator feeding the next::
+
+    fetch -> parse -> validate -> store -> acknowledge
+
+``fetch`` holds one chunk of messages at a time and the later stages one
+message each, so memory stays flat however large the backlog is. ``store``
+commits every message together with its UID checkpoint
+(:mod:`site_coordination.imap_sync`); ``acknowledge`` flags messages
+``\\Seen`` only after that commit. Messages that fail to parse or validate
+are not stored, but still move the checkpoint so they are not fetched again.
+A digest email with several request blocks fans out into one item per
+block after ``parse``; its items are committed together, so a digest is
+stored completely or not at all. Emails and requests the ingest ledger
+already has
+(:mod:`site_coordination.ingest_ledger`) are counted as duplicates and not
+stored again; ``skip_known`` drops known Message-IDs before they are parsed.
+:class:`StageCounters` counts what passed each stage.
+
+Bulk mode (:class:`BulkIngest`, ``process-imap --bulk``) is for replaying a
+large backlog: worker processes parse and validate batches of bodies, and the
+one writer connection group-commits many messages per transaction. There,
+known Message-IDs are skipped after parsing, on the writer's thread, while
+fetch and parse run ahead on background threads.
+:func:`ingest_archive` runs the same bulk stages over exported mail
+(``process-dir``/``process-mbox``), without checkpoint or acknowledgement.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass, fields, replace
+import imaplib
+import itertools
+import queue
+import re
+import sqlite3
+import threading
+import time
+from typing import Iterable, Iterator, Optional, Union
+
+from . import imap_sync, ingest_ledger
+from .config import IngestConfig
+from .email_parser import AccessRequest, BookingRequest, RequestBlock, iter_requests
+from .imap_watcher import (
+    FETCH_TEXT,
+    InboxMessage,
+    fetch_chunks,
+    mark_seen,
+    parse_message,
+)
+from .mail_archive import ArchivedMessage
+from .processor import process_request
+
+_EMAIL_PATTERN = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+
+Request = Union[AccessRequest, BookingRequest]
+
+
+@dataclass
+class StageCounters:
+    fetched: int = 0
+    parsed: int = 0
+    validated: int = 0
+    stored: int = 0
+    duplicates: int = 0
+    rejected: int = 0
+    acknowledged: int = 0
+
+    def summary(self) -> str:
+        return ", ".join(f"{field.name} {getattr(self, field.name)}" for field in fields(self))
+
+
+@dataclass(frozen=True)
+class BulkIngest:
+    """Parse workers and commit batching for replaying a large backlog."""
+
+    executor: Executor
+    config: IngestConfig
+    # Bodies per worker task; small tasks would cost more in pickling.
+    parse_batch: int = 100
+
+    @property
+    def window(self) -> int:
+        return 2 * self.config.workers
+
+    @property
+    def batch_seconds(self) -> float:
+        return self.config.batch_ms / 1000
+
+    def feed_store(self, items: Iterable[IngestItem]) -> Iterator[Optional[IngestItem]]:
+        """Run the stages before ``store`` on a thread, with a heartbeat.
+
+        While they block on IMAP or the parse workers, ``store`` still wakes
+        up and commits an open batch once ``batch_ms`` have passed, so the
+        write lock is never held across a network wait.
+        """
+
+        return prefetch(items, self.config.batch_size, heartbeat=self.batch_seconds / 4)
+
+
+@dataclass(frozen=True)
+class IngestItem:
+    message: InboxMessage
+    request: Optional[Request] = None
+    # Why the message was rejected; empty while it is still on its way.
+    error: str = ""
+    # The processor's message once stored.
+    result: str = ""
+    # Archive location, and the undecoded message until a parse worker reads it.
+    source: str = ""
+    data: Optional[bytes] = None
+    # Already in the ingest ledger; passed through without being stored.
+    duplicate: bool = False
+    # Line of the request block in a digest email (0 for a single request),
+    # and whether this is the last item of its email.
+    line: int = 0
+    last: bool = True
+
+
+def fetch(
+    client: imaplib.IMAP4,
+    uids: list[int],
+    chunk_size: int,
+    mode: str,
+    counters: StageCounters,
+) -> Iterator[IngestItem]:
+    for messages in fetch_chunks(client, uids, chunk_size, mode):
+        for message in messages:
+            counters.fetched += 1
+            yield IngestItem(message)
+
+
+_DONE = object()
+
+
+def prefetch(
+    items: Iterable[IngestItem], depth: int, heartbeat: Optional[float] = None
+) -> Iterator[Optional[IngestItem]]:
+    """Pull ``items`` on a background thread, at most ``depth`` ahead.
+
+    Used for ``fetch`` in bulk mode, so waiting for the IMAP server overlaps
+    with parsing and storing. Errors are re-raised in the consuming thread.
+    With ``heartbeat``, None is yielded whenever no item arrived for that
+    many seconds.
+    """
+
+    buffer: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(value: object) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run() -> None:
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException as exc:
+            put(exc)
+            return
+        put(_DONE)
+
+    worker = threading.Thread(target=run, name="ingest-prefetch", daemon=True)
+    worker.start()
+    try:
+        while True:
+            try:
+                value = buffer.get(timeout=heartbeat)
+            except queue.Empty:
+                yield None
+                continue
+            if value is _DONE:
+                return
+            if isinstance(value, BaseException):
+                raise value
+            yield value
+    finally:
+        stop.set()
+        worker.join()
+
+
+def _parse_body(body: str) -> list[RequestBlock]:
+    blocks = list(iter_requests(body))
+    return blocks or [RequestBlock("", 0, 0, error="Unsupported email format.")]
+
+
+def _validation_error(request: Request) -> str:
+    if _EMAIL_PATTERN.fullmatch(request.email):
+        return ""
+    return f"Invalid email address {request.email!r}."
+
+
+def _validated(block: RequestBlock) -> RequestBlock:
+    if block.request is None:
+        return block
+    error = _validation_error(block.request)
+    return replace(block, request=None, error=error) if error else block
+
+
+def _fan_out(item: IngestItem, blocks: list[RequestBlock]) -> Iterator[IngestItem]:
+    digest = len(blocks) > 1
+    for index, block in enumerate(blocks, 1):
+        yield replace(
+            item,
+            request=block.request,
+            error=block.error,
+            line=block.line if digest else 0,
+            last=index == len(blocks),
+        )
+
+
+def skip_known(
+    connection: sqlite3.Connection,
+    items: Iterable[Optional[IngestItem]],
+    counters: StageCounters,
+) -> Iterator[Optional[IngestItem]]:
+    """Mark messages whose Message-ID the ingest ledger has as duplicates.
+
+    Their request is dropped, so ``store`` passes them through untouched even
+    when this runs after parsing (bulk mode).
+    """
+
+    for item in items:
+        if item is None:
+            yield item
+            continue
+        if ingest_ledger.known_message(connection, item.message.message_id):
+            item = replace(
+                item, request=None, error="", duplicate=True, result="Already processed."
+            )
+        yield item
+
+
+def parse(items: Iterable[IngestItem], counters: StageCounters) -> Iterator[IngestItem]:
+    for item in items:
+        if item.duplicate:
+            yield item
+            continue
+        blocks = _parse_body(item.message.body)
+        counters.parsed += sum(block.request is not None for block in blocks)
+        yield from _fan_out(item, blocks)
+
+
+def validate(items: Iterable[IngestItem], counters: StageCounters) -> Iterator[IngestItem]:
+    for item in items:
+        if item.request is not None:
+            error = _validation_error(item.request)
+            if error:
+                item = replace(item, request=None, error=error)
+            else:
+                counters.validated += 1
+        yield item
+
+
+def _parse_and_validate(
+    payloads: list[Union[str, bytes]],
+) -> list[tuple[Optional[InboxMessage], list[RequestBlock], int]]:
+    # Runs in a worker process. A payload is a body, or a whole message from
+    # an archive that is decoded here first. Returns (decoded message,
+    # validated blocks, number parsed) per payload.
+    results = []
+    for payload in payloads:
+        message = None
+        try:
+            if isinstance(payload, bytes):
+                message = parse_message(payload)
+                payload = message.body
+            blocks = _parse_body(payload)
+        except Exception as exc:
+            # Reported on this message's line instead of ending the run.
+            error = f"Unreadable message: {exc}"
+            results.append((message, [RequestBlock("", 0, 0, error=error)], 0))
+            continue
+        parsed = sum(block.request is not None for block in blocks)
+        results.append((message, [_validated(block) for block in blocks], parsed))
+    return results
+
+
+def _payload(item: IngestItem) -> Union[str, bytes]:
+    if item.duplicate:
+        return ""
+    return item.data if item.data is not None else item.message.body
+
+
+def _batches(items: Iterable[IngestItem], size: int) -> Iterator[list[IngestItem]]:
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def parse_parallel(
+    items: Iterable[IngestItem],
+    executor: Executor,
+    batch_size: int,
+    window: int,
+    counters: StageCounters,
+) -> Iterator[IngestItem]:
+    """Parse and validate in ``executor``, ``batch_size`` bodies per task.
+
+    At most ``window`` tasks are in flight, so the stage stays bounded, and
+    results come out in the order the messages went in.
+    """
+
+    pending: deque[tuple[list[IngestItem], Future]] = deque()
+
+    def collect() -> Iterator[IngestItem]:
+        batch, future = pending.popleft()
+        for item, (message, blocks, parsed) in zip(batch, future.result()):
+            if item.duplicate:
+                yield item
+                continue
+            counters.parsed += parsed
+            counters.validated += sum(block.request is not None for block in blocks)
+            if message is not None:
+                item = replace(item, message=message, data=None)
+            yield from _fan_out(item, blocks)
+
+    for batch in _batches(items, batch_size):
+        payloads = [_payload(item) for item in batch]
+        pending.append((batch, executor.submit(_parse_and_validate, payloads)))
+        if len(pending) >= window:
+            yield from collect()
+    while pending:
+        yield from collect()
+
+
+def store(
+    connection: sqlite3.Connection,
+    items: Iterable[Optional[IngestItem]],
+    checkpoint: Optional[imap_sync.Checkpoint],
+    counters: StageCounters,
+    batch_size: int = 1,
+    batch_seconds: float = 0.0,
+) -> Iterator[IngestItem]:
+    """Store valid requests and advance the checkpoint (if any), then commit.
+
+    By default every message gets its own transaction. With a larger
+    ``batch_size`` one transaction covers up to ``batch_size`` messages, or
+    fewer once ``batch_seconds`` have passed since the first of them. The age
+    is checked as messages arrive and on every None heartbeat, see
+    :meth:`BulkIngest.feed_store`. The items of a digest email always share a
+    transaction. Messages are yielded only after their commit.
+    """
+
+    batch: list[IngestItem] = []
+    started = 0.0
+
+    def commit() -> list[IngestItem]:
+        nonlocal checkpoint, batch
+        if checkpoint is not None:
+            checkpoint = imap_sync.advance(
+                connection, checkpoint, max(item.message.uid for item in batch)
+            )
+        connection.commit()
+        for item in batch:
+            if item.error:
+                counters.rejected += 1
+            elif item.duplicate:
+                counters.duplicates += 1
+            else:
+                counters.stored += 1
+        done, batch = batch, []
+        return done
+
+    try:
+        for item in items:
+            if item is None:
+                if batch and batch[-1].last and time.monotonic() - started >= batch_seconds:
+                    yield from commit()
+                continue
+            if not batch:
+                started = time.monotonic()
+            if item.request is not None and not item.duplicate:
+                result = process_request(
+                    connection, item.request, item.message.message_id, commit=False
+                )
+                item = replace(item, result=result.message, duplicate=result.duplicate)
+            batch.append(item)
+            if not item.last:
+                continue
+            if len(batch) >= batch_size or time.monotonic() - started >= batch_seconds:
+                yield from commit()
+        if batch:
+            yield from commit()
+    except BaseException:
+        connection.rollback()
+        raise
+
+
+def acknowledge(
+    client: imaplib.IMAP4,
+    items: Iterable[IngestItem],
+    batch_size: int,
+    counters: StageCounters,
+) -> Iterator[IngestItem]:
+    """Flag committed messages ``\\Seen``, one ``UID STORE`` per batch."""
+
+    pending: list[int] = []
+    for item in items:
+        if not item.last:
+            yield item
+            continue
+        pending.append(item.message.uid)
+        if len(pending) >= batch_size:
+            mark_seen(client, pending)
+            counters.acknowledged += len(pending)
+            pending = []
+        yield item
+    mark_seen(client, pending)
+    counters.acknowledged += len(pending)
+
+
+def ingest_mailbox(
+    client: imaplib.IMAP4,
+    connection: sqlite3.Connection,
+    mailbox: str,
+    counters: StageCounters,
+    chunk_size: int = 500,
+    mode: str = FETCH_TEXT,
+    bulk: Optional[BulkIngest] = None,
+) -> Iterator[IngestItem]:
+    """Run the pipeline over everything after the checkpoint of ``mailbox``.
+
+    With ``bulk``, parsing runs in its executor and commits are grouped.
+    """
+
+    plan = imap_sync.plan_sync(client, connection, mailbox)
+    items = fetch(client, plan.uids, chunk_size, mode, counters)
+    if bulk is None:
+        items = skip_known(connection, items, counters)
+        items = validate(parse(items, counters), counters)
+        items = store(connection, items, plan.checkpoint, counters)
+    else:
+        items = parse_parallel(
+            prefetch(items, 2 * chunk_size),
+            bulk.executor,
+            bulk.parse_batch,
+            bulk.window,
+            counters,
+        )
+        # Known Message-IDs are checked here, on the connection's thread.
+        items = skip_known(connection, bulk.feed_store(items), counters)
+        items = store(
+            connection,
+            items,
+            plan.checkpoint,
+            counters,
+            bulk.config.batch_size,
+            bulk.batch_seconds,
+        )
+        # The prefetch thread owns the connection until it is done, so the
+        # flags are set in one go at the end.
+        chunk_size = max(len(plan.uids), 1)
+    yield from acknowledge(client, items, chunk_size, counters)
+    imap_sync.finish_sync(connection, plan)
+
+
+def read_archive(
+    messages: Iterable[ArchivedMessage], counters: StageCounters
+) -> Iterator[IngestItem]:
+    for archived in messages:
+        counters.fetched += 1
+        yield IngestItem(
+            InboxMessage(subject="", body=""), source=archived.source, data=archived.data
+        )
+
+
+def ingest_archive(
+    connection: sqlite3.Connection,
+    messages: Iterable[ArchivedMessage],
+    counters: StageCounters,
+    bulk: BulkIngest,
+) -> Iterator[IngestItem]:
+    """Run the bulk stages over archived messages; yields each after its commit.
+
+    Message-IDs are only known once a worker has parsed the file, so known
+    messages are skipped after parsing, as in bulk IMAP mode.
+    """
+
+    items = prefetch(read_archive(messages, counters), bulk.parse_batch * bulk.window)
+    items = parse_parallel(items, bulk.executor, bulk.parse_batch, bulk.window, counters)
+    yield from store(
+        connection,
+        skip_known(connection, bulk.feed_store(items), counters),
+        None,
+        counters,
+        bulk.config.batch_size,
+        bulk.batch_seconds,
+    )
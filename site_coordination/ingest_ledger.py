@@ -0,0 +1,122 @@
+"""Ledger of ingested requests, so replays and double submits are skipped.
+
+Every ingested request gets a row in ``ingest_ledger`` with the Message-ID of
+its email, a hash of its normalized payload and what it produced. Before a
+request is stored, :func:`lookup` checks the hash (the leading primary key
+column), so the same form sent twice by WordPress under two Message-IDs is
+stored once; the second Message-ID is recorded as well. The hash only
+matches while the record it produced is still awaiting review: the same form
+sent again after a denial, or for the same slot next year, is stored anew.
+:func:`known_message` checks the Message-ID index, which lets the ingest
+pipeline drop a replayed email before it is parsed at all.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, fields
+import hashlib
+import sqlite3
+from typing import Optional, Union
+
+from . import indexes
+from .email_parser import AccessRequest, BookingRequest
+
+REGISTRATION = "registration"
+BOOKING = "booking"
+
+# Derived from other fields, so not part of the payload.
+_DERIVED_FIELDS = {"timeslot"}
+
+_PENDING_RECORD = """
+    (kind = 'registration' AND EXISTS (
+        SELECT 1 FROM registrations
+        WHERE registrations.email = ingest_ledger.record_key
+          AND registrations.status IN ('open', 'offen')
+    ))
+    OR (kind = 'booking' AND EXISTS (
+        SELECT 1 FROM bookings
+        WHERE bookings.id = CAST(ingest_ledger.record_key AS INTEGER)
+          AND bookings.status = 'pending_review'
+    ))
+"""
+
+
+@dataclass(frozen=True)
+class LedgerEntry:
+    payload_hash: str
+    message_id: str
+    kind: str
+    # The registration email or the booking id.
+    record_key: str
+    result: str
+
+
+def create_tables(connection: sqlite3.Connection) -> None:
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ingest_ledger (
+            payload_hash TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            record_key TEXT NOT NULL,
+            result TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (payload_hash, message_id)
+        ) WITHOUT ROWID
+        """
+    )
+    indexes.ensure_indexes(connection, indexes.LEDGER_INDEXES)
+
+
+def request_kind(request: Union[AccessRequest, BookingRequest]) -> str:
+    return REGISTRATION if isinstance(request, AccessRequest) else BOOKING
+
+
+def _normalize(value: object) -> str:
+    # Case and whitespace differ between otherwise identical submissions.
+    return " ".join(str(value or "").split()).casefold()
+
+
+def payload_hash(request: Union[AccessRequest, BookingRequest]) -> str:
+    """Hash the request type and its normalized field values."""
+
+    values = [request_kind(request)] + [
+        _normalize(getattr(request, field.name))
+        for field in fields(request)
+        if field.name not in _DERIVED_FIELDS
+    ]
+    return hashlib.sha256("\x1f".join(values).encode("utf-8")).hexdigest()
+
+
+def lookup(connection: sqlite3.Connection, digest: str) -> Optional[LedgerEntry]:
+    """Return an entry for ``digest`` whose record still awaits review."""
+
+    row = connection.execute(
+        "SELECT payload_hash, message_id, kind, record_key, result"
+        f" FROM ingest_ledger WHERE payload_hash = ? AND ({_PENDING_RECORD}) LIMIT 1",
+        (digest,),
+    ).fetchone()
+    return LedgerEntry(*row) if row is not None else None
+
+
+def known_message(connection: sqlite3.Connection, message_id: str) -> bool:
+    if not message_id:
+        return False
+    row = connection.execute(
+        "SELECT 1 FROM ingest_ledger WHERE message_id = ? LIMIT 1", (message_id,)
+    ).fetchone()
+    return row is not None
+
+
+def record(connection: sqlite3.Connection, entry: LedgerEntry) -> None:
+    """Write ``entry`` without committing; the caller's transaction does.
+
+    A form entered again by hand has no Message-ID, so its entry replaces the
+    one of the earlier submission and points at the new record.
+    """
+
+    connection.execute(
+        "INSERT OR REPLACE INTO ingest_ledger"
+        " (payload_hash, message_id, kind, record_key, result) VALUES (?, ?, ?, ?, ?)",
+        (entry.payload_hash, entry.message_id, entry.kind, entry.record_key, entry.result),
+    )
@@ -0,0 +1,54 @@
+"""Read exported form emails from a Maildir, an mbox file or ``.eml`` files.
+
+Messages are yielded one at a time as undecoded bytes, so an archive of any
+size can be streamed into :func:`site_coordination.ingest.ingest_archive`.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import mailbox
+from pathlib import Path
+from typing import Iterator
+
+
+@dataclass(frozen=True)
+class ArchivedMessage:
+    # Where the message came from, for error reports.
+    source: str
+    data: bytes
+
+
+def is_maildir(path: Path) -> bool:
+    return all((path / name).is_dir() for name in ("cur", "new", "tmp"))
+
+
+def iter_maildir(path: Path) -> Iterator[ArchivedMessage]:
+    box = mailbox.Maildir(path, factory=None, create=False)
+    # Maildir names start with the delivery time, so this is roughly arrival order.
+    for key in sorted(box.keys()):
+        yield ArchivedMessage(f"{path}/{key}", box.get_bytes(key))
+
+
+def iter_mbox(path: Path) -> Iterator[ArchivedMessage]:
+    box = mailbox.mbox(path, create=False)
+    try:
+        for key in box.iterkeys():
+            yield ArchivedMessage(f"{path}#{key + 1}", box.get_bytes(key))
+    finally:
+        box.close()
+
+
+def iter_eml_files(path: Path) -> Iterator[ArchivedMessage]:
+    for file in sorted(path.glob("*.eml")):
+        yield ArchivedMessage(str(file), file.read_bytes())
+
+
+def iter_directory(path: Path) -> Iterator[ArchivedMessage]:
+    """Read ``path`` as a Maildir if it has one, else as ``.eml`` files."""
+
+    if not path.is_dir():
+        raise NotADirectoryError(f"{path} is not a directory.")
+    if is_maildir(path):
+        return iter_maildir(path)
+    return iter_eml_files(path)
@@ -0,0 +1,338 @@
+"""Versioned schema migrations for the SQLite database.
+
+The applied version is stored in ``PRAGMA user_version``. Checking whether a
+database is current is a single header read, so both web apps can do it on
+every start. Pending migrations run inside one ``BEGIN IMMEDIATE``
+transaction, which takes the write lock before the version is re-read. If two
+containers start at the same time, the second one waits for the first and then
+finds nothing left to do.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import sqlite3
+from typing import Callable
+
+from . import (
+    capacity,
+    imap_sync,
+    indexes,
+    ingest_ledger,
+    presence,
+    rollups,
+    search,
+    sessions,
+    timeslots,
+    timeutil,
+)
+from .config import load_session_policy
+
+
+class SchemaVersionError(RuntimeError):
+    """Raised when the database schema does not match this code version."""
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    apply: Callable[[sqlite3.Connection], None]
+
+
+def _columns(connection: sqlite3.Connection, table: str) -> set[str]:
+    return {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+
+
+def _create_base_tables(connection: sqlite3.Connection) -> None:
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS registrations (
+            email TEXT PRIMARY KEY,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            affiliation TEXT NOT NULL,
+            project TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            activity TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            email TEXT PRIMARY KEY,
+            password TEXT NOT NULL,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            affiliation TEXT NOT NULL,
+            project TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            credentials_sent INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT NOT NULL,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            project TEXT NOT NULL,
+            timeslot_raw TEXT NOT NULL,
+            duration_weeks TEXT NOT NULL,
+            indoor_laptop_workspace TEXT NOT NULL,
+            warehouse_storage_space TEXT NOT NULL,
+            outdoor TEXT NOT NULL,
+            outdoor_type TEXT NOT NULL,
+            equipment TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (email) REFERENCES users(email)
+        )
+        """
+    )
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS activity_research (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT NOT NULL,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            project TEXT NOT NULL,
+            presence TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (email) REFERENCES users(email)
+        )
+        """
+    )
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS activity_service_provider (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            company TEXT NOT NULL,
+            mobile TEXT NOT NULL,
+            service TEXT NOT NULL,
+            presence TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+
+def _add_users_credentials_column(connection: sqlite3.Connection) -> None:
+    if "credentials_sent" not in _columns(connection, "users"):
+        connection.execute(
+            "ALTER TABLE users ADD COLUMN credentials_sent INTEGER NOT NULL DEFAULT 0"
+        )
+
+
+def _add_activity_research_name_columns(connection: sqlite3.Connection) -> None:
+    columns = _columns(connection, "activity_research")
+    if "first_name" not in columns:
+        connection.execute(
+            "ALTER TABLE activity_research ADD COLUMN first_name TEXT NOT NULL DEFAULT ''"
+        )
+    if "last_name" not in columns:
+        connection.execute(
+            "ALTER TABLE activity_research ADD COLUMN last_name TEXT NOT NULL DEFAULT ''"
+        )
+
+
+def _align_booking_request_columns(connection: sqlite3.Connection) -> None:
+    columns = _columns(connection, "bookings")
+    if "indoor" in columns and "indoor_laptop_workspace" not in columns:
+        connection.execute(
+            "ALTER TABLE bookings RENAME COLUMN indoor TO indoor_laptop_workspace"
+        )
+    if "warehouse_storage_space" not in columns:
+        connection.execute(
+            "ALTER TABLE bookings ADD COLUMN warehouse_storage_space TEXT NOT NULL DEFAULT ''"
+        )
+
+
+def _create_hot_path_indexes(connection: sqlite3.Connection) -> None:
+    indexes.ensure_indexes(connection, indexes.HOT_PATH_INDEXES)
+
+
+def _create_search_indexes(connection: sqlite3.Connection) -> None:
+    for spec in search.FTS_TABLES.values():
+        search.create_fts_index(connection, spec)
+
+
+def _add_created_ts_columns(connection: sqlite3.Connection) -> None:
+    # registrations, users and bookings default to CURRENT_TIMESTAMP (UTC).
+    for table in ("registrations", "users", "bookings"):
+        if "created_ts" not in _columns(connection, table):
+            connection.execute(f"ALTER TABLE {table} ADD COLUMN created_ts INTEGER")
+        connection.execute(
+            f"UPDATE {table} SET created_ts = CAST(strftime('%s', created_at) AS INTEGER)"
+            " WHERE created_ts IS NULL"
+        )
+        connection.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_created_ts_ai
+            AFTER INSERT ON {table} WHEN new.created_ts IS NULL BEGIN
+                UPDATE {table}
+                SET created_ts = CAST(strftime('%s', new.created_at) AS INTEGER)
+                WHERE rowid = new.rowid;
+            END
+            """
+        )
+    # Activity rows carry Europe/Berlin local time, which SQLite cannot
+    # convert reliably, so they are backfilled here and written by the app.
+    for table in ("activity_research", "activity_service_provider"):
+        if "created_ts" not in _columns(connection, table):
+            connection.execute(f"ALTER TABLE {table} ADD COLUMN created_ts INTEGER")
+        rows = connection.execute(
+            f"SELECT rowid, created_at FROM {table} WHERE created_ts IS NULL"
+        )
+        while True:
+            batch = rows.fetchmany(5000)
+            if not batch:
+                break
+            connection.executemany(
+                f"UPDATE {table} SET created_ts = ? WHERE rowid = ?",
+                [(timeutil.local_text_to_epoch(row[1]), row[0]) for row in batch],
+            )
+    indexes.ensure_indexes(connection, indexes.TIMESTAMP_INDEXES)
+
+
+def _create_rollups(connection: sqlite3.Connection) -> None:
+    for spec in rollups.INITIAL_ROLLUPS:
+        rollups.create_rollup(connection, spec)
+
+
+def _create_presence_table(connection: sqlite3.Connection) -> None:
+    presence.create_table(connection)
+    presence.fill(connection)
+
+
+def _add_booking_week_columns(connection: sqlite3.Connection) -> None:
+    columns = _columns(connection, "bookings")
+    for column in ("start_week", "end_week", "week_count"):
+        if column not in columns:
+            connection.execute(f"ALTER TABLE bookings ADD COLUMN {column} INTEGER")
+    rows = connection.execute(
+        "SELECT id, timeslot_raw, duration_weeks FROM bookings WHERE start_week IS NULL"
+    )
+    while True:
+        batch = rows.fetchmany(5000)
+        if not batch:
+            break
+        parsed = [(row[0], timeslots.parse_timeslot(row[1], row[2])) for row in batch]
+        connection.executemany(
+            "UPDATE bookings SET start_week = ?, end_week = ?, week_count = ?"
+            " WHERE id = ?",
+            [
+                (slot.start_week, slot.end_week, slot.week_count, booking_id)
+                for booking_id, slot in parsed
+                if slot
+            ],
+        )
+    indexes.ensure_indexes(connection, indexes.TIMESLOT_INDEXES)
+    rollups.drop_rollup(connection, rollups.BOOKING_WEEKLY)
+    rollups.create_rollup(connection, rollups.BOOKING_SLOTS)
+
+
+def _add_booking_screening_columns(connection: sqlite3.Connection) -> None:
+    columns = _columns(connection, "bookings")
+    for column in ("screening_verdict", "screening_reasons"):
+        if column not in columns:
+            connection.execute(f"ALTER TABLE bookings ADD COLUMN {column} TEXT")
+    indexes.ensure_indexes(connection, indexes.SCREENING_INDEXES)
+
+
+def _create_ingest_ledger(connection: sqlite3.Connection) -> None:
+    ingest_ledger.create_tables(connection)
+    # Registrations are upserted now; see site_coordination.search.
+    connection.execute("DROP TRIGGER IF EXISTS registrations_fts_bi")
+
+
+def _backfill_sessions(connection: sqlite3.Connection) -> None:
+    # Pair the existing check-in history once at deploy time, so the first
+    # update after it only reads new events.
+    sessions.backfill(connection, load_session_policy())
+
+
+# Append new steps at the end; never renumber or edit an applied step.
+MIGRATIONS: tuple[Migration, ...] = (
+    Migration(1, "Create base tables", _create_base_tables),
+    Migration(2, "Add users.credentials_sent", _add_users_credentials_column),
+    Migration(
+        3, "Add activity_research name columns", _add_activity_research_name_columns
+    ),
+    Migration(
+        4, "Align bookings with BOOKING_REQUEST_V1", _align_booking_request_columns
+    ),
+    Migration(5, "Create hot path indexes", _create_hot_path_indexes),
+    Migration(6, "Create FTS5 search indexes", _create_search_indexes),
+    Migration(7, "Add epoch created_ts columns", _add_created_ts_columns),
+    Migration(8, "Create analytics rollup tables", _create_rollups),
+    Migration(9, "Create on-site session tables", sessions.create_tables),
+    Migration(10, "Create on-site presence table", _create_presence_table),
+    Migration(11, "Add typed booking week columns", _add_booking_week_columns),
+    Migration(12, "Create capacity state", capacity.create_tables),
+    Migration(13, "Add booking screening columns", _add_booking_screening_columns),
+    Migration(14, "Create IMAP checkpoint table", imap_sync.create_tables),
+    Migration(15, "Create ingest ledger", _create_ingest_ledger),
+    Migration(16, "Backfill on-site sessions", _backfill_sessions),
+)
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def schema_version(connection: sqlite3.Connection) -> int:
+    """Return the schema version recorded in the database header."""
+
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def is_current(connection: sqlite3.Connection) -> bool:
+    """Return True if no migration is pending."""
+
+    return schema_version(connection) == LATEST_VERSION
+
+
+def migrate(connection: sqlite3.Connection) -> list[Migration]:
+    """Apply all pending migrations and return the ones that ran."""
+
+    version = schema_version(connection)
+    if version == LATEST_VERSION:
+        return []
+    if version > LATEST_VERSION:
+        raise SchemaVersionError(
+            f"Database schema version {version} is newer than this code ({LATEST_VERSION})."
+        )
+    if connection.in_transaction:
+        connection.commit()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        version = schema_version(connection)
+        pending = [migration for migration in MIGRATIONS if migration.version > version]
+        for migration in pending:
+            migration.apply(connection)
+            connection.execute(f"PRAGMA user_version = {int(migration.version)}")
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    return pending
+
+
+def ensure_schema(connection: sqlite3.Connection, auto_migrate: bool = False) -> None:
+    """Check the schema version on start; migrate only if ``auto_migrate``."""
+
+    if is_current(connection):
+        return
+    if not auto_migrate:
+        raise SchemaVersionError(
+            f"Database schema version {schema_version(connection)} does not match "
+            f"{LATEST_VERSION}. Run `python -m site_coordination.cli migrate`."
+        )
+    migrate(connection)
@@ -0,0 +1,155 @@
+"""Keyset (cursor) pagination for the manage and activity listings.
+
+Pages are addressed by the sort key of their first or last row instead of an
+OFFSET, so every page is an index range read of ``page_size + 1`` rows no
+matter how deep into the table it is.
+"""
+
+from __future__ import annotations
+
+import base64
+from dataclasses import dataclass
+import json
+import sqlite3
+from typing import Any, Optional
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+@dataclass(frozen=True)
+class Listing:
+    """A paginated ``SELECT {columns} FROM {source} WHERE {where}``.
+
+    ``keys`` must identify a row uniquely, e.g. ``("t.created_at", "t.rowid")``.
+    """
+
+    source: str
+    columns: str
+    keys: tuple[str, str]
+    descending: bool = True
+    where: tuple[str, ...] = ()
+    params: tuple = ()
+
+
+@dataclass(frozen=True)
+class Page:
+    rows: list[sqlite3.Row]
+    page_size: int
+    approx_total: int
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+
+def parse_page_size(raw: Optional[str]) -> int:
+    """Parse a ``page_size`` request argument."""
+
+    try:
+        size = int(raw or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        return DEFAULT_PAGE_SIZE
+    return min(max(size, 1), MAX_PAGE_SIZE)
+
+
+def encode_cursor(direction: str, values: tuple[Any, Any]) -> str:
+    payload = json.dumps([direction, list(values)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[tuple[str, tuple[Any, Any]]]:
+    """Decode a cursor; malformed cursors are treated as the first page."""
+
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        direction, values = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        return None
+    if direction not in {"next", "prev"}:
+        return None
+    if not isinstance(values, list) or len(values) != 2:
+        return None
+    return direction, (values[0], values[1])
+
+
+def fetch_page(
+    connection: sqlite3.Connection,
+    listing: Listing,
+    cursor: Optional[str],
+    page_size: int,
+    approx_total: int,
+) -> Page:
+    """Fetch one page of ``listing`` starting after/before ``cursor``."""
+
+    decoded = decode_cursor(cursor)
+    direction = decoded[0] if decoded else "next"
+    forward_order = "DESC" if listing.descending else "ASC"
+    backward_order = "ASC" if listing.descending else "DESC"
+    # Walking backwards reverses both the comparison and the sort order.
+    if direction == "next":
+        comparison = "<" if listing.descending else ">"
+        order = forward_order
+    else:
+        comparison = ">" if listing.descending else "<"
+        order = backward_order
+
+    where = list(listing.where)
+    params = list(listing.params)
+    if decoded:
+        where.append(f"({listing.keys[0]}, {listing.keys[1]}) {comparison} (?, ?)")
+        params.extend(decoded[1])
+    sql = (
+        f"SELECT {listing.columns}, {listing.keys[0]} AS page_key_0,"
+        f" {listing.keys[1]} AS page_key_1 FROM {listing.source}"
+    )
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {listing.keys[0]} {order}, {listing.keys[1]} {order} LIMIT ?"
+    params.append(page_size + 1)
+    rows = connection.execute(sql, params).fetchall()
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if direction == "prev":
+        rows.reverse()
+    if not rows:
+        return Page(rows=[], page_size=page_size, approx_total=approx_total)
+
+    first = (rows[0]["page_key_0"], rows[0]["page_key_1"])
+    last = (rows[-1]["page_key_0"], rows[-1]["page_key_1"])
+    if direction == "next":
+        next_cursor = encode_cursor("next", last) if has_more else None
+        prev_cursor = encode_cursor("prev", first) if decoded else None
+    else:
+        next_cursor = encode_cursor("next", last)
+        prev_cursor = encode_cursor("prev", first) if has_more else None
+    return Page(
+        rows=rows,
+        page_size=page_size,
+        approx_total=approx_total,
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor,
+    )
+
+
+def approximate_row_count(connection: sqlite3.Connection, table: str) -> int:
+    """Estimate the row count without scanning the table.
+
+    Uses the ``ANALYZE`` statistics when present, otherwise the rowid span,
+    which overcounts by the number of deleted or replaced rows.
+    """
+
+    has_stats = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+    ).fetchone()
+    if has_stats:
+        row = connection.execute(
+            "SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1", (table,)
+        ).fetchone()
+        if row and row[0]:
+            return int(str(row[0]).split()[0])
+    row = connection.execute(
+        f"SELECT max(rowid) - min(rowid) + 1 FROM {table}"
+    ).fetchone()
+    return int(row[0] or 0)
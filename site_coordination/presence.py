@@ -0,0 +1,217 @@
+"""Materialized roster of the people currently on site.
+
+``onsite_presence`` holds one row per person whose last event is a check-in.
+The check-in app upserts the row on check-in and deletes it on check-out, in
+the same transaction as the activity insert. Roster lookups therefore read
+only the people on site, never the event history. :func:`rebuild` recomputes
+the table from the event log.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import sqlite3
+import time
+from typing import Optional
+
+from . import sessions
+from .config import SessionPolicy
+
+RESEARCH = "research"
+SERVICE = "service"
+
+
+@dataclass(frozen=True)
+class PresenceEvent:
+    source: str
+    person: str
+    name: str
+    group_name: str
+    detail: str
+    presence: str
+    created_at: str
+    created_ts: Optional[int]
+    event_id: int
+
+
+def create_table(connection: sqlite3.Connection) -> None:
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS onsite_presence (
+            source TEXT NOT NULL,
+            person TEXT NOT NULL,
+            name TEXT NOT NULL,
+            group_name TEXT NOT NULL,
+            detail TEXT NOT NULL,
+            checked_in_at TEXT NOT NULL,
+            checked_in_ts INTEGER,
+            event_id INTEGER NOT NULL,
+            PRIMARY KEY (source, person)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def research_person(email: str) -> str:
+    return email.strip().lower()
+
+
+def service_person(name: str, mobile: str) -> str:
+    return f"{name.strip().lower()}|{mobile.strip()}"
+
+
+def research_event(
+    email: str,
+    first_name: str,
+    last_name: str,
+    project: str,
+    presence: str,
+    created_at: str,
+    created_ts: Optional[int],
+    event_id: int,
+) -> PresenceEvent:
+    name = f"{first_name} {last_name}".strip() or email
+    return PresenceEvent(
+        RESEARCH,
+        research_person(email),
+        name,
+        project,
+        email,
+        presence,
+        created_at,
+        created_ts,
+        event_id,
+    )
+
+
+def service_event(
+    name: str,
+    company: str,
+    mobile: str,
+    service: str,
+    presence: str,
+    created_at: str,
+    created_ts: Optional[int],
+    event_id: int,
+) -> PresenceEvent:
+    return PresenceEvent(
+        SERVICE,
+        service_person(name, mobile),
+        name,
+        company,
+        service,
+        presence,
+        created_at,
+        created_ts,
+        event_id,
+    )
+
+
+def record_event(connection: sqlite3.Connection, event: PresenceEvent) -> None:
+    """Apply one check-in or check-out; the caller commits."""
+
+    if event.presence != sessions.CHECK_IN:
+        connection.execute(
+            "DELETE FROM onsite_presence WHERE source = ? AND person = ?",
+            (event.source, event.person),
+        )
+        return
+    connection.execute(
+        """
+        INSERT INTO onsite_presence (
+            source, person, name, group_name, detail, checked_in_at, checked_in_ts,
+            event_id
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (source, person) DO UPDATE SET
+            name = excluded.name,
+            group_name = excluded.group_name,
+            detail = excluded.detail,
+            checked_in_at = excluded.checked_in_at,
+            checked_in_ts = excluded.checked_in_ts,
+            event_id = excluded.event_id
+        """,
+        (
+            event.source,
+            event.person,
+            event.name,
+            event.group_name,
+            event.detail,
+            event.created_at,
+            event.created_ts,
+            event.event_id,
+        ),
+    )
+
+
+def _event_log(connection: sqlite3.Connection):
+    cursor = connection.execute(
+        "SELECT id, email, first_name, last_name, project, presence, created_at,"
+        " created_ts FROM activity_research ORDER BY id"
+    )
+    cursor.row_factory = None
+    for row in cursor:
+        yield research_event(*row[1:], event_id=row[0])
+    cursor = connection.execute(
+        "SELECT id, name, company, mobile, service, presence, created_at, created_ts"
+        " FROM activity_service_provider ORDER BY id"
+    )
+    cursor.row_factory = None
+    for row in cursor:
+        yield service_event(*row[1:], event_id=row[0])
+
+
+def fill(connection: sqlite3.Connection) -> int:
+    """Replace the table with the last check-in of everyone still on site."""
+
+    last_events: dict[tuple[str, str], PresenceEvent] = {}
+    for event in _event_log(connection):
+        last_events[(event.source, event.person)] = event
+    connection.execute("DELETE FROM onsite_presence")
+    on_site = [
+        event for event in last_events.values() if event.presence == sessions.CHECK_IN
+    ]
+    for event in on_site:
+        record_event(connection, event)
+    return len(on_site)
+
+
+def rebuild(connection: sqlite3.Connection) -> int:
+    """Rebuild the roster from the event log and return the people on site."""
+
+    if connection.in_transaction:
+        connection.commit()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        count = fill(connection)
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    return count
+
+
+def current_roster(
+    connection: sqlite3.Connection,
+    policy: SessionPolicy,
+    now_ts: Optional[int] = None,
+) -> list[dict]:
+    """Return everyone on site, flagging check-ins past the session limit."""
+
+    now_ts = int(time.time()) if now_ts is None else now_ts
+    rows = connection.execute(
+        "SELECT source, name, group_name, detail, checked_in_at, checked_in_ts"
+        " FROM onsite_presence ORDER BY source, group_name, name"
+    ).fetchall()
+    return [
+        {
+            "type": row[0],
+            "name": row[1],
+            "group": row[2],
+            "detail": row[3],
+            "checked_in_at": row[4],
+            "stale": row[5] is not None
+            and sessions.session_limit(row[5], policy) < now_ts,
+        }
+        for row in rows
+    ]
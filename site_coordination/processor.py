@@ -2,18 +2,28 @@
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from typing import Union
 
-from . import db
+from . import db, ingest_ledger
+from .conflicts import RESOURCE_COLUMNS
 from .email_parser import AccessRequest, BookingRequest
+from .screening import screen_booking
+from .timeslots import parse_timeslot
 
 
 @dataclass(frozen=True)
 class ProcessingResult:
     message: str
+    # The registration email or the booking id.
+    record_key: str = ""
+    # Set if the ingest ledger already had the request and nothing was stored.
+    duplicate: bool = False
 
 
-def handle_access_request(connection, request: AccessRequest) -> ProcessingResult:
+def handle_access_request(
+    connection, request: AccessRequest, commit: bool = True
+) -> ProcessingResult:
     """Store an access request with status 'open'."""
 
     record = db.RegistrationRecord(
@@ -26,13 +36,28 @@ def handle_access_request(connection, request: AccessRequest) -> ProcessingResul
         activity=request.activity,
         status="open",
     )
-    db.insert_registration(connection, record)
-    return ProcessingResult(message=f"Registration stored for {request.email}.")
+    db.insert_registration(connection, record, commit=commit)
+    return ProcessingResult(
+        message=f"Registration stored for {request.email}.", record_key=request.email
+    )
 
 
-def handle_booking_request(connection, request: BookingRequest) -> ProcessingResult:
-    """Store a booking request with status 'pending_review'."""
+def handle_booking_request(
+    connection, request: BookingRequest, commit: bool = True
+) -> ProcessingResult:
+    """Screen a booking request and store it with status 'pending_review'."""
 
+    timeslot = request.timeslot or parse_timeslot(
+        request.timeslot_raw, request.duration_weeks
+    )
+    screening = screen_booking(
+        connection,
+        request.email,
+        request.project,
+        request.timeslot_raw,
+        timeslot,
+        {column: getattr(request, column) for column in RESOURCE_COLUMNS.values()},
+    )
     record = db.BookingRecord(
         email=request.email,
         first_name=request.first_name,
@@ -46,6 +71,62 @@ def handle_booking_request(connection, request: BookingRequest) -> ProcessingRes
         outdoor_type=request.outdoor_type,
         equipment=request.equipment,
         status="pending_review",
+        start_week=timeslot.start_week if timeslot else None,
+        end_week=timeslot.end_week if timeslot else None,
+        week_count=timeslot.week_count if timeslot else None,
+        screening_verdict=screening.verdict,
+        screening_reasons=screening.reasons_text,
     )
-    db.insert_booking(connection, record)
-    return ProcessingResult(message=f"Booking stored for {request.email}.")
+    booking_id = db.insert_booking(connection, record, commit=commit)
+    message = f"Booking stored for {request.email} (screening: {screening.verdict}"
+    if screening.reasons:
+        message += f"; {', '.join(screening.reasons)}"
+    return ProcessingResult(message=message + ").", record_key=str(booking_id))
+
+
+def handle_request(
+    connection, request: Union[AccessRequest, BookingRequest], commit: bool = True
+) -> ProcessingResult:
+    """Store a parsed request of either type."""
+
+    if isinstance(request, AccessRequest):
+        return handle_access_request(connection, request, commit=commit)
+    return handle_booking_request(connection, request, commit=commit)
+
+
+def process_request(
+    connection,
+    request: Union[AccessRequest, BookingRequest],
+    message_id: str = "",
+    commit: bool = True,
+) -> ProcessingResult:
+    """Store a request and record it in the ingest ledger, unless it is known.
+
+    The request and its ledger entry are written in the same transaction.
+    """
+
+    digest = ingest_ledger.payload_hash(request)
+    known = ingest_ledger.lookup(connection, digest)
+    if known is not None:
+        # Recorded under this Message-ID too, so a replay skips it unparsed.
+        ingest_ledger.record(connection, replace(known, message_id=message_id))
+        result = ProcessingResult(
+            message=f"Already processed: {known.result}",
+            record_key=known.record_key,
+            duplicate=True,
+        )
+    else:
+        result = handle_request(connection, request, commit=False)
+        ingest_ledger.record(
+            connection,
+            ingest_ledger.LedgerEntry(
+                digest,
+                message_id,
+                ingest_ledger.request_kind(request),
+                result.record_key,
+                result.message,
+            ),
+        )
+    if commit:
+        connection.commit()
+    return result
@@ -0,0 +1,174 @@
+"""Analytics rollup tables kept current by triggers.
+
+Each rollup stores one counter row per group key. Triggers on the source
+table move counters on insert, delete and key changes. The analysis page
+therefore reads a few aggregate rows instead of the raw history. Activity days
+are taken from ``created_at``, which the check-in app writes in site-local time.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import sqlite3
+
+# First non-empty ``;``-separated part of ``bookings.timeslot_raw``.
+WEEK_SQL = (
+    "coalesce(nullif(trim(substr(ltrim({row}.timeslot_raw, '; '), 1,"
+    " instr(ltrim({row}.timeslot_raw, '; ') || ';', ';') - 1)), ''), 'unknown')"
+)
+
+
+@dataclass(frozen=True)
+class RollupSpec:
+    """A counter table grouped by ``keys`` over ``source``.
+
+    ``keys`` maps each rollup column to an SQL expression over the source row
+    alias ``{row}``. ``watched`` lists the source columns those expressions read.
+    """
+
+    table: str
+    source: str
+    keys: tuple[tuple[str, str], ...]
+    watched: tuple[str, ...]
+    integer_keys: tuple[str, ...] = ()
+
+    @property
+    def key_columns(self) -> tuple[str, ...]:
+        return tuple(column for column, _ in self.keys)
+
+    def expressions(self, row: str) -> tuple[str, ...]:
+        return tuple(expression.format(row=row) for _, expression in self.keys)
+
+
+RESEARCH_DAILY = RollupSpec(
+    "rollup_research_daily",
+    "activity_research",
+    (
+        ("day", "substr({row}.created_at, 1, 10)"),
+        ("email", "{row}.email"),
+        ("project", "{row}.project"),
+    ),
+    ("created_at", "email", "project"),
+)
+SERVICE_DAILY = RollupSpec(
+    "rollup_service_daily",
+    "activity_service_provider",
+    (
+        ("day", "substr({row}.created_at, 1, 10)"),
+        ("service", "{row}.service"),
+    ),
+    ("created_at", "service"),
+)
+# Superseded by BOOKING_SLOTS (migration 11); kept so migration 8 replays.
+BOOKING_WEEKLY = RollupSpec(
+    "rollup_booking_week_project",
+    "bookings",
+    (
+        ("week", WEEK_SQL),
+        ("project", "{row}.project"),
+    ),
+    ("timeslot_raw", "project"),
+)
+
+BOOKING_SLOTS = RollupSpec(
+    "rollup_booking_slots",
+    "bookings",
+    (
+        ("start_week", "coalesce({row}.start_week, 0)"),
+        ("end_week", "coalesce({row}.end_week, 0)"),
+        ("project", "{row}.project"),
+    ),
+    ("start_week", "end_week", "project"),
+    integer_keys=("start_week", "end_week"),
+)
+
+INITIAL_ROLLUPS: tuple[RollupSpec, ...] = (RESEARCH_DAILY, SERVICE_DAILY, BOOKING_WEEKLY)
+ROLLUPS: tuple[RollupSpec, ...] = (RESEARCH_DAILY, SERVICE_DAILY, BOOKING_SLOTS)
+
+
+def _increment_sql(spec: RollupSpec, row: str) -> str:
+    columns = ", ".join(spec.key_columns)
+    return (
+        f"INSERT INTO {spec.table} ({columns}, total)"
+        f" VALUES ({', '.join(spec.expressions(row))}, 1)"
+        f" ON CONFLICT ({columns}) DO UPDATE SET total = total + 1;"
+    )
+
+
+def _decrement_sql(spec: RollupSpec, row: str) -> str:
+    match = " AND ".join(
+        f"{column} = {expression}"
+        for column, expression in zip(spec.key_columns, spec.expressions(row))
+    )
+    return (
+        f"UPDATE {spec.table} SET total = total - 1 WHERE {match};"
+        f" DELETE FROM {spec.table} WHERE {match} AND total <= 0;"
+    )
+
+
+def _column_sql(spec: RollupSpec, column: str) -> str:
+    column_type = "INTEGER" if column in spec.integer_keys else "TEXT"
+    return f"{column} {column_type} NOT NULL"
+
+
+def create_rollup(connection: sqlite3.Connection, spec: RollupSpec) -> None:
+    """Create one rollup table with its triggers and fill it."""
+
+    columns = ", ".join(spec.key_columns)
+    connection.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {spec.table} (
+            {", ".join(_column_sql(spec, column) for column in spec.key_columns)},
+            total INTEGER NOT NULL,
+            PRIMARY KEY ({columns})
+        ) WITHOUT ROWID
+        """
+    )
+    connection.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {spec.table}_ai AFTER INSERT ON {spec.source}
+        BEGIN {_increment_sql(spec, "new")} END
+        """
+    )
+    connection.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {spec.table}_ad AFTER DELETE ON {spec.source}
+        BEGIN {_decrement_sql(spec, "old")} END
+        """
+    )
+    connection.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {spec.table}_au
+        AFTER UPDATE OF {", ".join(spec.watched)} ON {spec.source}
+        BEGIN {_decrement_sql(spec, "old")} {_increment_sql(spec, "new")} END
+        """
+    )
+    _fill(connection, spec)
+
+
+def drop_rollup(connection: sqlite3.Connection, spec: RollupSpec) -> None:
+    """Remove a rollup table and its triggers."""
+
+    for suffix in ("ai", "ad", "au"):
+        connection.execute(f"DROP TRIGGER IF EXISTS {spec.table}_{suffix}")
+    connection.execute(f"DROP TABLE IF EXISTS {spec.table}")
+
+
+def _fill(connection: sqlite3.Connection, spec: RollupSpec) -> None:
+    connection.execute(f"DELETE FROM {spec.table}")
+    connection.execute(
+        f"""
+        INSERT INTO {spec.table} ({", ".join(spec.key_columns)}, total)
+        SELECT {", ".join(spec.expressions(spec.source))}, count(*)
+        FROM {spec.source}
+        GROUP BY {", ".join(spec.expressions(spec.source))}
+        """
+    )
+
+
+def rebuild(connection: sqlite3.Connection) -> None:
+    """Recount every rollup from its source table."""
+
+    for spec in ROLLUPS:
+        _fill(connection, spec)
+    connection.commit()
@@ -0,0 +1,133 @@
+"""Automatic pre-screening of booking requests at ingest.
+
+Every incoming booking is checked before it is stored, with one indexed
+lookup per check:
+
+- ``unknown_user``: no ``users`` row for the email.
+- ``duplicate``: the same user already has an active booking for the same
+  project, weeks and resources.
+- ``overlap``: the user has another active booking in overlapping weeks.
+- ``capacity:<resource>``: a requested resource has no free slot left in one
+  of the weeks (see :mod:`site_coordination.capacity`).
+- ``unparsed_timeslot``: no start week could be read from the timeslot.
+
+The verdict is ``reject`` for duplicates, ``review`` for any other reason and
+``clear`` otherwise. It is advisory only; the booking status is not changed.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import sqlite3
+from typing import Optional
+
+from . import capacity, conflicts
+from .timeslots import Timeslot
+
+VERDICT_CLEAR = "clear"
+VERDICT_REVIEW = "review"
+VERDICT_REJECT = "reject"
+VERDICTS = (VERDICT_CLEAR, VERDICT_REVIEW, VERDICT_REJECT)
+
+REASON_LABELS = {
+    "unknown_user": "No registered user",
+    "duplicate": "Duplicate submission",
+    "overlap": "Overlaps another booking of this user",
+    "unparsed_timeslot": "Timeslot not recognized",
+    "capacity:indoor": "Indoor workspace full",
+    "capacity:warehouse": "Warehouse storage full",
+    "capacity:outdoor": "Outdoor area full",
+}
+
+
+@dataclass(frozen=True)
+class Screening:
+    verdict: str
+    reasons: tuple[str, ...]
+
+    @property
+    def reasons_text(self) -> str:
+        return ",".join(self.reasons)
+
+
+def _active_bookings_sql(where: str) -> str:
+    inactive = ", ".join("?" for _ in conflicts.INACTIVE_STATUSES)
+    return f"SELECT 1 FROM bookings WHERE {where} AND status NOT IN ({inactive}) LIMIT 1"
+
+
+def _exists(connection: sqlite3.Connection, sql: str, params: list[object]) -> bool:
+    return connection.execute(sql, params).fetchone() is not None
+
+
+def screen_booking(
+    connection: sqlite3.Connection,
+    email: str,
+    project: str,
+    timeslot_raw: str,
+    timeslot: Optional[Timeslot],
+    resources: dict[str, str],
+) -> Screening:
+    """Screen one booking that has not been stored yet.
+
+    ``resources`` maps each ``conflicts.RESOURCE_COLUMNS`` column to the
+    submitted value.
+    """
+
+    reasons: list[str] = []
+    inactive = list(conflicts.INACTIVE_STATUSES)
+    requested = sorted(
+        resource
+        for resource, column in conflicts.RESOURCE_COLUMNS.items()
+        if conflicts.is_requested(resources.get(column))
+    )
+    if not _exists(connection, "SELECT 1 FROM users WHERE email = ?", [email]):
+        reasons.append("unknown_user")
+
+    if timeslot is None:
+        reasons.append("unparsed_timeslot")
+        same_slot = ("timeslot_raw = ?", [timeslot_raw])
+    else:
+        same_slot = (
+            "start_week = ? AND end_week = ?",
+            [timeslot.start_week, timeslot.end_week],
+        )
+    same_resources = " AND ".join(
+        f"{column} = ?" for column in conflicts.RESOURCE_COLUMNS.values()
+    )
+    if _exists(
+        connection,
+        _active_bookings_sql(
+            f"email = ? AND project = ? AND {same_slot[0]} AND {same_resources}"
+        ),
+        [
+            email,
+            project,
+            *same_slot[1],
+            *(resources.get(column) for column in conflicts.RESOURCE_COLUMNS.values()),
+            *inactive,
+        ],
+    ):
+        reasons.append("duplicate")
+
+    if timeslot is not None:
+        if "duplicate" not in reasons and _exists(
+            connection,
+            _active_bookings_sql("email = ? AND start_week <= ? AND end_week >= ?"),
+            [email, timeslot.end_week, timeslot.start_week, *inactive],
+        ):
+            reasons.append("overlap")
+        if requested:
+            free = capacity.get_tracker().free(
+                connection, timeslot.start_week, timeslot.end_week
+            )
+            reasons.extend(
+                f"capacity:{resource}" for resource in requested if free[resource] < 1
+            )
+
+    if "duplicate" in reasons:
+        verdict = VERDICT_REJECT
+    elif reasons:
+        verdict = VERDICT_REVIEW
+    else:
+        verdict = VERDICT_CLEAR
+    return Screening(verdict, tuple(reasons))
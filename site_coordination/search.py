@@ -0,0 +1,177 @@
+"""FTS5 full-text search over the manage-page tables.
+
+Each searchable table gets an external-content FTS5 index named
+``<table>_fts`` that stores only the inverted index and reads column values
+from the base table. Triggers keep it in sync. ``users`` is written with
+``INSERT OR REPLACE``, and the implicit delete of a REPLACE does not fire
+delete triggers while ``recursive_triggers`` is off (the SQLite default). For
+such tables, a BEFORE INSERT trigger removes the old index entry.
+``registrations`` uses an ``ON CONFLICT DO UPDATE`` upsert instead, which the
+update trigger covers; a BEFORE INSERT trigger would fire for it as well and
+delete the entry twice.
+
+Rowids of tables without an INTEGER PRIMARY KEY may change on ``VACUUM``;
+run :func:`rebuild` afterwards.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import re
+import sqlite3
+from typing import Optional
+
+from .pagination import Listing
+
+
+@dataclass(frozen=True)
+class FtsSpec:
+    table: str
+    columns: tuple[str, ...]
+    replace_key: Optional[str] = None
+
+    @property
+    def fts_table(self) -> str:
+        return f"{self.table}_fts"
+
+
+FTS_TABLES: dict[str, FtsSpec] = {
+    spec.table: spec
+    for spec in (
+        FtsSpec(
+            "registrations",
+            ("email", "first_name", "last_name", "affiliation", "project", "status"),
+        ),
+        FtsSpec(
+            "users",
+            ("email", "first_name", "last_name", "affiliation", "project", "phone"),
+            replace_key="email",
+        ),
+        FtsSpec(
+            "bookings",
+            ("email", "first_name", "last_name", "project", "timeslot_raw", "status"),
+        ),
+        FtsSpec(
+            "activity_research",
+            ("email", "first_name", "last_name", "project", "presence", "created_at"),
+        ),
+        FtsSpec(
+            "activity_service_provider",
+            ("name", "company", "service", "presence", "created_at"),
+        ),
+    )
+}
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def _values(prefix: str, columns: tuple[str, ...]) -> str:
+    return ", ".join(f"{prefix}.{column}" for column in columns)
+
+
+def create_fts_index(connection: sqlite3.Connection, spec: FtsSpec) -> None:
+    """Create the FTS5 table and sync triggers for one table and fill it."""
+
+    fts = spec.fts_table
+    columns = ", ".join(spec.columns)
+    connection.execute(
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+            {columns},
+            content='{spec.table}',
+            prefix='2 3',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """
+    )
+    connection.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {spec.table} BEGIN
+            INSERT INTO {fts} (rowid, {columns})
+            VALUES (new.rowid, {_values("new", spec.columns)});
+        END
+        """
+    )
+    connection.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {spec.table} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, {columns})
+            VALUES ('delete', old.rowid, {_values("old", spec.columns)});
+        END
+        """
+    )
+    connection.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {columns} ON {spec.table}
+        BEGIN
+            INSERT INTO {fts} ({fts}, rowid, {columns})
+            VALUES ('delete', old.rowid, {_values("old", spec.columns)});
+            INSERT INTO {fts} (rowid, {columns})
+            VALUES (new.rowid, {_values("new", spec.columns)});
+        END
+        """
+    )
+    if spec.replace_key:
+        connection.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {fts}_bi BEFORE INSERT ON {spec.table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {columns})
+                SELECT 'delete', rowid, {columns} FROM {spec.table}
+                WHERE {spec.replace_key} = new.{spec.replace_key};
+            END
+            """
+        )
+    connection.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+def rebuild(connection: sqlite3.Connection) -> None:
+    """Rebuild every FTS index from its base table."""
+
+    for spec in FTS_TABLES.values():
+        fts = spec.fts_table
+        connection.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+    connection.commit()
+
+
+def build_match_query(query: str) -> str:
+    """Turn free text into an FTS5 query that prefix-matches every word."""
+
+    return " ".join(f'"{token}"*' for token in _TOKEN_PATTERN.findall(query))
+
+
+def search_listing(table: str, query: str, ranked: bool = False) -> Optional[Listing]:
+    """Return a paginated listing of the rows matching ``query``, newest first.
+
+    Pages are keyed on ``(created_at, rowid)`` like the unfiltered listings.
+    With ``ranked``, rows come best match first (bm25). The rank of a row
+    changes whenever a matching row is written, so a cursor over it could
+    repeat or skip rows; use only the first page of a ranked listing. Returns
+    None if the query contains no searchable words.
+    """
+
+    spec = FTS_TABLES[table]
+    match = build_match_query(query)
+    if not match:
+        return None
+    fts = spec.fts_table
+    order_key = f"{fts}.rank" if ranked else f"{table}.created_at"
+    return Listing(
+        source=f"{fts} JOIN {table} ON {table}.rowid = {fts}.rowid",
+        columns=f"{table}.*, {table}.rowid AS row_key",
+        keys=(order_key, f"{table}.rowid"),
+        descending=not ranked,
+        where=(f"{fts} MATCH ?",),
+        params=(match,),
+    )
+
+
+def count_matches(connection: sqlite3.Connection, table: str, query: str) -> int:
+    """Count the rows matching ``query`` using the FTS index only."""
+
+    match = build_match_query(query)
+    if not match:
+        return 0
+    fts = FTS_TABLES[table].fts_table
+    return connection.execute(
+        f"SELECT count(*) FROM {fts} WHERE {fts} MATCH ?", (match,)
+    ).fetchone()[0]
@@ -0,0 +1,59 @@
+"""Periodic folding of new check-in/check-out events into on-site sessions."""
+
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+from typing import Optional
+
+from site_coordination import db, sessions
+from site_coordination.config import DatabaseConfig, SessionPolicy, load_database_config
+
+
+class SessionUpdater:
+    """Background loop that runs :func:`sessions.update` off the request path."""
+
+    def __init__(
+        self, config: DatabaseConfig, policy: SessionPolicy, logger: logging.Logger
+    ) -> None:
+        self._config = config
+        self._policy = policy
+        self._logger = logger
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self._policy.update_interval_seconds):
+            self.update_once()
+
+    def update_once(self) -> None:
+        if not self._config.path.exists():
+            return
+        try:
+            connection = db.connect(self._config.path, profile=self._config.profile)
+            try:
+                sessions.update(connection, self._policy)
+            finally:
+                connection.close()
+        except sqlite3.Error as exc:
+            self._logger.warning("Session update failed: %s", exc)
+
+
+def start_session_updater(
+    policy: SessionPolicy, logger: logging.Logger
+) -> Optional[SessionUpdater]:
+    """Start the session update loop unless its interval is 0."""
+
+    if policy.update_interval_seconds <= 0:
+        logger.info("Session update task disabled.")
+        return None
+    updater = SessionUpdater(config=load_database_config(), policy=policy, logger=logger)
+    updater.start()
+    return updater
@@ -0,0 +1,516 @@
+"""Pair check-in and check-out events into on-site sessions.
+
+Events of one person are walked in id order. A check-in opens a session, and
+the next check-out closes it if it arrives before the session limit. The
+limit is local midnight for the ``end_of_day`` policy, and
+``max_session_hours`` after the check-in otherwise. Sessions without a
+matching check-out become ``missing_checkout``, and check-outs without an
+open session become ``orphan_checkout``. See
+:class:`~site_coordination.config.SessionPolicy`.
+
+``onsite_session_checkpoints`` records the last event id folded in per
+source, so :func:`update` only reads new events and the open sessions they
+may close. :func:`rebuild` recomputes everything with vectorized shifts over
+the full event history and yields the same sessions. Migration 16 pairs the
+existing history once (:func:`backfill`); afterwards the check-in app's
+background updater (:mod:`site_coordination.session_updater`) or
+``cli update-sessions`` fold in new events, never a web request.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import sqlite3
+import time
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from . import timeutil
+from .analysis import read_frame
+from .config import SessionPolicy
+
+CHECK_IN = "check-in"
+
+STATUS_OPEN = "open"
+STATUS_CLOSED = "closed"
+STATUS_MISSING = "missing_checkout"
+STATUS_ORPHAN = "orphan_checkout"
+
+_EVENT_COLUMNS = ["id", "person", "label", "group_name", "presence", "ts"]
+_SESSION_COLUMNS = [
+    "person",
+    "label",
+    "group_name",
+    "start_event_id",
+    "start_ts",
+    "end_event_id",
+    "end_ts",
+    "limit_ts",
+    "anchor_ts",
+    "status",
+]
+
+_SUMMARY_COLUMNS = [
+    "label",
+    "group_name",
+    "start_ts",
+    "end_ts",
+    "limit_ts",
+    "anchor_ts",
+    "status",
+]
+
+
+@dataclass(frozen=True)
+class EventSource:
+    """An activity table; the expressions identify, name and group a person."""
+
+    table: str
+    person: str
+    label: str
+    group_name: str
+
+
+SOURCES: dict[str, EventSource] = {
+    "research": EventSource("activity_research", "lower(email)", "email", "project"),
+    "service": EventSource(
+        "activity_service_provider",
+        "lower(trim(name)) || '|' || trim(mobile)",
+        "name",
+        "company",
+    ),
+}
+
+
+def create_tables(connection: sqlite3.Connection) -> None:
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS onsite_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT NOT NULL,
+            person TEXT NOT NULL,
+            label TEXT NOT NULL,
+            group_name TEXT NOT NULL,
+            start_event_id INTEGER,
+            start_ts INTEGER,
+            end_event_id INTEGER,
+            end_ts INTEGER,
+            limit_ts INTEGER,
+            anchor_ts INTEGER NOT NULL,
+            status TEXT NOT NULL
+        )
+        """
+    )
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS onsite_session_checkpoints (
+            source TEXT PRIMARY KEY,
+            last_event_id INTEGER NOT NULL
+        )
+        """
+    )
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS idx_onsite_sessions_source_anchor "
+        "ON onsite_sessions (source, anchor_ts)"
+    )
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS idx_onsite_sessions_source_status_person "
+        "ON onsite_sessions (source, status, person)"
+    )
+
+
+def session_limit(start_ts: int, policy: SessionPolicy) -> int:
+    """Return the latest epoch second a check-out may close this session."""
+
+    if policy.missing_checkout == "end_of_day":
+        day = datetime.fromtimestamp(start_ts, timeutil.SITE_TIMEZONE).date()
+        return timeutil.local_day_start(day + timedelta(days=1))
+    return start_ts + policy.max_session_hours * 3600
+
+
+def _limits(ts: pd.Series, policy: SessionPolicy) -> pd.Series:
+    if policy.missing_checkout != "end_of_day":
+        return ts + policy.max_session_hours * 3600
+    local = pd.to_datetime(ts, unit="s", utc=True).dt.tz_convert(timeutil.SITE_TIMEZONE)
+    day_end = local.dt.normalize() + pd.DateOffset(days=1)
+    return (day_end - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)
+
+
+def _missing_end(
+    limit: int, next_ts: Optional[int], policy: SessionPolicy
+) -> Optional[int]:
+    if policy.missing_checkout == "discard":
+        return None
+    return limit if next_ts is None else min(limit, next_ts)
+
+
+def _load_events(
+    connection: sqlite3.Connection, source: EventSource, after_id: int
+) -> pd.DataFrame:
+    sql = (
+        f"SELECT id, {source.person}, {source.label}, {source.group_name},"
+        f" presence, created_ts FROM {source.table}"
+        " WHERE id > ? AND created_ts IS NOT NULL ORDER BY id"
+    )
+    return read_frame(connection, sql, [after_id], _EVENT_COLUMNS)
+
+
+def _ignored_checkins(
+    frame: pd.DataFrame, is_in: pd.Series, policy: SessionPolicy
+) -> pd.Series:
+    """Flag repeated check-ins that ``keep_first`` folds into the open session."""
+
+    new_run = (frame["person"] != frame["person"].shift()) | (is_in != is_in.shift())
+    run = new_run.cumsum()
+    if policy.missing_checkout == "end_of_day":
+        # The limit is the end of the starter's day, so within a run of
+        # check-ins the first one of each local day starts a session.
+        day = pd.to_datetime(frame["ts"], unit="s", utc=True).dt.tz_convert(
+            timeutil.SITE_TIMEZONE
+        ).dt.date
+        return is_in & pd.DataFrame({"run": run, "day": day}).duplicated()
+    ignored = pd.Series(False, index=frame.index)
+    run_sizes = run[is_in].value_counts()
+    for run_id in run_sizes[run_sizes > 1].index:
+        limit = None
+        for index in run.index[run == run_id]:
+            ts = int(frame.at[index, "ts"])
+            if limit is not None and ts <= limit:
+                ignored.at[index] = True
+            else:
+                limit = session_limit(ts, policy)
+    return ignored
+
+
+def pair_events(
+    frame: pd.DataFrame, policy: SessionPolicy, now_ts: int
+) -> pd.DataFrame:
+    """Turn a full event history into sessions with vectorized shifts."""
+
+    if frame.empty:
+        return pd.DataFrame(columns=_SESSION_COLUMNS)
+    frame = frame.sort_values(["person", "id"], kind="stable").reset_index(drop=True)
+    frame["ts"] = frame["ts"].astype("int64")
+    is_in = frame["presence"] == CHECK_IN
+    if policy.double_checkin == "keep_first":
+        keep = ~_ignored_checkins(frame, is_in, policy)
+        frame = frame[keep].reset_index(drop=True)
+        is_in = is_in[keep].reset_index(drop=True)
+
+    limit = _limits(frame["ts"], policy)
+    same_next = frame["person"] == frame["person"].shift(-1)
+    same_prev = frame["person"] == frame["person"].shift(1)
+    next_ts = frame["ts"].shift(-1).where(same_next)
+    next_id = frame["id"].shift(-1).where(same_next)
+    next_is_out = same_next & ~is_in.shift(-1, fill_value=True)
+
+    paired = is_in & next_is_out & (next_ts <= limit)
+    is_open = is_in & ~same_next & (limit >= now_ts)
+    missing = is_in & ~paired & ~is_open
+    if policy.missing_checkout == "discard":
+        missing_end = pd.Series(np.nan, index=frame.index)
+    else:
+        missing_end = pd.Series(np.fmin(limit, next_ts), index=frame.index)
+
+    consumed = (
+        ~is_in
+        & same_prev
+        & is_in.shift(1, fill_value=False)
+        & (frame["ts"] <= limit.shift(1))
+    )
+    starts = frame.assign(
+        start_event_id=frame["id"],
+        start_ts=frame["ts"],
+        end_event_id=next_id.where(paired),
+        end_ts=next_ts.where(paired, missing_end.where(missing)),
+        limit_ts=limit,
+        anchor_ts=frame["ts"],
+        status=np.select(
+            [paired, is_open], [STATUS_CLOSED, STATUS_OPEN], default=STATUS_MISSING
+        ),
+    )[is_in]
+    orphans = frame.assign(
+        start_event_id=np.nan,
+        start_ts=np.nan,
+        end_event_id=frame["id"],
+        end_ts=frame["ts"],
+        limit_ts=np.nan,
+        anchor_ts=frame["ts"],
+        status=STATUS_ORPHAN,
+    )[~is_in & ~consumed]
+    sessions = pd.concat([starts, orphans]).sort_values("id", kind="stable")
+    return sessions[_SESSION_COLUMNS]
+
+
+def _nullable(value: object) -> Optional[int]:
+    if value is None or pd.isna(value):
+        return None
+    return int(value)
+
+
+def _rebuild_source(
+    connection: sqlite3.Connection, key: str, policy: SessionPolicy, now_ts: int
+) -> int:
+    events = _load_events(connection, SOURCES[key], 0)
+    sessions = pair_events(events, policy, now_ts)
+    connection.execute("DELETE FROM onsite_sessions WHERE source = ?", (key,))
+    connection.executemany(
+        f"""
+        INSERT INTO onsite_sessions (source, {", ".join(_SESSION_COLUMNS)})
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            (
+                key,
+                row.person,
+                row.label,
+                row.group_name,
+                _nullable(row.start_event_id),
+                _nullable(row.start_ts),
+                _nullable(row.end_event_id),
+                _nullable(row.end_ts),
+                _nullable(row.limit_ts),
+                int(row.anchor_ts),
+                row.status,
+            )
+            for row in sessions.itertuples(index=False)
+        ),
+    )
+    last_id = int(events["id"].max()) if not events.empty else 0
+    _set_checkpoint(connection, key, last_id)
+    return len(events)
+
+
+def _checkpoint(connection: sqlite3.Connection, key: str) -> Optional[int]:
+    # None if the source was never paired; 0 if it had no events yet.
+    row = connection.execute(
+        "SELECT last_event_id FROM onsite_session_checkpoints WHERE source = ?", (key,)
+    ).fetchone()
+    return int(row[0]) if row else None
+
+
+def _set_checkpoint(connection: sqlite3.Connection, key: str, last_id: int) -> None:
+    connection.execute(
+        """
+        INSERT INTO onsite_session_checkpoints (source, last_event_id) VALUES (?, ?)
+        ON CONFLICT (source) DO UPDATE SET last_event_id = excluded.last_event_id
+        """,
+        (key, last_id),
+    )
+
+
+def _close(
+    connection: sqlite3.Connection,
+    session_id: int,
+    status: str,
+    end_event_id: Optional[int],
+    end_ts: Optional[int],
+) -> None:
+    connection.execute(
+        "UPDATE onsite_sessions SET status = ?, end_event_id = ?, end_ts = ?"
+        " WHERE id = ?",
+        (status, end_event_id, end_ts, session_id),
+    )
+
+
+def _process_new_events(
+    connection: sqlite3.Connection,
+    key: str,
+    after_id: int,
+    policy: SessionPolicy,
+    now_ts: int,
+) -> int:
+    events = _load_events(connection, SOURCES[key], after_id)
+    open_sessions = {
+        row[0]: (row[1], row[2])
+        for row in connection.execute(
+            "SELECT person, id, limit_ts FROM onsite_sessions"
+            " WHERE source = ? AND status = ?",
+            (key, STATUS_OPEN),
+        )
+    }
+    insert_sql = f"""
+        INSERT INTO onsite_sessions (source, {", ".join(_SESSION_COLUMNS)})
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+    for event in events.itertuples(index=False):
+        ts = int(event.ts)
+        current = open_sessions.get(event.person)
+        if event.presence == CHECK_IN:
+            if current:
+                session_id, limit = current
+                if policy.double_checkin == "keep_first" and ts <= limit:
+                    continue
+                end_ts = _missing_end(limit, ts, policy)
+                _close(connection, session_id, STATUS_MISSING, None, end_ts)
+            limit = session_limit(ts, policy)
+            cursor = connection.execute(
+                insert_sql,
+                (
+                    key,
+                    event.person,
+                    event.label,
+                    event.group_name,
+                    int(event.id),
+                    ts,
+                    None,
+                    None,
+                    limit,
+                    ts,
+                    STATUS_OPEN,
+                ),
+            )
+            open_sessions[event.person] = (cursor.lastrowid, limit)
+            continue
+        open_sessions.pop(event.person, None)
+        if current and ts <= current[1]:
+            _close(connection, current[0], STATUS_CLOSED, int(event.id), ts)
+            continue
+        if current:
+            end_ts = _missing_end(current[1], ts, policy)
+            _close(connection, current[0], STATUS_MISSING, None, end_ts)
+        connection.execute(
+            insert_sql,
+            (
+                key,
+                event.person,
+                event.label,
+                event.group_name,
+                None,
+                None,
+                int(event.id),
+                ts,
+                None,
+                ts,
+                STATUS_ORPHAN,
+            ),
+        )
+
+    for session_id, limit in open_sessions.values():
+        if limit < now_ts:
+            end_ts = _missing_end(limit, None, policy)
+            _close(connection, session_id, STATUS_MISSING, None, end_ts)
+    if not events.empty:
+        _set_checkpoint(connection, key, int(events["id"].max()))
+    return len(events)
+
+
+def _run(connection: sqlite3.Connection, step) -> int:
+    if connection.in_transaction:
+        connection.commit()
+    # Take the write lock before reading the checkpoints so two app workers
+    # never fold in the same events twice.
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        processed = sum(step(key) for key in SOURCES)
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    return processed
+
+
+def update(
+    connection: sqlite3.Connection, policy: SessionPolicy, now_ts: Optional[int] = None
+) -> int:
+    """Fold events added since the last checkpoint into the sessions.
+
+    Returns the number of events processed.
+    """
+
+    now_ts = int(time.time()) if now_ts is None else now_ts
+
+    def step(key: str) -> int:
+        last_id = _checkpoint(connection, key)
+        if last_id is None:
+            return _rebuild_source(connection, key, policy, now_ts)
+        return _process_new_events(connection, key, last_id, policy, now_ts)
+
+    return _run(connection, step)
+
+
+def backfill(
+    connection: sqlite3.Connection, policy: SessionPolicy, now_ts: Optional[int] = None
+) -> int:
+    """Pair the history of every source that was never paired.
+
+    Runs inside the caller's transaction; see migration 16.
+    """
+
+    now_ts = int(time.time()) if now_ts is None else now_ts
+    return sum(
+        _rebuild_source(connection, key, policy, now_ts)
+        for key in SOURCES
+        if _checkpoint(connection, key) is None
+    )
+
+
+def rebuild(
+    connection: sqlite3.Connection, policy: SessionPolicy, now_ts: Optional[int] = None
+) -> int:
+    """Recompute all sessions from the raw events, e.g. after a policy change."""
+
+    now_ts = int(time.time()) if now_ts is None else now_ts
+    return _run(
+        connection, lambda key: _rebuild_source(connection, key, policy, now_ts)
+    )
+
+
+def hours_summary(
+    connection: sqlite3.Connection,
+    key: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    email_filter: str = "",
+    now_ts: Optional[int] = None,
+) -> dict:
+    """Summarize on-site hours per person and group for one source."""
+
+    now_ts = int(time.time()) if now_ts is None else now_ts
+    sql = f"SELECT {', '.join(_SUMMARY_COLUMNS)} FROM onsite_sessions WHERE source = ?"
+    params: list[object] = [key]
+    if email_filter:
+        sql += " AND person = ?"
+        params.append(email_filter.lower())
+    start_ts, end_ts = timeutil.local_date_bounds(start_date, end_date)
+    if start_ts is not None:
+        sql += " AND anchor_ts >= ?"
+        params.append(start_ts)
+    if end_ts is not None:
+        sql += " AND anchor_ts < ?"
+        params.append(end_ts)
+    frame = read_frame(connection, sql, params, _SUMMARY_COLUMNS)
+    is_open = frame["status"] == STATUS_OPEN
+    until = frame["end_ts"].astype("float64").where(
+        ~is_open, np.fmin(frame["limit_ts"].astype("float64"), now_ts)
+    )
+    seconds = (until - frame["start_ts"].astype("float64")).fillna(0).clip(lower=0)
+    frame["hours"] = seconds / 3600
+
+    def per(column: str) -> dict[str, float]:
+        totals = frame.groupby(column, sort=True)["hours"].sum()
+        return {name: round(float(hours), 1) for name, hours in totals.items()}
+
+    flagged = frame[frame["status"].isin([STATUS_MISSING, STATUS_ORPHAN])]
+    flagged = flagged.sort_values("anchor_ts", ascending=False).head(50)
+    return {
+        "sessions": int((frame["status"] != STATUS_ORPHAN).sum()),
+        "open": int(is_open.sum()),
+        "hours": round(float(frame["hours"].sum()), 1),
+        "per_person": per("label"),
+        "per_group": per("group_name"),
+        "flagged": [
+            {
+                "label": row.label,
+                "group": row.group_name,
+                "status": row.status,
+                "at": timeutil.format_local(
+                    datetime.fromtimestamp(int(row.anchor_ts), timeutil.SITE_TIMEZONE)
+                ),
+            }
+            for row in flagged.itertuples(index=False)
+        ],
+    }
@@ -0,0 +1,107 @@
+"""Typed booking timeslots.
+
+The booking form sends ``timeslot_raw`` such as ``2026-W41;2026-10-05;2026-10-11``
+and a free-text ``duration_weeks``. Both are parsed once at ingest into ISO
+week keys (``year * 100 + week``, e.g. ``202641``) and a week count, so
+queries compare integers instead of splitting strings.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import date, timedelta
+import re
+from typing import Iterator, Optional
+
+UNKNOWN_WEEK = "unknown"
+# Longer durations are treated as typos (e.g. a year in the duration field).
+MAX_WEEK_COUNT = 104
+
+_WEEK_PATTERN = re.compile(r"(\d{4})-?W(\d{1,2})", re.IGNORECASE)
+_DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+_NUMBER_PATTERN = re.compile(r"\d+")
+
+
+@dataclass(frozen=True)
+class Timeslot:
+    start_week: int
+    end_week: int
+    week_count: int
+
+
+def week_key(day: date) -> int:
+    """Return the ISO week key of ``day``."""
+
+    year, week, _ = day.isocalendar()
+    return year * 100 + week
+
+
+def week_monday(key: int) -> date:
+    return date.fromisocalendar(key // 100, key % 100, 1)
+
+
+def week_label(key: Optional[int]) -> str:
+    """Format a week key as ``2026-W41``; missing keys are ``unknown``."""
+
+    if not key:
+        return UNKNOWN_WEEK
+    return f"{key // 100}-W{key % 100:02d}"
+
+
+def week_ordinal(key: int) -> int:
+    """Return a consecutive week number, so week ranges are integer ranges."""
+
+    return (week_monday(key).toordinal() - 1) // 7
+
+
+def week_from_ordinal(ordinal: int) -> int:
+    return week_key(date.fromordinal(ordinal * 7 + 1))
+
+
+def add_weeks(key: int, weeks: int) -> int:
+    return week_key(week_monday(key) + timedelta(weeks=weeks))
+
+
+def iter_weeks(start_week: int, end_week: int) -> Iterator[int]:
+    """Yield every week key from ``start_week`` to ``end_week`` inclusive."""
+
+    for ordinal in range(week_ordinal(start_week), week_ordinal(end_week) + 1):
+        yield week_from_ordinal(ordinal)
+
+
+def parse_week(text: str) -> Optional[int]:
+    """Return the week key of the first ``2026-W41`` or ISO date in ``text``."""
+
+    match = _WEEK_PATTERN.search(text)
+    if match:
+        year, week = int(match.group(1)), int(match.group(2))
+        try:
+            return week_key(date.fromisocalendar(year, week, 1))
+        except ValueError:
+            return None
+    match = _DATE_PATTERN.search(text)
+    if match:
+        try:
+            return week_key(date.fromisoformat(match.group(0)))
+        except ValueError:
+            return None
+    return None
+
+
+def parse_duration(duration_weeks: str) -> int:
+    """Read the first number of ``duration_weeks``; anything else is one week."""
+
+    match = _NUMBER_PATTERN.search(duration_weeks or "")
+    if not match:
+        return 1
+    return min(max(int(match.group(0)), 1), MAX_WEEK_COUNT)
+
+
+def parse_timeslot(timeslot_raw: str, duration_weeks: str) -> Optional[Timeslot]:
+    """Parse the form fields; returns None if no start week can be found."""
+
+    start_week = parse_week(timeslot_raw or "")
+    if start_week is None:
+        return None
+    week_count = parse_duration(duration_weeks)
+    return Timeslot(start_week, add_weeks(start_week, week_count - 1), week_count)
@@ -0,0 +1,73 @@
+"""Time zone helpers for stored timestamps.
+
+``created_at`` columns hold display strings: UTC ``CURRENT_TIMESTAMP`` for
+registrations, users and bookings, and Europe/Berlin local time for check-in
+activity. ``created_ts`` columns hold the same instant as UTC epoch seconds so
+range filters compare integers on an index.
+"""
+
+from __future__ import annotations
+
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+SITE_TIMEZONE = ZoneInfo("Europe/Berlin")
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def now_local() -> datetime:
+    """Return the current time in the site time zone."""
+
+    return datetime.now(SITE_TIMEZONE)
+
+
+def format_local(moment: datetime) -> str:
+    """Format an aware datetime as a site-local ``created_at`` string."""
+
+    return moment.astimezone(SITE_TIMEZONE).strftime(TIMESTAMP_FORMAT)
+
+
+def epoch_seconds(moment: datetime) -> int:
+    return int(moment.timestamp())
+
+
+def local_text_to_epoch(text: str) -> Optional[int]:
+    """Convert a site-local ``YYYY-MM-DD HH:MM:SS`` string to epoch seconds."""
+
+    try:
+        parsed = datetime.fromisoformat(str(text).strip())
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=SITE_TIMEZONE)
+    return epoch_seconds(parsed)
+
+
+def parse_date(value: Optional[str]) -> Optional[date]:
+    """Parse an ISO ``YYYY-MM-DD`` form value; invalid input yields None."""
+
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value.strip())
+    except ValueError:
+        return None
+
+
+def local_day_start(day: date) -> int:
+    """Return the epoch seconds of local midnight at the start of ``day``."""
+
+    return epoch_seconds(datetime.combine(day, time.min, tzinfo=SITE_TIMEZONE))
+
+
+def local_date_bounds(
+    start_date: Optional[str], end_date: Optional[str]
+) -> tuple[Optional[int], Optional[int]]:
+    """Return ``[start, end)`` epoch bounds for an inclusive local date range."""
+
+    start = parse_date(start_date)
+    end = parse_date(end_date)
+    start_ts = local_day_start(start) if start else None
+    end_ts = local_day_start(end + timedelta(days=1)) if end else None
+    return start_ts, end_ts
@@ -0,0 +1,66 @@
+"""Periodic WAL checkpoints for the shared SQLite database."""
+
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+from typing import Optional
+
+from site_coordination import db
+from site_coordination.config import DatabaseConfig, load_database_config
+
+
+class WalCheckpointer:
+    """Background loop that checkpoints the write-ahead log."""
+
+    def __init__(self, config: DatabaseConfig, logger: logging.Logger) -> None:
+        self._config = config
+        self._logger = logger
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def _run(self) -> None:
+        interval = self._config.profile.checkpoint_interval_seconds
+        while not self._stop_event.wait(interval):
+            self._checkpoint_once()
+
+    def _checkpoint_once(self) -> None:
+        if not self._config.path.exists():
+            return
+        try:
+            connection = db.connect(self._config.path, profile=self._config.profile)
+            try:
+                busy, log_frames, checkpointed = db.checkpoint_wal(
+                    connection, self._config.profile.checkpoint_mode
+                )
+            finally:
+                connection.close()
+        except sqlite3.Error as exc:
+            self._logger.warning("WAL checkpoint failed: %s", exc)
+            return
+        if busy:
+            self._logger.info(
+                "WAL checkpoint incomplete (%s/%s frames); retrying next interval.",
+                checkpointed,
+                log_frames,
+            )
+
+
+def start_wal_checkpoint(logger: logging.Logger) -> Optional[WalCheckpointer]:
+    """Start the WAL checkpoint loop if WAL mode and an interval are configured."""
+
+    config = load_database_config()
+    profile = config.profile
+    if profile.journal_mode != "WAL" or profile.checkpoint_interval_seconds <= 0:
+        logger.info("WAL checkpoint task disabled.")
+        return None
+    checkpointer = WalCheckpointer(config=config, logger=logger)
+    checkpointer.start()
+    return checkpointer
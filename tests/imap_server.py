@@ -0,0 +1,267 @@
+"""A minimal local IMAP4rev1 server for the watcher tests.
+
+Supports what both fetch modes need: LOGIN, SELECT, STATUS, UID SEARCH,
+UID FETCH of ``BODY.PEEK[]``, ``BODYSTRUCTURE``, ``BODY.PEEK[HEADER.FIELDS
+(...)]`` and ``BODY.PEEK[n]`` sections, UID STORE, NOOP, IDLE and LOGOUT. New
+mail is announced with ``EXISTS`` in IDLE; outside IDLE the announcement is
+sent with the next command response, as real servers do.
+"""
+
+from email import message_from_bytes
+from email.policy import compat32
+import re
+import socketserver
+import threading
+
+_SECTION = re.compile(r"BODY\.PEEK\[([^\]]*)\]", re.IGNORECASE)
+
+
+class Mailbox:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages = []
+        self.next_uid = 1
+        self.sessions = set()
+        # Command name -> message delivered while that command is handled.
+        self.deliver_on = {}
+        # The item list of every UID FETCH, to check what was downloaded.
+        self.fetches = []
+
+    def add(self, data):
+        with self.lock:
+            self.messages.append({"uid": self.next_uid, "flags": set(), "data": data})
+            self.next_uid += 1
+            count = len(self.messages)
+            sessions = list(self.sessions)
+        for session in sessions:
+            session.announce(count)
+
+
+def _uid_range(text, maximum):
+    result = set()
+    for part in text.split(","):
+        first, _, last = part.partition(":")
+        low = maximum if first == "*" else int(first)
+        high = low if not last else maximum if last == "*" else int(last)
+        result.update(range(min(low, high), max(low, high) + 1))
+    return result
+
+
+def _string(value):
+    if value is None:
+        return "NIL"
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _params(pairs):
+    if not pairs:
+        return "NIL"
+    return "(" + " ".join(f"{_string(key)} {_string(value)}" for key, value in pairs) + ")"
+
+
+def _body_structure(part):
+    """Render the ``BODYSTRUCTURE`` of an ``email.message.Message``."""
+
+    params = [(key.upper(), value) for key, value in part.get_params()[1:]]
+    if part.is_multipart():
+        children = "".join(_body_structure(child) for child in part.get_payload())
+        return f"({children} {_string(part.get_content_subtype().upper())} {_params(params)} NIL NIL)"
+    payload = part.get_payload().encode("utf-8", "surrogateescape")
+    fields = [
+        _string(part.get_content_maintype().upper()),
+        _string(part.get_content_subtype().upper()),
+        _params(params),
+        "NIL",
+        "NIL",
+        _string((part.get("Content-Transfer-Encoding") or "7bit").upper()),
+        str(len(payload)),
+    ]
+    if part.get_content_maintype() == "text":
+        fields.append(str(payload.count(b"\n")))
+    disposition = part.get_content_disposition()
+    filename = part.get_param("filename", header="content-disposition")
+    fields += [
+        "NIL",
+        f"({_string(disposition.upper())} {_params([('FILENAME', filename)] if filename else [])})"
+        if disposition
+        else "NIL",
+        "NIL",
+    ]
+    return "(" + " ".join(fields) + ")"
+
+
+def _section(message, spec):
+    """Return the raw bytes of a ``BODY[spec]`` section."""
+
+    if spec == "":
+        return message.as_bytes()
+    if spec.upper().startswith("HEADER.FIELDS"):
+        names = spec[spec.index("(") + 1 : spec.rindex(")")].upper().split()
+        lines = [
+            f"{key}: {value}\r\n"
+            for key, value in message.items()
+            if key.upper() in names
+        ]
+        return ("".join(lines) + "\r\n").encode("utf-8")
+    part = message
+    for number in spec.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(number) - 1]
+        elif number != "1":
+            return b""
+    return part.get_payload().encode("utf-8", "surrogateescape")
+
+
+def _literal(name, data):
+    return f"{name} {{{len(data)}}}\r\n".encode() + data
+
+
+class _Session(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+        self.idling = False
+        self.pending = []
+
+    def write(self, data):
+        with self.write_lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+    def announce(self, count):
+        line = f"* {count} EXISTS\r\n".encode()
+        with self.write_lock:
+            if self.idling:
+                self.wfile.write(line)
+                self.wfile.flush()
+            else:
+                self.pending.append(line)
+
+    def flush_pending(self):
+        with self.write_lock:
+            lines, self.pending = self.pending, []
+            for line in lines:
+                self.wfile.write(line)
+            self.wfile.flush()
+
+    def deliver(self, command):
+        data = self.server.mailbox.deliver_on.pop(command, None)
+        if data is not None:
+            self.server.mailbox.add(data)
+
+    def handle(self):
+        mailbox = self.server.mailbox
+        self.write(b"* OK [CAPABILITY IMAP4rev1 IDLE] ready\r\n")
+        with mailbox.lock:
+            mailbox.sessions.add(self)
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                tag, _, rest = line.decode().rstrip("\r\n").partition(" ")
+                command, _, args = rest.partition(" ")
+                command = command.upper()
+                by_uid = command == "UID"
+                if by_uid:
+                    command, _, args = args.partition(" ")
+                    command = command.upper()
+                self.deliver(command)
+                if command == "IDLE":
+                    self.idle(tag)
+                    continue
+                body = self.respond(command, args, by_uid)
+                if body is None:
+                    self.write(f"{tag} BAD unknown command\r\n".encode())
+                    continue
+                self.flush_pending()
+                self.write(body + f"{tag} OK done\r\n".encode())
+                if command == "LOGOUT":
+                    return
+        finally:
+            with mailbox.lock:
+                mailbox.sessions.discard(self)
+
+    def idle(self, tag):
+        self.flush_pending()
+        with self.write_lock:
+            self.idling = True
+            self.wfile.write(b"+ idling\r\n")
+            self.wfile.flush()
+        self.rfile.readline()
+        self.idling = False
+        self.deliver("DONE")
+        self.flush_pending()
+        self.write(f"{tag} OK idle done\r\n".encode())
+
+    def respond(self, command, args, by_uid):
+        mailbox = self.server.mailbox
+        with mailbox.lock:
+            messages = list(mailbox.messages)
+            next_uid = mailbox.next_uid
+        if command in ("CAPABILITY",):
+            return b"* CAPABILITY IMAP4rev1 IDLE\r\n"
+        if command in ("LOGIN", "NOOP", "LOGOUT"):
+            return b""
+        if command == "SELECT":
+            return (
+                f"* {len(messages)} EXISTS\r\n* OK [UIDVALIDITY 1] ok\r\n"
+                f"* OK [UIDNEXT {next_uid}] ok\r\n"
+            ).encode()
+        if command == "STATUS":
+            name = args.split(" ")[0]
+            return f"* STATUS {name} (UIDVALIDITY 1 UIDNEXT {next_uid})\r\n".encode()
+        if command == "SEARCH" and by_uid:
+            criteria = args.upper()
+            after = re.search(r"UID (\d+):\*", criteria)
+            hits = [
+                str(message["uid"])
+                for message in messages
+                if not ("UNSEEN" in criteria and "\\Seen" in message["flags"])
+                and not (after and message["uid"] < int(after.group(1)))
+            ]
+            return f"* SEARCH {' '.join(hits)}\r\n".encode()
+        if command in ("FETCH", "STORE") and by_uid:
+            uid_text, _, items = args.partition(" ")
+            if command == "FETCH":
+                mailbox.fetches.append(items)
+            wanted = _uid_range(uid_text, messages[-1]["uid"] if messages else 0)
+            response = b""
+            for seq, message in enumerate(messages, 1):
+                if message["uid"] not in wanted:
+                    continue
+                if command == "STORE":
+                    message["flags"].add("\\Seen")
+                    continue
+                response += (
+                    f"* {seq} FETCH (".encode()
+                    + self.fetch_items(message, items)
+                    + b")\r\n"
+                )
+            return response
+        return None
+
+
+    def fetch_items(self, message, items):
+        parsed = message_from_bytes(message["data"], policy=compat32)
+        fetched = [f"UID {message['uid']}".encode()]
+        if "BODYSTRUCTURE" in items.upper():
+            fetched.append(b"BODYSTRUCTURE " + _body_structure(parsed).encode())
+        for spec in _SECTION.findall(items):
+            data = message["data"] if spec == "" else _section(parsed, spec)
+            fetched.append(_literal(f"BODY[{spec}]", data))
+        return b" ".join(fetched)
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start(mailbox):
+    """Serve ``mailbox`` on a free local port; call ``shutdown()`` when done."""
+
+    server = _Server(("127.0.0.1", 0), _Session)
+    server.mailbox = mailbox
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
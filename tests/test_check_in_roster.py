@@ -0,0 +1,35 @@
+import pytest
+
+from site_coordination import check_in_rcs_app, db
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    path = tmp_path / "test.sqlite"
+    connection = db.connect(path)
+    db.init_db(connection)
+    connection.close()
+    monkeypatch.setenv("SITE_COORDINATION_DB", str(path))
+    monkeypatch.setenv("SITE_COORDINATION_SESSION_UPDATE_INTERVAL_SECONDS", "0")
+    monkeypatch.setenv("SITE_COORDINATION_DB_CHECKPOINT_INTERVAL_SECONDS", "0")
+    monkeypatch.setenv("SITE_COORDINATION_ROSTER_TOKEN", "s3cret")
+    app = check_in_rcs_app.create_app()
+    with app.app_context():
+        check_in_rcs_app._insert_activity(
+            "anna@example.com", "Anna", "Berg", "P1", "check-in"
+        )
+    return app.test_client()
+
+
+def test_roster_needs_the_token(client):
+    assert client.get("/roster").status_code == 404
+    assert client.get("/roster.json?token=wrong").status_code == 404
+    assert client.get("/roster?token=s3cret").status_code == 200
+
+
+def test_roster_leaves_out_email_addresses(client):
+    response = client.get("/roster.json", headers={"X-Roster-Token": "s3cret"})
+
+    assert response.json["count"] == 1
+    assert "anna@example.com" not in response.get_data(as_text=True)
+    assert "anna@example.com" not in client.get("/roster?token=s3cret").get_data(as_text=True)
@@ -0,0 +1,86 @@
+from email.message import EmailMessage
+
+import pytest
+
+import imap_server
+from site_coordination import db, ingest
+from site_coordination.config import ImapConfig
+from site_coordination.imap_watcher import FETCH_TEXT, connect, fetch_chunks
+
+FORM = (
+    "BEGIN_ACCESS_REQUEST_V1\n"
+    "email=juergen@example.com\n"
+    "first_name=Jürgen\nlast_name=Weiß\naffiliation=ACME\nproject=P1\nphone=1\n"
+    "END_ACCESS_REQUEST_V1\n"
+)
+
+
+def _form_with_attachment():
+    # multipart/mixed: multipart/alternative (text/plain, text/html), PDF.
+    message = EmailMessage()
+    message["Subject"] = "Registrierung Jürgen"
+    message["Message-ID"] = "<form@example.com>"
+    message.set_content(FORM, cte="quoted-printable")
+    message.add_alternative("<p>Formular</p>", subtype="html")
+    message.add_attachment(
+        b"%PDF-1.4 " + bytes(range(256)) * 40,
+        maintype="application",
+        subtype="pdf",
+        filename="form.pdf",
+    )
+    return message.as_bytes()
+
+
+def _pdf_only():
+    message = EmailMessage()
+    message["Subject"] = "Scan"
+    message["Message-ID"] = "<scan@example.com>"
+    message.set_content(b"%PDF-1.4", maintype="application", subtype="pdf", filename="a.pdf")
+    return message.as_bytes()
+
+
+@pytest.fixture
+def client():
+    box = imap_server.Mailbox()
+    server = imap_server.start(box)
+    config = ImapConfig(
+        host="127.0.0.1",
+        user="user",
+        password="secret",
+        port=server.server_address[1],
+        use_ssl=False,
+    )
+    imap = connect(config)
+    imap.mailbox = box
+    yield imap
+    imap.logout()
+    server.shutdown()
+    server.server_close()
+
+
+def test_text_mode_fetches_only_the_nested_text_part(client):
+    client.mailbox.add(_form_with_attachment())
+
+    [[message]] = list(fetch_chunks(client, [1], 10, FETCH_TEXT))
+
+    assert message.subject == "Registrierung Jürgen"
+    assert message.message_id == "<form@example.com>"
+    assert "first_name=Jürgen\nlast_name=Weiß" in message.body
+    assert client.mailbox.fetches[-1] == "(UID BODY.PEEK[1.1])"
+    assert not any("BODY.PEEK[]" in items for items in client.mailbox.fetches)
+
+
+def test_text_mode_ingest_falls_back_for_messages_without_text(tmp_path, client):
+    client.mailbox.add(_pdf_only())
+    client.mailbox.add(_form_with_attachment())
+    connection = db.connect(tmp_path / "test.sqlite")
+    db.init_db(connection)
+    counters = ingest.StageCounters()
+
+    items = list(ingest.ingest_mailbox(client, connection, "INBOX", counters))
+
+    assert [item.message.uid for item in items] == [1, 2]
+    assert items[0].error
+    row = connection.execute("SELECT first_name, last_name FROM registrations").fetchone()
+    assert tuple(row) == ("Jürgen", "Weiß")
+    assert "(UID BODY.PEEK[])" in client.mailbox.fetches
@@ -0,0 +1,124 @@
+from email.message import EmailMessage
+import logging
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import imap_server
+from site_coordination import db, ingest
+from site_coordination.config import ImapConfig
+from site_coordination.imap_watcher import FETCH_FULL, ImapWatcher, SyncStats
+
+
+def _form_email(number):
+    message = EmailMessage()
+    message["Subject"] = f"Registration {number}"
+    message.set_content(
+        "BEGIN_ACCESS_REQUEST_V1\n"
+        f"email=user{number}@example.com\n"
+        "first_name=Anna\nlast_name=Berg\naffiliation=ACME\nproject=P1\nphone=1\n"
+        "END_ACCESS_REQUEST_V1\n"
+    )
+    return message.as_bytes()
+
+
+@pytest.fixture
+def mailbox():
+    box = imap_server.Mailbox()
+    server = imap_server.start(box)
+    box.port = server.server_address[1]
+    yield box
+    server.shutdown()
+    server.server_close()
+
+
+def _watch_until_stored(tmp_path, mailbox, expected):
+    """Run the watcher until ``expected`` registrations are stored or 10s pass."""
+
+    connection = db.connect(tmp_path / "test.sqlite", check_same_thread=False)
+    db.init_db(connection)
+    config = ImapConfig(
+        host="127.0.0.1",
+        user="user",
+        password="secret",
+        port=mailbox.port,
+        use_ssl=False,
+        idle_timeout_seconds=1,
+    )
+
+    def sync(client):
+        counters = ingest.StageCounters()
+        started = time.perf_counter()
+        for _ in ingest.ingest_mailbox(client, connection, "INBOX", counters, mode=FETCH_FULL):
+            pass
+        return SyncStats(counters.fetched, time.perf_counter() - started)
+
+    def stored():
+        return connection.execute("SELECT COUNT(*) FROM registrations").fetchone()[0]
+
+    watcher = ImapWatcher(config, sync, logging.getLogger("test"))
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    deadline = time.monotonic() + 10
+    try:
+        while stored() < expected and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        watcher.stop()
+        thread.join()
+    return stored()
+
+
+def test_mail_delivered_during_processing_is_synced(tmp_path, mailbox):
+    # The EXISTS comes back with the UID STORE response, so IDLE never sees it.
+    mailbox.add(_form_email(1))
+    mailbox.deliver_on["STORE"] = _form_email(2)
+
+    assert _watch_until_stored(tmp_path, mailbox, 2) == 2
+
+
+def test_mail_delivered_as_idle_times_out(tmp_path, mailbox):
+    mailbox.add(_form_email(1))
+    mailbox.deliver_on["DONE"] = _form_email(2)
+
+    assert _watch_until_stored(tmp_path, mailbox, 2) == 2
+
+
+def test_mail_announced_before_idle_continuation(tmp_path, mailbox):
+    mailbox.add(_form_email(1))
+    mailbox.deliver_on["IDLE"] = _form_email(2)
+
+    assert _watch_until_stored(tmp_path, mailbox, 2) == 2
+
+
+def test_database_errors_do_not_end_the_watcher(mailbox):
+    config = ImapConfig(
+        host="127.0.0.1",
+        user="user",
+        password="secret",
+        port=mailbox.port,
+        use_ssl=False,
+        idle_timeout_seconds=1,
+    )
+    calls = []
+
+    def sync(client):
+        calls.append(1)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return SyncStats(0, 0.0)
+
+    watcher = ImapWatcher(config, sync, logging.getLogger("test"))
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    deadline = time.monotonic() + 10
+    try:
+        while len(calls) < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        watcher.stop()
+        thread.join()
+
+    assert len(calls) >= 2
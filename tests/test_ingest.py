@@ -0,0 +1,120 @@
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+import time
+
+import imap_server
+from site_coordination import db, ingest
+from site_coordination.config import ImapConfig, IngestConfig
+from site_coordination.email_parser import AccessRequest
+from site_coordination.imap_watcher import FETCH_FULL, InboxMessage, connect
+
+
+def _item(number):
+    request = AccessRequest(
+        email=f"user{number}@example.com",
+        first_name="Anna",
+        last_name="Berg",
+        affiliation="ACME",
+        project="P1",
+        phone="1",
+        activity="",
+    )
+    message = InboxMessage(
+        subject="Registration", body="", uid=number, message_id=f"<{number}@example.com>"
+    )
+    return ingest.IngestItem(message=message, request=request)
+
+
+def _form_email():
+    message = EmailMessage()
+    message["Subject"] = "Registration"
+    message["Message-ID"] = "<registration@example.com>"
+    message.set_content(
+        "BEGIN_ACCESS_REQUEST_V1\n"
+        "email=anna@example.com\n"
+        "first_name=Anna\nlast_name=Berg\naffiliation=ACME\nproject=P1\nphone=1\n"
+        "END_ACCESS_REQUEST_V1\n"
+    )
+    return message.as_bytes()
+
+
+def test_open_batch_is_committed_while_the_source_blocks(tmp_path):
+    path = tmp_path / "test.sqlite"
+    connection = db.connect(path, check_same_thread=False)
+    db.init_db(connection)
+    reader = db.connect(path, check_same_thread=False)
+    seen_while_blocked = []
+
+    def slow_source():
+        yield _item(1)
+        # Far longer than batch_ms; the first registration must not wait for us.
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            count = reader.execute("SELECT COUNT(*) FROM registrations").fetchone()[0]
+            if count:
+                break
+            time.sleep(0.02)
+        seen_while_blocked.append(count)
+        yield _item(2)
+
+    with ThreadPoolExecutor(1) as executor:
+        bulk = ingest.BulkIngest(executor, IngestConfig(workers=1, batch_size=100, batch_ms=200))
+        counters = ingest.StageCounters()
+        items = list(
+            ingest.store(
+                connection,
+                bulk.feed_store(slow_source()),
+                None,
+                counters,
+                bulk.config.batch_size,
+                bulk.batch_seconds,
+            )
+        )
+
+    assert seen_while_blocked == [1]
+    assert len(items) == 2
+    assert counters.stored == 2
+
+
+def test_bulk_replay_of_a_known_message_is_not_stored_again(tmp_path):
+    box = imap_server.Mailbox()
+    server = imap_server.start(box)
+    config = ImapConfig(
+        host="127.0.0.1",
+        user="user",
+        password="secret",
+        port=server.server_address[1],
+        use_ssl=False,
+    )
+    connection = db.connect(tmp_path / "test.sqlite")
+    db.init_db(connection)
+
+    def run():
+        counters = ingest.StageCounters()
+        client = connect(config)
+        try:
+            with ThreadPoolExecutor(2) as executor:
+                bulk = ingest.BulkIngest(executor, IngestConfig(workers=2))
+                for _ in ingest.ingest_mailbox(
+                    client, connection, "INBOX", counters, mode=FETCH_FULL, bulk=bulk
+                ):
+                    pass
+        finally:
+            client.logout()
+        return counters
+
+    try:
+        box.add(_form_email())
+        run()
+        connection.execute("UPDATE registrations SET status = 'registriert'")
+        connection.commit()
+        # The same email again under a new UID, e.g. moved back into the inbox.
+        box.add(_form_email())
+        counters = run()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert (counters.stored, counters.duplicates) == (0, 1)
+    status = connection.execute("SELECT status FROM registrations").fetchone()[0]
+    assert status == "registriert"
@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from site_coordination import db, ingest
+from site_coordination.config import IngestConfig
+from site_coordination.imap_watcher import parse_message
+from site_coordination.mail_archive import iter_directory
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def _ingest(tmp_path, directory):
+    connection = db.connect(tmp_path / "test.sqlite")
+    db.init_db(connection)
+    counters = ingest.StageCounters()
+    with ThreadPoolExecutor(2) as executor:
+        config = IngestConfig(workers=2, batch_size=10, batch_ms=250)
+        bulk = ingest.BulkIngest(executor, config)
+        items = list(
+            ingest.ingest_archive(connection, iter_directory(directory), counters, bulk)
+        )
+    return connection, counters, items
+
+
+def test_message_without_text_part_has_empty_body():
+    message = parse_message((FIXTURES / "pdf_only.eml").read_bytes())
+
+    assert message.body == ""
+
+
+def test_unknown_charset_is_decoded_as_utf8():
+    message = parse_message((FIXTURES / "unknown_charset.eml").read_bytes())
+
+    assert "email=charset@example.com" in message.body
+
+
+def test_bad_files_are_reported_and_the_run_continues(tmp_path):
+    connection, counters, items = _ingest(tmp_path, FIXTURES)
+
+    errors = {Path(item.source).name: item.error for item in items if item.error}
+    assert errors == {"pdf_only.eml": "Unsupported email format."}
+    emails = {row[0] for row in connection.execute("SELECT email FROM registrations")}
+    assert emails == {"charset@example.com", "valid@example.com"}
+    assert counters.fetched == 3
+    assert counters.stored == 2
+
+
+def test_parse_failure_becomes_an_error_for_that_message(tmp_path, monkeypatch):
+    (tmp_path / "a.eml").write_bytes(b"Subject: broken\r\n\r\nbody\r\n")
+    (tmp_path / "b.eml").write_bytes((FIXTURES / "valid.eml").read_bytes())
+    real_parse = ingest.parse_message
+
+    def parse(data):
+        if b"broken" in data:
+            raise ValueError("broken header")
+        return real_parse(data)
+
+    monkeypatch.setattr(ingest, "parse_message", parse)
+
+    connection, counters, items = _ingest(tmp_path, tmp_path)
+
+    errors = {Path(item.source).name: item.error for item in items if item.error}
+    assert errors == {"a.eml": "Unreadable message: broken header"}
+    assert counters.stored == 1
+
+
+def test_reimport_skips_known_messages_after_review(tmp_path):
+    archive = tmp_path / "archive"
+    archive.mkdir()
+    (archive / "valid.eml").write_bytes((FIXTURES / "valid.eml").read_bytes())
+    connection, _, _ = _ingest(tmp_path, archive)
+    connection.execute("UPDATE registrations SET status = 'registriert'")
+    connection.commit()
+    connection.close()
+
+    connection, counters, _ = _ingest(tmp_path, archive)
+
+    assert (counters.stored, counters.duplicates) == (0, 1)
+    status = connection.execute("SELECT status FROM registrations").fetchone()[0]
+    assert status == "registriert"
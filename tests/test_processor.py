@@ -0,0 +1,74 @@
+from site_coordination import db
+from site_coordination.email_parser import AccessRequest, BookingRequest
+from site_coordination.processor import process_request
+
+REGISTRATION = AccessRequest(
+    first_name="Anna",
+    last_name="Berg",
+    email="anna@example.com",
+    affiliation="ACME",
+    project="P1",
+    phone="1",
+    activity="",
+)
+BOOKING = BookingRequest(
+    first_name="Anna",
+    last_name="Berg",
+    email="anna@example.com",
+    project="P1",
+    timeslot_raw="KW 10",
+    duration_weeks="1",
+    indoor_laptop_workspace="1",
+    warehouse_storage_space="0",
+    outdoor="no",
+    outdoor_type="",
+    equipment="",
+)
+
+
+def _connect(tmp_path):
+    connection = db.connect(tmp_path / "test.sqlite")
+    db.init_db(connection)
+    return connection
+
+
+def test_resubmission_is_a_duplicate_while_pending(tmp_path):
+    connection = _connect(tmp_path)
+
+    first = process_request(connection, BOOKING, "<1@example.com>")
+    second = process_request(connection, BOOKING, "<2@example.com>")
+
+    assert not first.duplicate
+    assert second.duplicate
+    assert connection.execute("SELECT COUNT(*) FROM bookings").fetchone()[0] == 1
+
+
+def test_resubmission_after_denial_is_stored(tmp_path):
+    connection = _connect(tmp_path)
+    process_request(connection, BOOKING, "<1@example.com>")
+    process_request(connection, REGISTRATION, "<2@example.com>")
+    connection.execute("UPDATE bookings SET status = 'denied'")
+    connection.execute("UPDATE registrations SET status = 'denied'")
+    connection.commit()
+
+    booking = process_request(connection, BOOKING, "<3@example.com>")
+    registration = process_request(connection, REGISTRATION, "<4@example.com>")
+
+    assert not booking.duplicate
+    assert not registration.duplicate
+    assert connection.execute("SELECT COUNT(*) FROM bookings").fetchone()[0] == 2
+    assert connection.execute("SELECT status FROM registrations").fetchone()[0] == "open"
+
+
+def test_manual_entries_without_message_id_follow_the_latest_record(tmp_path):
+    connection = _connect(tmp_path)
+    process_request(connection, BOOKING)
+    connection.execute("UPDATE bookings SET status = 'denied'")
+    connection.commit()
+
+    stored = process_request(connection, BOOKING)
+    again = process_request(connection, BOOKING)
+
+    assert not stored.duplicate
+    assert again.duplicate
+    assert again.record_key == stored.record_key
@@ -0,0 +1,54 @@
+from site_coordination import db, pagination, search
+
+
+def test_search_pages_cover_every_match_once(tmp_path):
+    connection = db.connect(tmp_path / "test.sqlite")
+    db.init_db(connection)
+    for number in range(7):
+        connection.execute(
+            "INSERT INTO registrations"
+            " (email, first_name, last_name, affiliation, project, phone, activity, status)"
+            " VALUES (?, 'Anna', 'Berg', 'ACME', 'P1', '1', '', 'open')",
+            (f"user{number}@example.com",),
+        )
+    connection.commit()
+    listing = search.search_listing("registrations", "berg")
+
+    emails = []
+    cursor = None
+    while True:
+        page = pagination.fetch_page(connection, listing, cursor, 3, 7)
+        emails += [row["email"] for row in page.rows]
+        # A write between page loads must not move rows across the cursor.
+        connection.execute(
+            "UPDATE registrations SET last_name = 'Berg Berg' WHERE email = ?",
+            (emails[-1],),
+        )
+        connection.commit()
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+
+    assert sorted(emails) == sorted(f"user{number}@example.com" for number in range(7))
+
+
+def test_ranked_search_puts_the_best_match_first(tmp_path):
+    connection = db.connect(tmp_path / "test.sqlite")
+    db.init_db(connection)
+    for email, last_name, project in (
+        ("strong@example.com", "Berg", "Berg"),
+        ("weak@example.com", "Berg", "P1"),
+        ("other@example.com", "Lund", "P1"),
+    ):
+        connection.execute(
+            "INSERT INTO registrations"
+            " (email, first_name, last_name, affiliation, project, phone, activity, status)"
+            " VALUES (?, 'Anna', ?, 'ACME', ?, '1', '', 'open')",
+            (email, last_name, project),
+        )
+    connection.commit()
+    listing = search.search_listing("registrations", "berg", ranked=True)
+
+    page = pagination.fetch_page(connection, listing, None, 10, 2)
+
+    assert [row["email"] for row in page.rows] == ["strong@example.com", "weak@example.com"]
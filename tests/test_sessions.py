@@ -0,0 +1,73 @@
+import logging
+import sqlite3
+
+from site_coordination import db, sessions
+from site_coordination.config import DatabaseConfig, SessionPolicy
+from site_coordination.session_updater import SessionUpdater
+
+POLICY = SessionPolicy()
+
+
+def _connect(path):
+    connection = db.connect(path)
+    db.init_db(connection)
+    return connection
+
+
+def _check_in(connection, email, ts):
+    connection.execute(
+        "INSERT INTO activity_research"
+        " (email, first_name, last_name, project, presence, created_at, created_ts)"
+        " VALUES (?, 'Anna', 'Berg', 'P1', 'check-in', '2024-01-01 08:00:00', ?)",
+        (email, ts),
+    )
+    connection.commit()
+
+
+def _rebuilds(monkeypatch):
+    calls = []
+    rebuild_source = sessions._rebuild_source
+
+    def counting(connection, key, policy, now_ts):
+        calls.append(key)
+        return rebuild_source(connection, key, policy, now_ts)
+
+    monkeypatch.setattr(sessions, "_rebuild_source", counting)
+    return calls
+
+
+def test_sources_without_events_are_not_rebuilt_on_every_update(tmp_path, monkeypatch):
+    connection = _connect(tmp_path / "test.sqlite")
+    calls = _rebuilds(monkeypatch)
+
+    sessions.update(connection, POLICY)
+    _check_in(connection, "anna@example.com", 1704096000)
+    sessions.update(connection, POLICY)
+
+    assert calls == []
+    assert connection.execute("SELECT COUNT(*) FROM onsite_sessions").fetchone()[0] == 1
+
+
+def test_backfill_pairs_history_of_unpaired_sources(tmp_path):
+    connection = _connect(tmp_path / "test.sqlite")
+    _check_in(connection, "anna@example.com", 1704096000)
+    connection.execute("DELETE FROM onsite_session_checkpoints WHERE source = 'research'")
+
+    assert sessions.backfill(connection, POLICY) == 1
+    assert connection.execute("SELECT COUNT(*) FROM onsite_sessions").fetchone()[0] == 1
+
+
+def test_updater_logs_database_errors(tmp_path, monkeypatch, caplog):
+    path = tmp_path / "test.sqlite"
+    _connect(path).close()
+
+    def locked(connection, policy):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(sessions, "update", locked)
+    updater = SessionUpdater(DatabaseConfig(path=path), POLICY, logging.getLogger("test"))
+
+    with caplog.at_level(logging.WARNING):
+        updater.update_once()
+
+    assert "database is locked" in caplog.text